@@ -1,18 +1,36 @@
 import os
-import json
-import shutil
-import requests
-import random
-import traceback
-import subprocess
+import re
+import asyncio
+import uuid
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 from dotenv import load_dotenv
-import boto3
-import re
+import httpx
+from botocore.exceptions import ClientError
+from app.services import http_pool
+from app.services.job_events import hub as job_hub
+from app.services.job_cache import JobResultCache
+from app.services.gpu_scheduler import GpuCluster, SchedulerFull
+from app.services.comfy_pool import ComfyPool
+from app.services.artifacts import ArtifactStore, bridge_to_input, fetch_output
+from app.services.database import RecordWriter, open_database
+from app.services.metrics import metrics, trace_requests
+from app.services.slicer import SliceScheduler, SlicerBusy, SliceError
+from app.services.slice_cache import SliceCache
+from app.services.gcode_meta import read_gcode_stats
+from app.services.gcode_pack import iter_body, to_binary_gcode
+from app.services.pricing import price_for_weight
+from app.services.mesh import PRINT_ENVELOPE_MM, MeshError, Pedestal, estimate_quote, load_print_profile, prepare_print, quote_stl
+from app.services.gltf import load_glb
+from app.services.storage import file_digest, storage
+from app.services.uploads import UploadRejected, limit_upload_size, scratch_dir, scratch_path, spool_upload, sweep_scratch
+from app.services import lods
+from app.services import workflows
+from app.services.variants import variant_params, batch_seed
 
 load_dotenv()
 app = FastAPI()
@@ -25,8 +43,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Oversized STL uploads are refused from their Content-Length, before FastAPI buffers them
+app.middleware("http")(limit_upload_size)
+
+# Optional per-request trace ids plus a per-stage timing line in the log
+if os.getenv("TRACE_REQUESTS") == "1":
+    app.middleware("http")(trace_requests)
+
 # --- CONFIGURATION ---
-PRUSA_PATH = r"C:\Program Files\Prusa3D\PrusaSlicer\prusa-slicer-console.exe"
+PRUSA_PATH = os.getenv("PRUSA_PATH", r"C:\Program Files\Prusa3D\PrusaSlicer\prusa-slicer-console.exe")
+BASE_PATH = Path(__file__).resolve().parent.parent
+CONFIG_PATH = (BASE_PATH / "config.ini").absolute()
+PRINT_PROFILE = load_print_profile(CONFIG_PATH)
+# G-code is stored gzip-encoded unless GCODE_COMPRESSION=none; BGCODE_PATH (libbgcode's
+# `bgcode` tool) additionally publishes PrusaSlicer's binary G-code
+GCODE_ENCODING = None if os.getenv("GCODE_COMPRESSION", "gzip") == "none" else "gzip"
+BGCODE_PATH = os.getenv("BGCODE_PATH")
+# Triangle budget for models prepared server-side (model + base) before slicing
+PRINT_MAX_TRIANGLES = int(os.getenv("PRINT_MAX_TRIANGLES", "150000"))
+
+# Finished jobs are resolved (and uploaded to R2) once, then served from memory.
+job_results = JobResultCache(
+    max_entries=int(os.getenv("JOB_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.getenv("JOB_CACHE_TTL", "21600")),
+)
+
+# Job and quote rows are buffered and written to D1 (or local SQLite) in batches
+records = RecordWriter(
+    open_database(str(BASE_PATH / ".cache" / "records.db")),
+    flush_interval=float(os.getenv("RECORD_FLUSH_INTERVAL", "2")),
+    max_batch=int(os.getenv("RECORD_MAX_BATCH", "200")),
+)
+
+# Files we link/copy into ComfyUI input (and served) folders, evicted once unowned
+artifacts = ArtifactStore(
+    max_bytes=int(os.getenv("ARTIFACT_MAX_BYTES", str(2 * 1024**3))),
+    max_files=int(os.getenv("ARTIFACT_MAX_FILES", "5000")),
+)
 
 # --- MODELS ---
 class ChatRequest(BaseModel):
@@ -34,37 +87,85 @@ class ChatRequest(BaseModel):
 
 class GenRequest(BaseModel):
     visual_prompt: str
+    variants: int = 1             # candidates rendered in one batched pass (capped by MAX_VARIANTS)
+    seed: Optional[int] = None    # fixed seed makes the variants reproducible
 
 class ThreeDRequest(BaseModel):
     image_url: str
 
-# --- R2 HELPERS ---
-def get_r2_client():
-    return boto3.client(
-        service_name='s3',
-        endpoint_url=f"https://{os.getenv('R2_ACCOUNT_ID')}.r2.cloudflarestorage.com",
-        aws_access_key_id=os.getenv('R2_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('R2_SECRET_ACCESS_KEY'),
-        region_name="auto",
-    )
-
-def upload_to_r2(local_path, file_name):
+class PrintRequest(BaseModel):
+    glb_url: str                  # stage-2 model as returned by check-status
+    shape: str = "box"            # the rest mirrors the PedestalControls.js settings (mm)
+    width: float = 60
+    depth: float = 60
+    height: float = 10
+    offset: float = 10
+    scale: float = 1.0
+    modelZOffset: float = 0
+    max_triangles: Optional[int] = None
+
+@metrics.timed("comfy_submit")
+async def trigger_workflow(workflow, node=0):
     try:
-        client = get_r2_client()
-        content_type = "image/png" if file_name.endswith(".png") else "model/gltf-binary"
-        if file_name.endswith(".gcode"): content_type = "text/x.gcode"
-        
-        client.upload_file(local_path, os.getenv("R2_BUCKET_NAME"), file_name, ExtraArgs={'ContentType': content_type})
-        return f"{os.getenv('R2_PUBLIC_URL')}/{file_name}"
-    except Exception as e:
-        print(f"R2 Error: {e}")
+        resp = await http_pool.comfy("POST", "/prompt", node=node, json={"prompt": workflow, "client_id": job_hub.client_id})
+        return resp.json().get('prompt_id')
+    except:
+        metrics.inc("comfy_submit_errors_total")
         return None
 
-def trigger_workflow(workflow):
+# ComfyUI nodes (COMFY_URLS) with their queue depth and health
+comfy_pool = ComfyPool(health_interval=float(os.getenv("COMFY_HEALTH_INTERVAL", "5")))
+
+# One owner per node for the ComfyUI queue: groups image/3D jobs to avoid model swaps
+gpu_queue = GpuCluster(
+    comfy_pool,
+    trigger_workflow,
+    max_inflight=int(os.getenv("COMFY_MAX_INFLIGHT", "2")),
+    max_pending=int(os.getenv("COMFY_MAX_PENDING", "32")),
+    max_batch=int(os.getenv("COMFY_PHASE_BATCH", "4")),
+    max_wait=float(os.getenv("COMFY_PHASE_MAX_WAIT", "60")),
+)
+
+def queue_gpu_job(phase, workflow, prepare=None, node=None):
     try:
-        resp = requests.post(f"{os.getenv('COMFY_URL')}/prompt", json={"prompt": workflow})
-        return resp.json().get('prompt_id')
-    except: return None
+        job = gpu_queue.submit(phase, workflow, prepare, node)
+    except SchedulerFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    records.job(job.id, kind=phase, status="queued")
+    return {"status": "queued", "job_id": job.id, "position": gpu_queue.position(job)}
+
+@app.on_event("startup")
+async def start_services():
+    workflows.load_all()
+    gpu_queue.start()
+    sweep_scratch()
+    job_hub.start()
+    await slice_jobs.start()
+    await records.start()
+
+@app.on_event("shutdown")
+async def stop_services():
+    await gpu_queue.stop()
+    await job_hub.stop()
+    await slice_jobs.stop()
+    await records.stop()
+    await http_pool.close_clients()
+    storage.shutdown()
+
+# --- METRICS ---
+metrics.gauge("gpu_queue_pending", lambda: {(("node", str(s.node)), ("phase", p)): len(q)
+                                            for s in gpu_queue.schedulers for p, q in s.pending.items()},
+              "Jobs waiting in our GPU scheduler")
+metrics.gauge("gpu_queue_inflight", lambda: {(("node", str(s.node)),): s.stats()["inflight"] for s in gpu_queue.schedulers},
+              "Our prompts sitting in ComfyUI's queue")
+metrics.gauge("comfy_queue_depth", lambda: {(("node", str(n.index)),): n.depth for n in comfy_pool.nodes},
+              "Prompts running or pending on each ComfyUI node")
+metrics.gauge("comfy_node_up", lambda: {(("node", str(n.index)),): int(n.healthy) for n in comfy_pool.nodes})
+metrics.gauge("job_cache_entries", lambda: job_results.stats()["entries"])
+metrics.gauge("slicer_queue_depth", lambda: slice_jobs.depth())
+metrics.gauge("slicer_running", lambda: slice_jobs.running())
+metrics.gauge("record_buffer_rows", lambda: records.stats()["buffered"])
+metrics.gauge("artifact_store_bytes", lambda: artifacts.bytes)
 
 # --- API ENDPOINTS ---
 
@@ -80,130 +181,393 @@ async def chat_with_ai(req: ChatRequest):
 async def generate_images(payload: GenRequest):
     try:
         template = f"Product designer prompt: {payload.visual_prompt}. Style: matte gray PLA, 3D printed figurine, solid geometry, white background."
+        params = variant_params(payload.variants, payload.seed)
+        workflow = workflows.render("stage1", prompt=template, **params)
         
-        base_dir = Path(__file__).resolve().parent.parent 
-        with open(base_dir / "workflows" / "stage1_image.json", "r") as f:
-            workflow = json.load(f)
-
-        if "34:27" in workflow: workflow["34:27"]["inputs"]["text"] = template
-        if "34:3" in workflow: workflow["34:3"]["inputs"]["seed"] = random.randint(1, 10**14)
-        
-        job_id = trigger_workflow(workflow)
-        return {"status": "queued", "job_id": job_id}
+        return {**queue_gpu_job("image", workflow), "variants": params["batch_size"], "seed": params["seed"]}
+    except HTTPException: raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/check-status/{job_id}")
-async def check_status(job_id: str):
+async def resolve_job(job_id):
+    """Collects a finished job's outputs and uploads them. Returns (result, cacheable)."""
+    job = gpu_queue.get(job_id)
+    if job is not None and job.status == "failed": artifacts.release(f"{job_id}:input")
+    if job is not None and job.status != "submitted": return gpu_queue.status(job), False
+    prompt_id = job.prompt_id if job else job_id
+    node = comfy_pool.node(job.node if job else comfy_pool.node_for(job_id))
     try:
-        resp = requests.get(f"{os.getenv('COMFY_URL')}/history/{job_id}", timeout=2)
+        # An id we don't track (pruned, or never issued) is only pending while a node still queues it;
+        # the queue is read before the history so a prompt finishing in between isn't taken for unknown
+        queued = None if job else await comfy_pool.has_prompt(prompt_id, node.index)
+        resp = await http_pool.comfy("GET", f"/history/{prompt_id}", node=node.index, timeout_setting="poll_timeout")
         history = resp.json()
-        if not history or job_id not in history: return {"status": "processing"}
+        if not history or prompt_id not in history:
+            if queued is False: return {"status": "unknown", "message": "Unknown or expired job."}, False
+            return {"status": "processing"}, False
+        artifacts.release(f"{job_id}:input")  # ComfyUI is done with the bridged image
         
-        outputs = history[job_id]['outputs']
-        urls = []
-        out_dir = Path(os.getenv("COMFY_OUTPUT_DIR"))
-
+        outputs = history[prompt_id]['outputs']
+        items = []  # (history item, variant index for stage-1 images or None for meshes)
         for node_id in ['9', '10']:
-            if node_id in outputs:
-                for key in outputs[node_id]:
-                    if isinstance(outputs[node_id][key], list):
-                        for item in outputs[node_id][key]:
-                            if 'filename' in item:
-                                fname = item['filename']
-                                src = out_dir / fname
-                                if not src.exists(): src = out_dir / "mesh" / os.path.basename(fname)
-                                if src.exists():
-                                    url = upload_to_r2(str(src), os.path.basename(fname))
-                                    if url: urls.append(url)
-        return {"status": "completed", "images": urls}
-    except: return {"status": "processing"}
+            for key, value in outputs.get(node_id, {}).items():
+                if isinstance(value, list):
+                    items += [(item, i if node_id == '9' else None) for i, item in enumerate(value) if 'filename' in item]
+        # Remote nodes (no visible output folder) are read through /view into scratch copies
+        found = await asyncio.gather(*(fetch_output(node, item, scratch_path(f"out_{job_id}_{n}_{os.path.basename(item['filename'])}"))
+                                       for n, (item, _) in enumerate(items)))
+        outs = [(*hit, i) for (_, i), hit in zip(items, found) if hit]  # (path, name, variant index)
+        fetched = {src for src, _, _ in outs if node.output_dir is None}
+
+        # Upload every output (all variants of a batch) in parallel
+        uploaded = await storage.upload_many([src for src, _, _ in outs])
+        for (src, name, _), url in zip(outs, uploaded):
+            # Stage 2 and print prep read the file this node wrote: route by R2 key, not by filename
+            if url: comfy_pool.record_output(url.rsplit("/", 1)[-1], node.index, name)
+        result = {"status": "completed", "images": [url for url in uploaded if url]}
+        if '9' in outputs:
+            seed = batch_seed(history[prompt_id])
+            result["variants"] = [{"index": i, "seed": seed, "url": url}
+                                  for (_, _, i), url in zip(outs, uploaded) if url and i is not None]
+        meshes = [(src, url) for (src, _, i), url in zip(outs, uploaded) if i is None and url]
+        if meshes:
+            lods.attach_later(result, publish_lods(*meshes[0], discard=meshes[0][0] in fetched),
+                              on_done=lambda r: lods_ready(job_id, r))
+        for src in fetched - {src for src, _ in meshes[:1]}: src.unlink(missing_ok=True)
+        # Only remember the result once every output made it to R2
+        return result, len(result["images"]) == len(items)
+    except (httpx.HTTPError, OSError, ValueError, KeyError) as e:
+        print(f"ComfyUI History Error ({job_id}): {e}")
+        return {"status": "processing"}, False
+
+def lods_ready(job_id, result):
+    """Stores the job row again with its preview manifest and wakes SSE streams waiting for it."""
+    records.job(job_id, detail=result)
+    job_hub.publish(job_id, {"type": "lods"})
+
+async def publish_lods(src, source_url, discard=False):
+    """Uploads lighter, quantized copies of a stage-2 GLB; returns the check-status manifest (or None).
+
+    `discard` removes `src` afterwards (a scratch copy fetched from a remote node).
+    """
+    try:
+        source_bytes = src.stat().st_size
+        with metrics.timer("glb_lods"):
+            levels, source_triangles = await asyncio.to_thread(lods.build_lods, src, scratch_dir())
+    except Exception as e:
+        print(f"LOD Error: {e}")
+        return None
+    finally:
+        if discard: src.unlink(missing_ok=True)
+    try:
+        urls = await storage.upload_many([level["path"] for level in levels])
+    finally:
+        for level in levels: level["path"].unlink(missing_ok=True)
+    if not all(urls): return None
+    return lods.manifest(levels, urls, source_triangles, source_bytes, source_url)
+
+async def resolve_and_record(job_id):
+    result, cacheable = await resolve_job(job_id)
+    if cacheable: records.job(job_id, status=result["status"], detail=result)
+    return result, cacheable
+
+async def job_status(job_id):
+    with metrics.timer("check_status"):
+        result = await job_results.resolve(job_id, lambda: resolve_and_record(job_id))
+    metrics.inc("check_status_total", status=result.get("status"))
+    return result
+
+@app.get("/api/check-status/{job_id}")
+async def check_status(job_id: str):
+    result = await job_status(job_id)
+    if result["status"] == "unknown": raise HTTPException(status_code=404, detail=result["message"])
+    return result
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text format: stage latencies (p50/p95/p99), error counts and queue gauges."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/job-cache/stats")
+async def job_cache_stats():
+    return job_results.stats()
+
+@app.get("/api/gpu-queue/stats")
+async def gpu_queue_stats():
+    return gpu_queue.stats()
+
+@app.get("/api/records/stats")
+async def record_stats():
+    return records.stats()
+
+@app.get("/api/artifacts/stats")
+async def artifact_stats():
+    return artifacts.stats()
+
+@app.get("/api/comfy/nodes")
+async def comfy_nodes():
+    return comfy_pool.stats()
+
+@app.get("/api/job-events/{job_id}")
+async def job_events(job_id: str):
+    """Pushes progress/completion for one job over SSE instead of check-status polling."""
+    return StreamingResponse(job_hub.stream(job_id, job_status), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/api/generate-3d")
 async def generate_3d(payload: ThreeDRequest):
     try:
-        requests.post(f"{os.getenv('COMFY_URL')}/free")
-        filename = os.path.basename(payload.image_url)
-        shutil.copy2(Path(os.getenv("COMFY_OUTPUT_DIR")) / filename, Path(os.getenv("COMFY_INPUT_DIR")) / filename)
+        # R2 keys are content hashes; run stage 2 on the node that rendered the image, under its output name
+        key = payload.image_url.rsplit("/", 1)[-1]
+        origin = comfy_pool.origin(key)
+        # Unrecorded (a restart, or an evicted record): any node will do, the image comes from R2
+        node_index, filename = origin if origin is not None else (None, key)
 
-        base_dir = Path(__file__).resolve().parent.parent 
-        with open(base_dir / "workflows" / "stage2_3d.json", "r") as f:
-            workflow = json.load(f)
+        async def bridge(job):
+            # Link/upload right before submission; /free is handled by the scheduler on phase switches
+            node = comfy_pool.node(job.node)
+            if origin is not None:
+                await bridge_to_input(artifacts, node, filename, owner=f"{job.id}:input")
+                return
+            local = scratch_path(f"bridge_{job.id}_{key}")
+            try:
+                await asyncio.to_thread(storage.download, payload.image_url, local)
+                await bridge_to_input(artifacts, node, filename, owner=f"{job.id}:input", src=local)
+            finally:
+                local.unlink(missing_ok=True)
 
-        workflow["2"]["inputs"]["image"] = filename
-        job_id = trigger_workflow(workflow)
-        return {"status": "queued", "job_id": job_id}
+        workflow = workflows.render("stage2", image=filename)
+        return queue_gpu_job("3d", workflow, bridge, node_index)
+    except HTTPException: raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# (REMOVED --align-z, ADDED --ensure-on-bed)
+SLICER_ARGS = [
+    "--export-gcode",
+    "--center", "100,100", # Center of your 200x200 bed
+    "--ensure-on-bed",     # Correct flag for 2.9.4
+]
+
+def build_slice_command(job):
+    return [
+        PRUSA_PATH,
+        *SLICER_ARGS,
+        "--load", str(CONFIG_PATH),
+        "--output", str(job.gcode_path),
+        str(job.stl_path)
+    ]
+
+async def finish_slice(job, stderr):
+    """Turns a finished slicer run into the quote: volume, weight, time, price and G-code URL."""
+    output_gcode = Path(job.gcode_path)
+    if not output_gcode.exists():
+        raise SliceError("Slicer failed to create G-code.")
+
+    # Read the footer stats (volume is in cm3 because grams is 0 without filament_density)
+    stats = await asyncio.to_thread(read_gcode_stats, output_gcode)
+    weight_g = stats.grams()
+    price = price_for_weight(weight_g)
+
+    # Upload to R2, compressing on the way (local files are removed by the scheduler afterwards)
+    gcode_upload = asyncio.create_task(storage.upload(output_gcode, encoding=GCODE_ENCODING))
+    bgcode_url = None
+    bgcode = await to_binary_gcode(output_gcode, BGCODE_PATH) if BGCODE_PATH else None
+    if bgcode is not None:
+        try:
+            bgcode_url = await storage.upload(bgcode)
+        finally:
+            bgcode.unlink(missing_ok=True)
+    gcode_url = await gcode_upload
+
+    result = {
+        "gcode_url": gcode_url,
+        "download_url": f"/api/gcode/{gcode_url.rsplit('/', 1)[-1]}" if gcode_url else None,
+        "weight": round(weight_g, 1),
+        "print_time": stats.print_time,
+        "print_seconds": stats.print_seconds,
+        "price": round(price, 2)
+    }
+    if bgcode_url: result["bgcode_url"] = bgcode_url
+    if gcode_url and job.key: slice_cache.put(job.key, result)
+    records.quote(job.id, result)
+    return result
+
+slice_jobs = SliceScheduler(
+    build_slice_command,
+    finish_slice,
+    workers=int(os.getenv("SLICER_WORKERS", "2")),
+    max_queue=int(os.getenv("SLICER_QUEUE_SIZE", "16")),
+    timeout=float(os.getenv("SLICER_TIMEOUT", "300")),
+)
+
+# Repeat quotes for the same mesh + config are answered from disk
+slice_cache = SliceCache(
+    os.getenv("SLICE_CACHE_DIR", str(BASE_PATH / ".cache" / "slices")),
+    max_entries=int(os.getenv("SLICE_CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.getenv("SLICE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
+
+async def spool_stl(file, dest):
+    try:
+        return await spool_upload(file, dest)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+async def submit_slice(file):
+    """Spools the upload, then returns (job, estimate): a cache hit or a queued slice job."""
+    job_id = uuid.uuid4().hex
+    temp_stl = scratch_path(f"temp_{job_id}.stl")
+    upload = await spool_stl(file, temp_stl)
+    return await queue_slice(job_id, temp_stl, upload.sha256)
+
+async def queue_slice(job_id, temp_stl, sha256):
+    """Answers from the slice cache or queues the STL for the slicer. Returns (job, estimate)."""
+    output_gcode = scratch_path(f"gift_{job_id}.gcode")
+    key = SliceCache.make_key(sha256, CONFIG_PATH, [PRUSA_PATH, *SLICER_ARGS])
+    cached = slice_cache.get(key)
+    if cached is not None:
+        temp_stl.unlink(missing_ok=True)
+        records.quote(job_id, {**cached, "cached": True})
+        return slice_jobs.record({**cached, "cached": True}, job_id), None
+    # Cached quotes are served even when the queue is full; only a miss needs a slot
+    if slice_jobs.full():
+        temp_stl.unlink(missing_ok=True)
+        raise HTTPException(status_code=503, detail="Slicer queue is full, try again shortly.")
+
+    # Instant estimate; oversized or broken meshes never reach the slicer
+    try:
+        estimate = await asyncio.to_thread(quote_stl, temp_stl, PRINT_PROFILE)
+    except MeshError as e:
+        temp_stl.unlink(missing_ok=True)
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        return slice_jobs.submit(temp_stl, output_gcode, job_id, key), estimate
+    except SlicerBusy as e:
+        temp_stl.unlink(missing_ok=True)
+        raise HTTPException(status_code=503, detail=str(e))
+
 @app.post("/api/slice")
 async def slice_model(file: UploadFile = File(...)):
-    job_id = str(random.randint(1000, 9999))
-    base_path = Path(__file__).resolve().parent.parent
-    temp_stl = (base_path / f"temp_{job_id}.stl").absolute()
-    output_gcode = (base_path / f"gift_{job_id}.gcode").absolute()
-    config_path = (base_path / "config.ini").absolute()
+    """Slices and quotes in one call (waits for the queued job to finish)."""
+    job, _ = await submit_slice(file)
+    await job.done.wait()
+    return job.to_dict()
+
+@app.post("/api/slice/jobs")
+async def submit_slice_job(file: UploadFile = File(...)):
+    job, estimate = await submit_slice(file)
+    if job.done.is_set(): return job.to_dict()
+    return {"status": "queued", "job_id": job.id, "position": slice_jobs.position(job), "estimate": estimate}
 
+@app.post("/api/quote")
+async def quote_model(file: UploadFile = File(...)):
+    """Instant pre-slice quote computed from the mesh itself."""
+    temp_stl = scratch_path(f"quote_{uuid.uuid4().hex}.stl")
     try:
-        # 1. Save STL
-        with open(temp_stl, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # 2. Run Slicer (REMOVED --align-z, ADDED --ensure-on-bed)
-        command = [
-            PRUSA_PATH,
-            "--export-gcode",
-            "--center", "100,100", # Center of your 200x200 bed
-            "--ensure-on-bed",     # Correct flag for 2.9.4
-            "--load", str(config_path),
-            "--output", str(output_gcode),
-            str(temp_stl)
-        ]
-        
-        print(f"DEBUG: Running Slicer for {temp_stl.name}...")
-        result = subprocess.run(command, capture_output=True, text=True)
+        await spool_stl(file, temp_stl)
+        estimate = await asyncio.to_thread(quote_stl, temp_stl, PRINT_PROFILE)
+        return {"status": "success", **estimate}
+    except MeshError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    finally:
+        temp_stl.unlink(missing_ok=True)
 
-        if not output_gcode.exists():
-            print("--- SLICER ERROR LOG ---")
-            print(result.stderr)
-            return {"status": "error", "message": "Slicer failed to create G-code."}
+async def fetch_model(url, dest):
+    """Path to a stage-2 GLB: the ComfyUI output it was published from when we can still read it,
+    else a download from R2."""
+    key = url.rsplit("/", 1)[-1]
+    origin = comfy_pool.origin(key)
+    out_dir = comfy_pool.node(origin[0]).output_dir if origin is not None else None
+    if out_dir is not None:
+        src = out_dir / origin[1]
+        # Keys are content hashes: a file rewritten since (a renumbered output) is not used
+        if src.exists() and await asyncio.to_thread(file_digest, src) == Path(key).stem: return src
+    return await asyncio.to_thread(storage.download, url, dest)
 
-        # 3. Read G-Code and Extract Volume
-        content = output_gcode.read_text()
-        
-        # We search for cm3 because grams was 0 in your previous test
-        volume_cm3 = 0.0
-        print_time = "Unknown"
-        
-        vol_match = re.search(r"filament used \[cm3\]\s*=\s*([\d\.]+)", content)
-        time_match = re.search(r"estimated printing time \(normal mode\)\s*=\s*(.*)", content)
-        
-        if vol_match: volume_cm3 = float(vol_match.group(1))
-        if time_match: print_time = time_match.group(1).strip()
-
-        # 4. Math: Weight & Price
-        # PLA Density is 1.24g/cm3
-        weight_g = volume_cm3 * 1.24
-        # Pricing: (Material * 0.05) + 5€ setup + 7€ profit
-        price = (weight_g * 0.05) + 5 + 7
-        
-        # Force a minimum price for tiny objects
-        if price < 12.00: price = 12.00
+@app.post("/api/prepare-print")
+async def prepare_print_model(payload: PrintRequest):
+    """Builds the printable STL on the server (decimated model, fitted to the base, base merged)
+    and queues it for slicing. Poll /api/slice/jobs/{job_id} for the final quote."""
+    job_id = uuid.uuid4().hex
+    glb_path = scratch_path(f"model_{job_id}.glb")
+    temp_stl = scratch_path(f"temp_{job_id}.stl")
+    base = Pedestal(shape=payload.shape, width=payload.width, depth=payload.depth, height=payload.height,
+                    offset=payload.offset, scale=payload.scale, modelZOffset=payload.modelZOffset)
+    budget = min(payload.max_triangles or PRINT_MAX_TRIANGLES, PRINT_MAX_TRIANGLES)
+    envelope = (*PRINT_ENVELOPE_MM[:2], PRINT_PROFILE["max_height_mm"])
 
-        # 5. Upload to R2
-        gcode_url = upload_to_r2(str(output_gcode), output_gcode.name)
+    def build(source):
+        return prepare_print(load_glb(source), temp_stl, base, budget, envelope)
 
-        # Cleanup local files
+    try:
+        source = await fetch_model(payload.glb_url, glb_path)
+        with metrics.timer("print_prep"):
+            stats, source_triangles = await asyncio.to_thread(build, source)
+        sha256 = await asyncio.to_thread(file_digest, temp_stl)
+    except MeshError as e:
         temp_stl.unlink(missing_ok=True)
-        output_gcode.unlink(missing_ok=True)
-
-        return {
-            "status": "success",
-            "gcode_url": gcode_url,
-            "weight": round(weight_g, 1),
-            "print_time": print_time,
-            "price": round(price, 2)
-        }
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        print(traceback.format_exc())
-        return {"status": "error", "message": str(e)}
+        temp_stl.unlink(missing_ok=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        glb_path.unlink(missing_ok=True)
+
+    job, _ = await queue_slice(job_id, temp_stl, sha256)
+    mesh_info = {"source_triangles": source_triangles, "triangles": stats.triangles, "size_mm": stats.size_mm}
+    if job.done.is_set(): return {**job.to_dict(), "mesh": mesh_info}
+    return {"status": "queued", "job_id": job.id, "position": slice_jobs.position(job),
+            "estimate": estimate_quote(stats, PRINT_PROFILE), "mesh": mesh_info}
+
+@app.get("/api/slice/jobs/{job_id}")
+async def get_slice_job(job_id: str):
+    job = slice_jobs.get(job_id)
+    if job is None: raise HTTPException(status_code=404, detail="Unknown slice job.")
+    data = job.to_dict()
+    if job.status == "queued": data["position"] = slice_jobs.position(job)
+    return data
+
+GCODE_KEY = re.compile(r"[0-9a-f]{64}\.b?gcode")
+
+@app.get("/api/gcode/{key}")
+async def download_gcode(key: str, request: Request):
+    """Streams a sliced file from R2 with Range support.
+
+    Gzip-stored G-code is passed through as-is (Content-Encoding: gzip, ranges
+    over the stored bytes) to clients that accept gzip, and inflated on the
+    fly (full body, no ranges) for the ones that do not.
+    """
+    if not GCODE_KEY.fullmatch(key): raise HTTPException(status_code=404, detail="Unknown G-code file.")
+    byte_range = request.headers.get("range")
+    accepts_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    try:
+        obj = await asyncio.to_thread(storage.open_object, key, byte_range)
+        inflate = obj.get("ContentEncoding") == "gzip" and not accepts_gzip
+        if inflate and byte_range:
+            obj["Body"].close()
+            obj = await asyncio.to_thread(storage.open_object, key)
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if code == "InvalidRange": raise HTTPException(status_code=416, detail="Requested range not satisfiable.")
+        if code in ("NoSuchKey", "404"): raise HTTPException(status_code=404, detail="Unknown G-code file.")
+        raise HTTPException(status_code=502, detail=str(e))
+
+    headers = {"Content-Disposition": f'attachment; filename="{key}"', "ETag": obj.get("ETag", "")}
+    if inflate:
+        return StreamingResponse(iter_body(obj["Body"], inflate=True), media_type=obj.get("ContentType"), headers=headers)
+    headers.update({"Accept-Ranges": "bytes", "Content-Length": str(obj["ContentLength"])})
+    if obj.get("ContentEncoding"): headers["Content-Encoding"] = obj["ContentEncoding"]
+    if obj.get("ContentRange"): headers["Content-Range"] = obj["ContentRange"]
+    return StreamingResponse(iter_body(obj["Body"]), status_code=206 if obj.get("ContentRange") else 200,
+                             media_type=obj.get("ContentType"), headers=headers)
+
+@app.get("/api/slice/cache/stats")
+async def slice_cache_stats():
+    return slice_cache.stats()
+
+@app.delete("/api/slice/jobs/{job_id}")
+async def cancel_slice_job(job_id: str):
+    if not slice_jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="No active slice job with that id.")
+    return {"status": "cancelled", "job_id": job_id}
@@ -1,17 +1,31 @@
 import os
 import json
-import shutil
-import requests
+import asyncio
 import re
 import random
 import traceback
-import base64
 from pathlib import Path
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 from dotenv import load_dotenv
+import httpx
+from app.services import http_pool
+from app.services.job_events import hub as job_hub
+from app.services.job_cache import JobResultCache
+from app.services.gpu_scheduler import GpuCluster, SchedulerFull
+from app.services.comfy_pool import ComfyPool
+from app.services.artifacts import ArtifactStore, bridge_to_input, fetch_output
+from app.services.metrics import metrics, trace_requests
+from app.services.gatekeeper import VlmGatekeeper
+from app.services.job_events import sse
+from app.services.chat_stream import VisualPromptExtractor, stream_ollama
+from app.services import workflows
+from app.services.variants import variant_params, batch_seed, saved_images
+from app.services.uploads import scratch_dir, scratch_path
+from app.services import lods
 
 load_dotenv()
 
@@ -25,77 +39,130 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Optional per-request trace ids plus a per-stage timing line in the log
+if os.getenv("TRACE_REQUESTS") == "1":
+    app.middleware("http")(trace_requests)
+
 # --- MODELS ---
 class ChatRequest(BaseModel):
     history: List[Dict[str, str]]
 
+class ChatStreamRequest(ChatRequest):
+    speculate: bool = False  # queue image generation as soon as visual_prompt is known
+
 class GenRequest(BaseModel):
     visual_prompt: str
+    variants: int = 1             # candidates rendered in one batched pass (capped by MAX_VARIANTS)
+    seed: Optional[int] = None    # fixed seed makes the variants reproducible
 
 class ThreeDRequest(BaseModel):
     image_url: str
 
+# --- CACHES ---
+GENERATED_DIR = Path(os.getenv("GENERATED_DIR", Path(__file__).resolve().parent.parent.parent / "frontend" / "public" / "generated"))
+# Files we link/copy into ComfyUI input and frontend/public/generated, evicted once unowned
+artifacts = ArtifactStore(
+    max_bytes=int(os.getenv("ARTIFACT_MAX_BYTES", str(2 * 1024**3))),
+    max_files=int(os.getenv("ARTIFACT_MAX_FILES", "5000")),
+)
+# Finished jobs are gated, copied and resolved once, then served from memory.
+job_results = JobResultCache(
+    max_entries=int(os.getenv("JOB_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.getenv("JOB_CACHE_TTL", "21600")),
+    on_evict=artifacts.release,  # a forgotten result no longer pins its published files
+)
+# VLM verdicts are memoized by image hash
+gatekeeper = VlmGatekeeper(
+    model=os.getenv("VLM_MODEL", "llava"),
+    max_concurrency=int(os.getenv("VLM_MAX_CONCURRENCY", "2")),
+)
+
+# --- METRICS ---
+metrics.gauge("gpu_queue_pending", lambda: {(("node", str(s.node)), ("phase", p)): len(q)
+                                            for s in gpu_queue.schedulers for p, q in s.pending.items()},
+              "Jobs waiting in our GPU scheduler")
+metrics.gauge("gpu_queue_inflight", lambda: {(("node", str(s.node)),): s.stats()["inflight"] for s in gpu_queue.schedulers},
+              "Our prompts sitting in ComfyUI's queue")
+metrics.gauge("comfy_queue_depth", lambda: {(("node", str(n.index)),): n.depth for n in comfy_pool.nodes},
+              "Prompts running or pending on each ComfyUI node")
+metrics.gauge("comfy_node_up", lambda: {(("node", str(n.index)),): int(n.healthy) for n in comfy_pool.nodes})
+metrics.gauge("job_cache_entries", lambda: job_results.stats()["entries"])
+metrics.gauge("artifact_store_bytes", lambda: artifacts.bytes)
+
 # --- HELPERS ---
 
-def query_ollama(model, messages):
+@metrics.timed("llm_chat")
+async def query_ollama(model, messages):
     url = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
     payload = {"model": model, "messages": messages, "stream": False, "options": {"temperature": 0.8}}
     try:
-        resp = requests.post(url, json=payload, timeout=40)
+        resp = await http_pool.ollama("POST", url, json=payload)
         return resp.json()['message']['content']
     except Exception as e:
         print(f"Ollama Error: {e}")
+        metrics.inc("llm_chat_errors_total")
         return "Error connecting to AI."
 
-def analyze_image_with_vlm(image_path):
-    """The Gatekeeper: Asks Llava if the image is actually a 3D solid."""
+@metrics.timed("comfy_submit")
+async def trigger_workflow(workflow, node=0):
     try:
-        with open(image_path, "rb") as f:
-            b64_string = base64.b64encode(f.read()).decode('utf-8')
-        
-        url = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
-        payload = {
-            "model": "llava",
-            "messages": [{
-                "role": "user",
-                "content": "Does this image contain floating stars, speech bubbles, or 2D sketches in the corner? Answer only FAIL if it has them, or PASS if it is a clean solid object.",
-                "images": [b64_string]
-            }],
-            "stream": False
-        }
-        resp = requests.post(url, json=payload, timeout=30)
-        result = resp.json()['message']['content'].upper()
-        print(f"DEBUG: VLM Result for {os.path.basename(image_path)}: {result}")
-        return "PASS" in result
-    except Exception as e:
-        print(f"VLM Error: {e}")
-        return True # Default to true if VLM is offline
-
-def trigger_workflow(workflow):
-    comfy_url = os.getenv("COMFY_URL", "http://127.0.0.1:8188")
-    try:
-        resp = requests.post(f"{comfy_url}/prompt", json={"prompt": workflow})
+        resp = await http_pool.comfy("POST", "/prompt", node=node, json={"prompt": workflow, "client_id": job_hub.client_id})
         return resp.json().get('prompt_id')
     except Exception as e:
         print(f"ComfyUI Trigger Error: {e}")
+        metrics.inc("comfy_submit_errors_total")
         return None
 
+# ComfyUI nodes (COMFY_URLS) with their queue depth and health
+comfy_pool = ComfyPool(health_interval=float(os.getenv("COMFY_HEALTH_INTERVAL", "5")))
+
+# One owner per node for the ComfyUI queue: groups image/3D jobs to avoid model swaps
+gpu_queue = GpuCluster(
+    comfy_pool,
+    trigger_workflow,
+    max_inflight=int(os.getenv("COMFY_MAX_INFLIGHT", "2")),
+    max_pending=int(os.getenv("COMFY_MAX_PENDING", "32")),
+    max_batch=int(os.getenv("COMFY_PHASE_BATCH", "4")),
+    max_wait=float(os.getenv("COMFY_PHASE_MAX_WAIT", "60")),
+)
+
+def queue_gpu_job(phase, workflow, prepare=None, node=None):
+    try:
+        job = gpu_queue.submit(phase, workflow, prepare, node)
+    except SchedulerFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "queued", "job_id": job.id, "position": gpu_queue.position(job)}
+
+@app.on_event("startup")
+async def start_services():
+    workflows.load_all()
+    await asyncio.to_thread(artifacts.adopt, GENERATED_DIR)
+    gpu_queue.start()
+    job_hub.start()
+
+@app.on_event("shutdown")
+async def stop_services():
+    await gpu_queue.stop()
+    await job_hub.stop()
+    await http_pool.close_clients()
+
 # --- API ENDPOINTS ---
 
+SYSTEM_PROMPT = {
+    "role": "system", 
+    "content": """
+    You are a Creative 3D Product Designer. Merge user interests into ONE funny physical object.
+    RULES:
+    1. Always merge ideas (e.g. Dog + Pizza = Dog sitting on pizza base).
+    2. No floating parts. No sketches.
+    Format: {"visual_prompt": "A macro studio photo of a [DESCRIPTION] figurine"}
+    """
+}
+
 @app.post("/api/chat")
 async def chat_with_ai(req: ChatRequest):
-    system_prompt = {
-        "role": "system", 
-        "content": """
-        You are a Creative 3D Product Designer. Merge user interests into ONE funny physical object.
-        RULES:
-        1. Always merge ideas (e.g. Dog + Pizza = Dog sitting on pizza base).
-        2. No floating parts. No sketches.
-        Format: {"visual_prompt": "A macro studio photo of a [DESCRIPTION] figurine"}
-        """
-    }
-    full_conversation = [system_prompt] + req.history
-    response_text = query_ollama(os.getenv("LLM_MODEL", "llama3.1"), full_conversation)
+    full_conversation = [SYSTEM_PROMPT] + req.history
+    response_text = await query_ollama(os.getenv("LLM_MODEL", "llama3.1"), full_conversation)
     
     visual_prompt = None
     json_match = re.search(r"\{.*\"visual_prompt\".*\}", response_text, re.DOTALL)
@@ -107,6 +174,33 @@ async def chat_with_ai(req: ChatRequest):
 
     return {"response": response_text, "visual_prompt": visual_prompt}
 
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatStreamRequest):
+    """Relays Ollama tokens over SSE and emits visual_prompt the moment its JSON closes."""
+    async def events():
+        extractor = VisualPromptExtractor()
+        reply = []
+        try:
+            async for token in stream_ollama(os.getenv("LLM_MODEL", "llama3.1"), [SYSTEM_PROMPT] + req.history):
+                reply.append(token)
+                yield sse("token", {"text": token})
+                visual_prompt = extractor.feed(token)
+                if visual_prompt:
+                    yield sse("visual_prompt", {"visual_prompt": visual_prompt})
+                    if req.speculate:
+                        # Start the image render while the LLM is still talking
+                        try:
+                            yield sse("job", await generate_images(GenRequest(visual_prompt=visual_prompt)))
+                        except HTTPException as e:
+                            yield sse("job", {"status": "error", "message": e.detail})
+        except Exception as e:
+            print(f"Ollama Error: {e}")
+            yield sse("error", {"message": "Error connecting to AI."})
+        yield sse("done", {"response": "".join(reply), "visual_prompt": extractor.visual_prompt})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/api/generate-images")
 async def generate_images(payload: GenRequest):
     try:
@@ -116,95 +210,198 @@ async def generate_images(payload: GenRequest):
         pos_mod = "physical figurine, 3D printed matte gray PLA plastic, wide flat base, solid chunky geometry, macro photography, white studio background, sharp focus"
         neg_mod = "stars, speech bubbles, 2D sketches, icons, logo, text, stickers, wireframe, floating parts, separate pieces, thin whiskers"
         
-        base_dir = Path(__file__).resolve().parent.parent 
-        with open(base_dir / "workflows" / "stage1_image.json", "r") as f:
-            workflow = json.load(f)
-
-        # Inject into your NEW stage1_image nodes
-        if "34:27" in workflow: workflow["34:27"]["inputs"]["text"] = f"{user_prompt}, {pos_mod}"
-        if "34:33" in workflow: workflow["34:33"]["inputs"]["text"] = neg_mod # Now works as CLIPText
-        
-        if "34:3" in workflow:
-            workflow["34:3"]["inputs"]["seed"] = random.randint(1, 10**14)
-            workflow["34:3"]["inputs"]["cfg"] = 2.5 # Forced CFG to enforce negative rules
-            workflow["34:3"]["inputs"]["steps"] = 8
-        
-        if "34:13" in workflow:
-            workflow["34:13"]["inputs"]["width"] = 768
-            workflow["34:13"]["inputs"]["height"] = 768
-            workflow["34:13"]["inputs"]["batch_size"] = 1
+        params = variant_params(payload.variants, payload.seed)
+        workflow = workflows.render(
+            "stage1",
+            prompt=f"{user_prompt}, {pos_mod}",
+            negative=neg_mod,
+            cfg=2.5,  # Forced CFG to enforce negative rules
+            steps=8,
+            resolution=768,
+            **params,
+        )
 
-        job_id = trigger_workflow(workflow)
-        return {"status": "queued", "job_id": job_id}
+        return {**queue_gpu_job("image", workflow), "variants": params["batch_size"], "seed": params["seed"]}
+    except HTTPException: raise
     except Exception as e:
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/check-status/{job_id}")
-async def check_status(job_id: str):
-    comfy_url = os.getenv("COMFY_URL", "http://127.0.0.1:8188")
+async def resolve_job(job_id):
+    """Gates and publishes a finished job's outputs. Returns (result, cacheable)."""
+    job = gpu_queue.get(job_id)
+    if job is not None and job.status == "failed": artifacts.release(f"{job_id}:input")
+    if job is not None and job.status != "submitted": return gpu_queue.status(job), False
+    prompt_id = job.prompt_id if job else job_id
+    node = comfy_pool.node(job.node if job else comfy_pool.node_for(job_id))
     try:
-        resp = requests.get(f"{comfy_url}/history/{job_id}")
+        # An id we don't track (pruned, or never issued) is only pending while a node still queues it;
+        # the queue is read before the history so a prompt finishing in between isn't taken for unknown
+        queued = None if job else await comfy_pool.has_prompt(prompt_id, node.index)
+        resp = await http_pool.comfy("GET", f"/history/{prompt_id}", node=node.index, timeout_setting="poll_timeout")
         history = resp.json()
-    except: return {"status": "processing"}
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"ComfyUI History Error ({job_id}): {e}")
+        return {"status": "processing"}, False
     
-    if not history or job_id not in history: return {"status": "processing"}
+    if not history or prompt_id not in history:
+        if queued is False: return {"status": "unknown", "message": "Unknown or expired job."}, False
+        return {"status": "processing"}, False
+    artifacts.release(f"{job_id}:input")  # ComfyUI is done with the bridged image
         
-    outputs = history[job_id]['outputs']
+    outputs = history[prompt_id]['outputs']
     files_to_return = []
-    dst_dir = Path(__file__).resolve().parent.parent.parent / "frontend" / "public" / "generated"
-    dst_dir.mkdir(parents=True, exist_ok=True)
-
-    # Check Stage 1
-    if '9' in outputs:
-        for item in outputs['9']['images']:
-            fname = item['filename']
-            src = Path(os.getenv("COMFY_OUTPUT_DIR")) / fname
-            if src.exists():
-                # GATEKEEPER CHECK
-                if analyze_image_with_vlm(src):
-                    shutil.copy2(src, dst_dir / os.path.basename(fname))
-                    files_to_return.append(f"/generated/{os.path.basename(fname)}")
-                else:
-                    return {"status": "rejected", "message": "VLM detected floating parts. Retrying..."}
-
-    # Check Stage 2
-    if '10' in outputs:
-        data = outputs['10']
-        items = data.get('gifs', []) + data.get('files', [])
-        for item in items:
-            fname = item['filename']
-            src = Path(os.getenv("COMFY_OUTPUT_DIR")) / fname
-            if src.exists():
-                clean_name = os.path.basename(fname)
-                shutil.copy2(src, dst_dir / clean_name)
-                files_to_return.append(f"/generated/{clean_name}")
-
-    return {"status": "completed", "images": files_to_return}
+    variants = None
+    GENERATED_DIR.mkdir(parents=True, exist_ok=True)
+
+    # Remote nodes (no visible output folder) are read through /view into scratch copies, removed once published
+    fetched = []
+
+    async def local_copy(item, tag):
+        hit = await fetch_output(node, item, scratch_path(f"out_{job_id}_{tag}_{os.path.basename(item['filename'])}"))
+        if hit and node.output_dir is None: fetched.append(hit[0])
+        return hit
+
+    try:
+        # Check Stage 1 (one image per variant, in batch order)
+        if '9' in outputs:
+            found = await asyncio.gather(*(local_copy(item, f"i{n}") for n, item in enumerate(saved_images(history[prompt_id]))))
+            batch = [(i, *hit) for i, hit in enumerate(found) if hit]
+            # GATEKEEPER CHECK (whole batch at once); failing variants are dropped
+            verdicts = await gatekeeper.check_many([src for _, src, _ in batch])
+            passed = [entry for entry, v in zip(batch, verdicts) if v.passed]
+            if batch and not passed:
+                return {"status": "rejected", "message": "VLM detected floating parts. Retrying..."}, True
+            # Published files are owned by this job's cached result; every node numbers its outputs
+            # independently, so the published name carries the job id
+            published = [(i, src, name, f"{job_id}_{os.path.basename(name)}") for i, src, name in passed]
+            await asyncio.gather(*(asyncio.to_thread(artifacts.place, src, GENERATED_DIR / public, job_id)
+                                   for _, src, _, public in published))
+            for _, _, name, public in published: comfy_pool.record_output(public, node.index, name)
+            seed = batch_seed(history[prompt_id])
+            variants = [{"index": i, "seed": seed, "url": f"/generated/{public}"} for i, _, _, public in published]
+            files_to_return.extend(v["url"] for v in variants)
+
+        # Check Stage 2
+        mesh = None
+        if '10' in outputs:
+            data = outputs['10']
+            items = data.get('gifs', []) + data.get('files', [])
+            for n, item in enumerate(items):
+                hit = await local_copy(item, f"m{n}")
+                if hit:
+                    clean_name = f"{job_id}_{os.path.basename(item['filename'])}"
+                    await asyncio.to_thread(artifacts.place, hit[0], GENERATED_DIR / clean_name, job_id)
+                    files_to_return.append(f"/generated/{clean_name}")
+                    # LODs are built from the published copy, which outlives the scratch one
+                    if mesh is None and clean_name.endswith(".glb"): mesh = (GENERATED_DIR / clean_name, f"/generated/{clean_name}")
+    except (httpx.HTTPError, OSError) as e:
+        print(f"ComfyUI Output Error ({job_id}): {e}")
+        return {"status": "processing"}, False
+    finally:
+        for path in fetched: path.unlink(missing_ok=True)
+
+    result = {"status": "completed", "images": files_to_return}
+    if mesh: lods.attach_later(result, publish_lods(*mesh, job_id), on_done=lambda r: lods_ready(job_id, r))
+    if variants is not None:
+        result["variants"] = variants
+        result["rejected_variants"] = len(batch) - len(passed)
+    return result, True
+
+def lods_ready(job_id, result):
+    """Wakes SSE streams waiting for the preview manifest."""
+    job_hub.publish(job_id, {"type": "lods"})
+
+async def publish_lods(src, source_url, owner):
+    """Serves lighter, quantized copies of a stage-2 GLB; returns the check-status manifest (or None)."""
+    try:
+        with metrics.timer("glb_lods"):
+            levels, source_triangles = await asyncio.to_thread(lods.build_lods, src, scratch_dir())
+    except Exception as e:
+        print(f"LOD Error: {e}")
+        return None
+    try:
+        for level in levels:
+            await asyncio.to_thread(artifacts.place, level["path"], GENERATED_DIR / level["path"].name, owner)
+    except Exception as e:
+        print(f"LOD Error: {e}")
+        return None
+    finally:
+        for level in levels: level["path"].unlink(missing_ok=True)
+    urls = [f"/generated/{level['path'].name}" for level in levels]
+    return lods.manifest(levels, urls, source_triangles, src.stat().st_size, source_url)
+
+async def job_status(job_id):
+    with metrics.timer("check_status"):
+        result = await job_results.resolve(job_id, lambda: resolve_job(job_id))
+    metrics.inc("check_status_total", status=result.get("status"))
+    return result
+
+@app.get("/api/check-status/{job_id}")
+async def check_status(job_id: str):
+    result = await job_status(job_id)
+    if result["status"] == "unknown": raise HTTPException(status_code=404, detail=result["message"])
+    return result
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text format: stage latencies (p50/p95/p99), error counts and queue gauges."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/job-cache/stats")
+async def job_cache_stats():
+    return job_results.stats()
+
+@app.get("/api/gatekeeper/stats")
+async def gatekeeper_stats():
+    return gatekeeper.stats()
+
+@app.get("/api/gpu-queue/stats")
+async def gpu_queue_stats():
+    return gpu_queue.stats()
+
+@app.get("/api/artifacts/stats")
+async def artifact_stats():
+    return artifacts.stats()
+
+@app.get("/api/comfy/nodes")
+async def comfy_nodes():
+    return comfy_pool.stats()
+
+@app.get("/api/job-events/{job_id}")
+async def job_events(job_id: str):
+    """Pushes progress/completion for one job over SSE instead of check-status polling."""
+    return StreamingResponse(job_hub.stream(job_id, job_status), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/api/generate-3d")
 async def generate_3d(payload: ThreeDRequest):
     try:
-        requests.post(f"{os.getenv('COMFY_URL')}/free")
-        image_url = payload.image_url
-        filename = os.path.basename(image_url)
-        src = Path(os.getenv("COMFY_OUTPUT_DIR")) / filename
-        dst = Path(os.getenv("COMFY_INPUT_DIR")) / filename
-        if src.exists(): shutil.copy2(src, dst)
-
-        base_dir = Path(__file__).resolve().parent.parent 
-        with open(base_dir / "workflows" / "stage2_3d.json", "r") as f:
-            workflow = json.load(f)
-
-        workflow["2"]["inputs"]["image"] = filename
-        if "4" in workflow: workflow["4"]["inputs"]["resolution"] = 512
-        if "7" in workflow: 
-            workflow["7"]["inputs"]["cfg"] = 3.0
-            workflow["7"]["inputs"]["seed"] = random.randint(1, 10**14)
-        if "17" in workflow: workflow["17"]["inputs"]["background_color"] = "#FFFFFF"
-
-        job_id = trigger_workflow(workflow)
-        return {"status": "queued", "job_id": job_id}
+        # Run stage 2 on the node that rendered the image, under its output name
+        name = os.path.basename(payload.image_url)
+        origin = comfy_pool.origin(name)
+        source = None
+        if origin is None:
+            # Unrecorded (a restart, or an evicted record): any node will do, fed from the published copy
+            source = GENERATED_DIR / name
+            if not source.exists(): raise HTTPException(status_code=404, detail=f"{name} not found.")
+        node_index, filename = origin if origin is not None else (None, name)
+
+        async def bridge(job):
+            # Link/upload right before submission; /free is handled by the scheduler on phase switches
+            await bridge_to_input(artifacts, comfy_pool.node(job.node), filename, owner=f"{job.id}:input", src=source)
+
+        workflow = workflows.render(
+            "stage2",
+            image=filename,
+            resolution=512,
+            cfg=3.0,
+            seed=random.randint(1, 10**14),
+            background="#FFFFFF",
+        )
+
+        return queue_gpu_job("3d", workflow, bridge, node_index)
+    except HTTPException: raise
     except Exception as e:
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,185 @@
+import os
+import shutil
+import asyncio
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from app.services import http_pool
+
+try:
+    import fcntl
+except ImportError:  # Windows: no reflinks, hardlinks and copies still work
+    fcntl = None
+
+FICLONE = 0x40049409  # Linux ioctl: share the source extents (btrfs, XFS, ...)
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dst)
+            raise
+
+
+def link_or_copy(src, dst):
+    """Puts `src` at `dst` as cheaply as the filesystem allows; returns how."""
+    src, dst = Path(src), Path(dst)
+    if dst.exists():
+        if os.path.samefile(src, dst): return "existing"
+        dst.unlink()
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass  # different filesystem (or no hardlink support)
+    if fcntl is not None:
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+class ArtifactStore:
+    """Every file we place into a served or ComfyUI folder, with its owners.
+
+    An owner is usually a job id: a finished job owns the files its result
+    points at, a queued 3D job owns its bridged input image. Files nobody
+    owns are deleted oldest-first once the store holds more than `max_bytes`
+    or `max_files`; owned files are never evicted.
+    """
+
+    def __init__(self, max_bytes=2 * 1024**3, max_files=5000):
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.bytes = 0
+        self.evictions = 0
+        self.methods = {}
+        self._entries = OrderedDict()  # path -> [size, set of owners]
+        self._owned = {}               # owner -> set of paths
+        self._lock = threading.Lock()
+
+    def _track(self, path, owner=None):
+        entry = self._entries.get(path)
+        if entry is None:
+            entry = self._entries[path] = [path.stat().st_size, set()]
+            self.bytes += entry[0]
+        self._entries.move_to_end(path)
+        if owner is not None:
+            entry[1].add(owner)
+            self._owned.setdefault(owner, set()).add(path)
+
+    def adopt(self, directory):
+        """Tracks files already in `directory` (e.g. from before a restart) as unowned."""
+        directory = Path(directory)
+        if not directory.is_dir(): return
+        files = sorted((p for p in directory.iterdir() if p.is_file()), key=lambda p: p.stat().st_mtime)
+        with self._lock:
+            for path in files:
+                self._track(path)
+            self._evict()
+
+    def place(self, src, dst, owner=None):
+        """Blocking: links/copies `src` to `dst` and records `owner` on it. Returns the method used."""
+        dst = Path(dst)
+        with self._lock:
+            method = link_or_copy(src, dst)
+            self.methods[method] = self.methods.get(method, 0) + 1
+            if method != "existing" and dst in self._entries:
+                self.bytes -= self._entries.pop(dst)[0]
+            self._track(dst, owner)
+            self._evict()
+        return method
+
+    def release(self, owner):
+        """Drops every reference `owner` holds; the files become evictable."""
+        with self._lock:
+            for path in self._owned.pop(owner, ()):
+                entry = self._entries.get(path)
+                if entry is not None: entry[1].discard(owner)
+            self._evict()
+
+    def _evict(self):
+        for path in list(self._entries):
+            if self.bytes <= self.max_bytes and len(self._entries) <= self.max_files: return
+            size, owners = self._entries[path]
+            if owners: continue
+            try:
+                path.unlink(missing_ok=True)
+            except OSError as e:
+                print(f"Artifact Eviction Error: {e}")
+                continue
+            del self._entries[path]
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "files": len(self._entries),
+            "bytes": self.bytes,
+            "owners": len(self._owned),
+            "evictions": self.evictions,
+            "placed": dict(self.methods),
+        }
+
+
+async def upload_input(node, filename, src=None):
+    """Sends an image to a (remote) node's input folder through ComfyUI's /upload/image.
+
+    The bytes come from `src` when we can read it, otherwise from the node's
+    own /view endpoint.
+    """
+    if src is not None and Path(src).exists():
+        with open(src, "rb") as f:
+            resp = await http_pool.comfy("POST", "/upload/image", node=node.index, timeout_setting="upload_timeout",
+                                         files={"image": (filename, f, "image/png")},
+                                         data={"type": "input", "overwrite": "true"})
+    else:
+        view = await http_pool.comfy("GET", "/view", node=node.index, timeout_setting="upload_timeout",
+                                     params={"filename": filename, "type": "output"})
+        view.raise_for_status()
+        resp = await http_pool.comfy("POST", "/upload/image", node=node.index, timeout_setting="upload_timeout",
+                                     files={"image": (filename, view.content, "image/png")},
+                                     data={"type": "input", "overwrite": "true"})
+    resp.raise_for_status()
+    return resp.json().get("name", filename)
+
+
+async def bridge_to_input(store, node, filename, owner=None, src=None):
+    """Makes a node's output image loadable by LoadImage on that node.
+
+    Hardlink/reflink (or copy) when we can see the node's input folder,
+    otherwise an upload over its API. `src` is a local copy to use instead
+    of the node's output folder (the image came from elsewhere). Returns the
+    method used.
+    """
+    if src is None and node.output_dir is not None: src = node.output_dir / filename
+    if node.input_dir is not None and node.input_dir.is_dir() and src is not None and src.exists():
+        return await asyncio.to_thread(store.place, src, node.input_dir / filename, owner)
+    await upload_input(node, filename, src)
+    store.methods["upload"] = store.methods.get("upload", 0) + 1
+    return "upload"
+
+
+async def fetch_output(node, item, dest):
+    """Local copy of one ComfyUI history output: (path, name within the output folder), or None.
+
+    Nodes whose output folder we can see are read in place (meshes may sit in
+    its mesh/ subfolder); remote nodes are read through their /view endpoint
+    into `dest`.
+    """
+    fname, subfolder = item["filename"], item.get("subfolder") or ""
+    if node.output_dir is not None:
+        for name in dict.fromkeys((Path(subfolder, fname).as_posix(), fname, f"mesh/{os.path.basename(fname)}")):
+            if (node.output_dir / name).exists(): return node.output_dir / name, name
+        return None
+    resp = await http_pool.comfy("GET", "/view", node=node.index, timeout_setting="upload_timeout",
+                                 params={"filename": fname, "subfolder": subfolder, "type": item.get("type", "output")})
+    if resp.status_code != 200: return None
+    await asyncio.to_thread(Path(dest).write_bytes, resp.content)
+    return Path(dest), Path(subfolder, fname).as_posix()
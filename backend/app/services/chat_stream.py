@@ -0,0 +1,62 @@
+import os
+import json
+from app.services import http_pool
+
+
+class VisualPromptExtractor:
+    """Finds the {"visual_prompt": ...} object in streamed LLM text as soon as it closes.
+
+    Tracks brace depth and string/escape state across chunks, so the JSON can be
+    split at any point between tokens.
+    """
+
+    def __init__(self):
+        self.visual_prompt = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buf = []
+
+    def feed(self, text):
+        """Consumes a chunk; returns the visual prompt the first time it becomes available."""
+        if self.visual_prompt is not None: return None
+        for ch in text:
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._buf = [ch]
+                continue
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape: self._escape = False
+                elif ch == "\\": self._escape = True
+                elif ch == '"': self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        data = json.loads("".join(self._buf))
+                    except ValueError:
+                        continue
+                    if isinstance(data, dict) and data.get("visual_prompt"):
+                        self.visual_prompt = data["visual_prompt"]
+                        return self.visual_prompt
+        return None
+
+
+async def stream_ollama(model, messages, options=None):
+    """Yields reply tokens from Ollama's streaming chat API as they arrive."""
+    url = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
+    payload = {"model": model, "messages": messages, "stream": True, "options": options or {"temperature": 0.8}}
+    async with http_pool.stream("ollama", "POST", url, json=payload) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line.strip(): continue
+            chunk = json.loads(line)
+            token = chunk.get("message", {}).get("content", "")
+            if token: yield token
+            if chunk.get("done"): break
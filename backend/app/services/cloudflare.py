@@ -1,7 +1,7 @@
 import boto3
 import os
 from dotenv import load_dotenv
-import requests
+from app.services.database import D1Database
 
 
 load_dotenv()
@@ -28,19 +28,12 @@ def upload_file_to_r2(file_path, object_name):
         return None
 
 
-def query_d1(sql, params=[]):
-    """Executes SQL on real Cloudflare D1 via API"""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{os.getenv('CF_ACCOUNT_ID')}/d1/database/{os.getenv('D1_DB_ID')}/query"
-    
-    headers = {
-        "Authorization": f"Bearer {os.getenv('CF_API_TOKEN')}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "sql": sql,
-        "params": params
-    }
-    
-    response = requests.post(url, json=payload, headers=headers)
-    return response.json()
\ No newline at end of file
+_d1 = None
+
+
+def query_d1(sql, params=None):
+    """Executes SQL on real Cloudflare D1 via API (over one shared keep-alive session)"""
+    global _d1
+    if _d1 is None:
+        _d1 = D1Database(os.getenv('CF_ACCOUNT_ID'), os.getenv('D1_DB_ID'), os.getenv('CF_API_TOKEN'))
+    return _d1.query(sql, params)
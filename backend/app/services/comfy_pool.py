@@ -0,0 +1,134 @@
+import os
+import asyncio
+from pathlib import Path
+from collections import OrderedDict
+from app.services import http_pool
+
+
+def _node_setting(plural, singular, count):
+    """Per-node value list from e.g. COMFY_OUTPUT_DIRS, falling back to COMFY_OUTPUT_DIR for every node."""
+    values = [v.strip() for v in (os.getenv(plural) or os.getenv(singular) or "").split(",") if v.strip()]
+    if len(values) == 1: values = values * count
+    return values + [None] * (count - len(values))
+
+
+class ComfyNode:
+    def __init__(self, index, url, output_dir=None, input_dir=None):
+        self.index = index
+        self.url = url
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.input_dir = Path(input_dir) if input_dir else None
+        self.healthy = True
+        self.depth = 0  # running + pending prompts reported by /queue (ours and anyone else's)
+        self.failures = 0
+
+    def to_dict(self):
+        return {"node": self.index, "url": self.url, "healthy": self.healthy, "queue_depth": self.depth}
+
+
+class ComfyPool:
+    """The ComfyUI machines we can send work to, with their queue depth and health.
+
+    Nodes come from COMFY_URLS (comma-separated; COMFY_URL still works for a
+    single box). COMFY_OUTPUT_DIRS / COMFY_INPUT_DIRS list each node's folders
+    in the same order; a single COMFY_OUTPUT_DIR / COMFY_INPUT_DIR is used for
+    all of them (e.g. a shared network drive).
+
+    Jobs are pinned to the node that ran them, so history lookups, the
+    output -> input bridge and /free always hit the right machine.
+    """
+
+    def __init__(self, health_interval=5, max_pins=8192):
+        self.health_interval = health_interval
+        self.max_pins = max_pins
+        self._nodes = None
+        self._pins = OrderedDict()
+        self._outputs = OrderedDict()  # published key -> (node index, output filename)
+        self._task = None
+
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            urls = http_pool.comfy_urls()
+            outputs = _node_setting("COMFY_OUTPUT_DIRS", "COMFY_OUTPUT_DIR", len(urls))
+            inputs = _node_setting("COMFY_INPUT_DIRS", "COMFY_INPUT_DIR", len(urls))
+            self._nodes = [ComfyNode(i, url, outputs[i], inputs[i]) for i, url in enumerate(urls)]
+        return self._nodes
+
+    def node(self, index):
+        return self.nodes[index]
+
+    def pin(self, job_id, index):
+        self._pins[job_id] = index
+        self._pins.move_to_end(job_id)
+        while len(self._pins) > self.max_pins:
+            self._pins.popitem(last=False)
+
+    def node_for(self, job_id, default=0):
+        return self._pins.get(job_id, default)
+
+    def record_output(self, key, index, filename):
+        """Remembers which node rendered a published output, and under which name.
+
+        Every node numbers its outputs independently (ComfyUI_00001_.png exists
+        on each of them), so a filename alone can't route follow-up work.
+        """
+        self._outputs[key] = (index, filename)
+        self._outputs.move_to_end(key)
+        while len(self._outputs) > self.max_pins:
+            self._outputs.popitem(last=False)
+
+    def origin(self, key):
+        """(node index, output filename) recorded for a published key, or None."""
+        return self._outputs.get(key)
+
+    def pick(self, backlog=lambda index: 0):
+        """Least-loaded healthy node; `backlog(index)` adds work we have queued but not sent yet."""
+        candidates = [n for n in self.nodes if n.healthy] or self.nodes
+        return min(candidates, key=lambda n: (n.depth + backlog(n.index), n.index)).index
+
+    async def check(self, node):
+        try:
+            resp = await http_pool.comfy("GET", "/queue", node=node.index, timeout_setting="poll_timeout")
+            queue = resp.json()
+            node.depth = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+            if not node.healthy: print(f"DEBUG: ComfyUI node {node.url} is back")
+            node.healthy = True
+            node.failures = 0
+        except Exception as e:
+            node.failures += 1
+            if node.healthy: print(f"ComfyUI Node Error ({node.url}): {e}")
+            node.healthy = False
+
+    async def has_prompt(self, prompt_id, index):
+        """Whether a node still has `prompt_id` running or pending (None if the node can't be asked)."""
+        try:
+            resp = await http_pool.comfy("GET", "/queue", node=index, timeout_setting="poll_timeout")
+            queue = resp.json()
+        except Exception:
+            return None
+        return any(item[1] == prompt_id for item in queue.get("queue_running", []) + queue.get("queue_pending", []))
+
+    async def refresh(self):
+        await asyncio.gather(*(self.check(node) for node in self.nodes))
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.health_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return [node.to_dict() for node in self.nodes]
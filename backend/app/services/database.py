@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DatabaseError(Exception):
+    """A statement (or a whole batch) was rejected by the database."""
+
+
+class Statement:
+    """A SQL string with `?` placeholders, checked once and bound per call."""
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.arity = sql.count("?")
+
+    def bind(self, *params):
+        if len(params) != self.arity:
+            raise DatabaseError(f"Expected {self.arity} parameters, got {len(params)}: {self.sql}")
+        return (self.sql, list(params))
+
+
+class D1Database:
+    """Cloudflare D1 over the REST API with one keep-alive session.
+
+    `batch()` sends many statements in a single round trip (D1 runs them in
+    one transaction).
+    """
+
+    def __init__(self, account_id, database_id, api_token, timeout=10, pool_size=8):
+        self.url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {api_token}", "Content-Type": "application/json"})
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=2))
+
+    def query(self, sql, params=None):
+        """Raw API response for one statement (what query_d1 used to return)."""
+        response = self.session.post(self.url, json={"sql": sql, "params": list(params or [])}, timeout=self.timeout)
+        return response.json()
+
+    def _results(self, body):
+        if not body.get("success"):
+            raise DatabaseError(f"D1 error: {body.get('errors')}")
+        return [item.get("results", []) for item in body.get("result", [])]
+
+    def execute(self, sql, params=None):
+        return self._results(self.query(sql, params))[0]
+
+    def batch(self, statements):
+        """Runs [(sql, params), ...] in one request; returns one row list per statement."""
+        if not statements: return []
+        payload = {"batch": [{"sql": sql, "params": list(params or [])} for sql, params in statements]}
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        return self._results(response.json())
+
+    def close(self):
+        self.session.close()
+
+
+class SQLiteDatabase:
+    """Local stand-in for D1 (same SQL dialect) for offline runs and load tests."""
+
+    def __init__(self, path):
+        if path != ":memory:": os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+
+    def execute(self, sql, params=None):
+        with self._lock:
+            try:
+                return [dict(row) for row in self.conn.execute(sql, list(params or []))]
+            except sqlite3.Error as e:
+                raise DatabaseError(str(e)) from e
+
+    def batch(self, statements):
+        with self._lock:
+            try:
+                self.conn.execute("BEGIN")
+                results = [[dict(row) for row in self.conn.execute(sql, list(params or []))]
+                           for sql, params in statements]
+                self.conn.execute("COMMIT")
+                return results
+            except sqlite3.Error as e:
+                self.conn.execute("ROLLBACK")
+                raise DatabaseError(str(e)) from e
+
+    def close(self):
+        self.conn.close()
+
+
+def open_database(sqlite_path="records.db"):
+    """D1 when DB_BACKEND=d1 (the default once D1_DB_ID is set), otherwise SQLite at SQLITE_PATH."""
+    backend = os.getenv("DB_BACKEND") or ("d1" if os.getenv("D1_DB_ID") else "sqlite")
+    if backend == "d1":
+        return D1Database(os.getenv("CF_ACCOUNT_ID"), os.getenv("D1_DB_ID"), os.getenv("CF_API_TOKEN"))
+    return SQLiteDatabase(os.getenv("SQLITE_PATH", sqlite_path))
+
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT,
+        status TEXT,
+        detail TEXT,
+        created_at REAL,
+        updated_at REAL
+    )""",
+    """CREATE TABLE IF NOT EXISTS quotes (
+        job_id TEXT PRIMARY KEY,
+        weight_g REAL,
+        price REAL,
+        print_seconds INTEGER,
+        gcode_url TEXT,
+        cached INTEGER,
+        created_at REAL
+    )""",
+]
+
+UPSERT_JOB = Statement(
+    "INSERT INTO jobs (id, kind, status, detail, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET kind = COALESCE(excluded.kind, jobs.kind), "
+    "status = COALESCE(excluded.status, jobs.status), detail = COALESCE(excluded.detail, jobs.detail), "
+    "updated_at = excluded.updated_at"
+)
+UPSERT_QUOTE = Statement(
+    "INSERT OR REPLACE INTO quotes (job_id, weight_g, price, print_seconds, gcode_url, cached, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class RecordWriter:
+    """Write-behind buffer for job and quote rows.
+
+    Request handlers only touch an in-memory dict; a background task flushes
+    it as one batch every `flush_interval` seconds (or sooner once
+    `max_batch` rows are waiting). Several updates to the same job between
+    flushes collapse into one upsert. A failed flush is retried with the next
+    one; past `max_buffer` rows the oldest are dropped and counted.
+    """
+
+    def __init__(self, db, flush_interval=2.0, max_batch=200, max_buffer=20000):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_buffer = max_buffer
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self._jobs = {}
+        self._quotes = {}
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def job(self, job_id, kind=None, status=None, detail=None):
+        now = time.time()
+        row = self._jobs.setdefault(job_id, {"created_at": now})
+        if kind is not None: row["kind"] = kind
+        if status is not None: row["status"] = status
+        if detail is not None: row["detail"] = json.dumps(detail)
+        row["updated_at"] = now
+        self._buffered()
+
+    def quote(self, job_id, result):
+        self._quotes[job_id] = (
+            result.get("weight"), result.get("price"), result.get("print_seconds"),
+            result.get("gcode_url"), int(bool(result.get("cached"))), time.time(),
+        )
+        self._buffered()
+
+    def _buffered(self):
+        pending = len(self._jobs) + len(self._quotes)
+        while pending > self.max_buffer:
+            table = self._jobs if self._jobs else self._quotes
+            del table[next(iter(table))]
+            self.dropped += 1
+            pending -= 1
+        if pending >= self.max_batch: self._wake.set()
+
+    def _statements(self, jobs, quotes):
+        statements = [UPSERT_JOB.bind(job_id, row.get("kind"), row.get("status"), row.get("detail"),
+                                      row["created_at"], row["updated_at"]) for job_id, row in jobs.items()]
+        statements += [UPSERT_QUOTE.bind(job_id, *values) for job_id, values in quotes.items()]
+        return statements
+
+    def _take(self, table, count):
+        taken = {}
+        for key in list(table)[:max(count, 0)]:
+            taken[key] = table.pop(key)
+        return taken
+
+    async def flush(self):
+        """Writes everything buffered, `max_batch` rows per round trip."""
+        while self._jobs or self._quotes:
+            jobs = self._take(self._jobs, self.max_batch)
+            quotes = self._take(self._quotes, self.max_batch - len(jobs))
+            statements = self._statements(jobs, quotes)
+            try:
+                await asyncio.to_thread(self.db.batch, statements)
+            except Exception as e:
+                print(f"Record Flush Error: {e}")
+                self.failures += 1
+                # Put the rows back under anything newer that arrived meanwhile
+                for job_id, row in jobs.items():
+                    self._jobs[job_id] = {**row, **self._jobs.get(job_id, {}), "created_at": row["created_at"]}
+                self._quotes = {**quotes, **self._quotes}
+                self._buffered()
+                return
+            self.flushed += len(statements)
+            self.batches += 1
+
+    async def ensure_schema(self):
+        await asyncio.to_thread(self.db.batch, [(sql, []) for sql in SCHEMA])
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def start(self):
+        try:
+            await self.ensure_schema()
+        except Exception as e:
+            print(f"Record Schema Error: {e}")
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "buffered": len(self._jobs) + len(self._quotes),
+            "flushed_rows": self.flushed,
+            "batches": self.batches,
+            "failed_flushes": self.failures,
+            "dropped_rows": self.dropped,
+        }
@@ -0,0 +1,121 @@
+import io
+import os
+import time
+import base64
+import asyncio
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass
+from collections import OrderedDict
+from app.services import http_pool
+from app.services.metrics import metrics
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it the full image is sent
+    Image = None
+
+VLM_QUESTION = "Does this image contain floating stars, speech bubbles, or 2D sketches in the corner? Answer only FAIL if it has them, or PASS if it is a clean solid object."
+
+
+@dataclass
+class Verdict:
+    passed: bool
+    latency_ms: float
+    cached: bool = False
+    answer: str = ""
+
+
+class VlmGatekeeper:
+    """The Gatekeeper: asks Llava whether generated images are clean 3D solids.
+
+    Images are shrunk to a thumbnail before inference, checks run concurrently
+    under a bounded pool, and verdicts are memoized by image content hash so
+    re-polls and retries of the same job cost nothing.
+    """
+
+    def __init__(self, model="llava", thumb_size=336, max_concurrency=2, cache_size=4096):
+        self.model = model
+        self.thumb_size = thumb_size
+        self.max_concurrency = max_concurrency
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._limit = None
+        self.calls = 0
+        self.hits = 0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+
+    def _thumbnail(self, raw):
+        if Image is None: return raw
+        with Image.open(io.BytesIO(raw)) as img:
+            img = img.convert("RGB")
+            img.thumbnail((self.thumb_size, self.thumb_size))
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=90)
+            return out.getvalue()
+
+    async def _ask(self, raw):
+        if self._limit is None: self._limit = asyncio.Semaphore(self.max_concurrency)
+        async with self._limit:
+            start = time.perf_counter()
+            thumb = await asyncio.to_thread(self._thumbnail, raw)
+            url = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
+            payload = {
+                "model": self.model,
+                "messages": [{"role": "user", "content": VLM_QUESTION,
+                              "images": [base64.b64encode(thumb).decode('utf-8')]}],
+                "stream": False
+            }
+            resp = await http_pool.ollama("POST", url, json=payload, timeout_setting="vlm_timeout")
+            answer = resp.json()['message']['content'].upper()
+            latency = (time.perf_counter() - start) * 1000
+        metrics.observe("vlm_check", latency / 1000)
+        self.calls += 1
+        self.total_latency_ms += latency
+        self.max_latency_ms = max(self.max_latency_ms, latency)
+        return Verdict("PASS" in answer, round(latency, 1), answer=answer.strip())
+
+    async def check(self, image_path):
+        raw = await asyncio.to_thread(Path(image_path).read_bytes)
+        key = hashlib.sha256(raw).hexdigest()
+        verdict = self._cache.get(key)
+        if verdict is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            metrics.inc("vlm_cache_hits_total")
+            return Verdict(verdict.passed, 0.0, cached=True, answer=verdict.answer)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._ask(raw))
+            self._inflight[key] = task
+        try:
+            verdict = await asyncio.shield(task)
+        except Exception as e:
+            print(f"VLM Error: {e}")
+            metrics.inc("vlm_check_errors_total")
+            return Verdict(True, 0.0, answer="VLM offline")  # Default to pass if VLM is offline
+        finally:
+            if task.done(): self._inflight.pop(key, None)
+
+        self._cache[key] = verdict
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        metrics.inc("vlm_verdicts_total", result="pass" if verdict.passed else "fail")
+        print(f"DEBUG: VLM Result for {os.path.basename(image_path)}: {verdict.answer} ({verdict.latency_ms} ms)")
+        return verdict
+
+    async def check_many(self, image_paths):
+        """Checks a batch concurrently; takes about as long as the slowest single check."""
+        return await asyncio.gather(*(self.check(p) for p in image_paths))
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "cache_hits": self.hits,
+            "cached_verdicts": len(self._cache),
+            "avg_latency_ms": round(self.total_latency_ms / self.calls, 1) if self.calls else 0.0,
+            "max_latency_ms": round(self.max_latency_ms, 1),
+        }
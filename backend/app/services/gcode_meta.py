@@ -0,0 +1,102 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from app.services.pricing import PLA_DENSITY
+
+# PrusaSlicer writes its statistics and the full config as a trailing comment
+# block, so only the tail of the file has to be read, however large the print.
+CHUNK_SIZE = 64 * 1024
+# Hard cap on how far back we read, which keeps the cost independent of file size.
+TAIL_LIMIT = 512 * 1024
+
+_STATS_START = b"; filament used [mm]"
+_Z_MARKER = b"\n;Z:"
+_TIME_PART = re.compile(r"(\d+)\s*([dhms])")
+_TIME_UNITS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+
+
+@dataclass
+class GcodeStats:
+    """Print statistics from a PrusaSlicer G-code footer."""
+    volume_cm3: float = 0.0
+    filament_mm: float = 0.0
+    slicer_grams: float = 0.0  # "total filament used [g]"; 0 when filament_density is unset
+    filament_cost: float = 0.0
+    print_time: str = "Unknown"
+    print_seconds: Optional[int] = None
+    silent_print_time: Optional[str] = None
+    first_layer_time: Optional[str] = None
+    max_z: Optional[float] = None
+    layer_count: Optional[int] = None  # estimated from max_z and the layer heights
+    config: Dict[str, str] = field(default_factory=dict)
+
+    def grams(self, density=PLA_DENSITY):
+        return self.volume_cm3 * density
+
+
+def parse_duration(text):
+    """'1d 2h 3m 4s' -> seconds, or None if nothing parses."""
+    parts = _TIME_PART.findall(text or "")
+    if not parts: return None
+    return sum(int(n) * _TIME_UNITS[u] for n, u in parts)
+
+
+def read_tail(path, marker=_STATS_START, limit=TAIL_LIMIT):
+    """Reads backwards in chunks until `marker` (and the last ;Z: line before it) is in view."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while pos > 0 and len(tail) < limit:
+            step = min(CHUNK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            start = tail.rfind(marker)
+            if start != -1 and tail.rfind(_Z_MARKER, 0, start) != -1:
+                break
+        return tail
+
+
+def _number(value):
+    try:
+        return float(value.split()[0])
+    except (ValueError, IndexError):
+        return 0.0
+
+
+def read_gcode_stats(path):
+    """Parses the footer of a PrusaSlicer G-code file into a GcodeStats."""
+    tail = read_tail(path).decode("utf-8", errors="replace")
+    stats = GcodeStats()
+    values = {}
+    in_config = False
+    start = tail.rfind(_STATS_START.decode())
+    for line in tail[max(start, 0):].splitlines():
+        if not line.startswith("; ") or " = " not in line: continue
+        key, value = line[2:].split(" = ", 1)
+        if key == "prusaslicer_config":
+            in_config = value.strip() == "begin"
+            continue
+        if in_config: stats.config[key] = value
+        else: values[key] = value.strip()
+
+    stats.filament_mm = _number(values.get("filament used [mm]", "0"))
+    stats.volume_cm3 = _number(values.get("filament used [cm3]", "0"))
+    stats.slicer_grams = _number(values.get("total filament used [g]", "0"))
+    stats.filament_cost = _number(values.get("total filament cost", "0"))
+    stats.print_time = values.get("estimated printing time (normal mode)", "Unknown")
+    stats.print_seconds = parse_duration(stats.print_time)
+    stats.silent_print_time = values.get("estimated printing time (silent mode)")
+    stats.first_layer_time = values.get("estimated first layer printing time (normal mode)")
+
+    z_at = tail.rfind(_Z_MARKER.decode(), 0, start if start != -1 else len(tail))
+    if z_at != -1:
+        stats.max_z = _number(tail[z_at + len(_Z_MARKER):].split("\n", 1)[0])
+        # Layer count from the last layer height and the embedded layer settings
+        first = _number(stats.config.get("first_layer_height", "0"))
+        height = _number(stats.config.get("layer_height", "0"))
+        if height > 0 and stats.max_z >= first > 0:
+            stats.layer_count = 1 + round((stats.max_z - first) / height)
+    return stats
@@ -0,0 +1,88 @@
+import os
+import zlib
+import asyncio
+import subprocess
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class GzipStream:
+    """Read-only file object that gzips a file as it is read.
+
+    Handed to boto3's upload_fileobj, the compressed bytes go out in parts as
+    they are produced: neither the G-code nor its compressed form is ever held
+    in memory (or written to disk) as a whole.
+    """
+
+    def __init__(self, path, level=6, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self._src = open(path, "rb")
+        self._zip = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            chunk = self._src.read(self.chunk_size)
+            if chunk:
+                self.raw_bytes += len(chunk)
+                self._buffer += self._zip.compress(chunk)
+            else:
+                self._buffer += self._zip.flush()
+                self._eof = True
+        if size is None or size < 0: size = len(self._buffer)
+        out = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.compressed_bytes += len(out)
+        return out
+
+    def close(self):
+        self._src.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def iter_body(body, inflate=False, chunk_size=CHUNK_SIZE):
+    """Yields an S3 object body in chunks, optionally un-gzipping it on the way."""
+    unzip = zlib.decompressobj(31) if inflate else None
+    try:
+        for chunk in body.iter_chunks(chunk_size):
+            yield unzip.decompress(chunk) if unzip else chunk
+        if unzip: yield unzip.flush()
+    finally:
+        body.close()
+
+
+async def to_binary_gcode(gcode_path, converter, timeout=120):
+    """Converts G-code to PrusaSlicer's binary format with libbgcode's `bgcode` tool.
+
+    The tool writes <name>.bgcode next to the input. Returns that path, or
+    None if the conversion failed (the text G-code is still usable).
+    """
+    target = Path(gcode_path).with_suffix(".bgcode")
+    try:
+        # Popen in a thread rather than asyncio subprocesses, like the slicer (Windows event loops)
+        proc = await asyncio.to_thread(subprocess.run, [converter, str(gcode_path)], capture_output=True,
+                                       text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f"BGCode Error: conversion timed out after {timeout}s")
+        return None
+    except OSError as e:
+        print(f"BGCode Error: {e}")
+        return None
+    if proc.returncode != 0 or not target.exists():
+        print(f"BGCode Error: {proc.stderr.strip()}")
+        if target.exists(): os.remove(target)
+        return None
+    return target
@@ -0,0 +1,180 @@
+import json
+import struct
+import numpy as np
+from app.services.mesh import MeshError
+
+# glTF accessor componentType -> dtype, and element type -> component count
+COMPONENT_TYPES = {5120: "<i1", 5121: "<u1", 5122: "<i2", 5123: "<u2", 5125: "<u4", 5126: "<f4"}
+ELEMENT_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT4": 16}
+TRIANGLES = 4
+
+# glTF is Y-up (metres), the slicer is Z-up: (x, y, z) -> (x, -z, y) keeps the winding intact
+Y_UP_TO_Z_UP = np.array([[1, 0, 0], [0, 0, -1], [0, 1, 0]], dtype=np.float64)
+
+
+def read_glb(path):
+    """Returns (document, binary chunk) of a .glb file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < 12 or data[:4] != b"glTF":
+        raise MeshError("Not a GLB file.")
+    doc, binary = None, b""
+    offset = 12
+    while offset + 8 <= len(data):
+        length, kind = struct.unpack_from("<I4s", data, offset)
+        chunk = data[offset + 8:offset + 8 + length]
+        if kind == b"JSON": doc = json.loads(chunk)
+        elif kind == b"BIN\0": binary = chunk
+        offset += 8 + length
+    if doc is None: raise MeshError("GLB has no JSON chunk.")
+    return doc, binary
+
+
+def read_accessor(doc, binary, index):
+    """Accessor data as a float64 (count, size) array, honouring byteStride and `normalized`."""
+    acc = doc["accessors"][index]
+    if "bufferView" not in acc or "sparse" in acc:
+        raise MeshError("Sparse or empty accessors are not supported.")
+    view = doc["bufferViews"][acc["bufferView"]]
+    dtype = np.dtype(COMPONENT_TYPES[acc["componentType"]])
+    size = ELEMENT_SIZES[acc["type"]]
+    stride = view.get("byteStride") or dtype.itemsize * size
+    start = view.get("byteOffset", 0) + acc.get("byteOffset", 0)
+    data = np.ndarray((acc["count"], size), dtype=dtype, buffer=binary, offset=start,
+                      strides=(stride, dtype.itemsize)).astype(np.float64)
+    if acc.get("normalized") and dtype.kind in "iu":
+        data /= np.iinfo(dtype).max
+        if dtype.kind == "i": np.maximum(data, -1.0, out=data)
+    return data
+
+
+def node_matrix(node):
+    """Local 4x4 transform of a scene node (matrix, or translation/rotation/scale)."""
+    if "matrix" in node:
+        return np.array(node["matrix"], dtype=np.float64).reshape(4, 4).T  # stored column-major
+    x, y, z, w = node.get("rotation", (0, 0, 0, 1))
+    rotation = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+    m = np.eye(4)
+    m[:3, :3] = rotation * np.array(node.get("scale", (1, 1, 1)), dtype=np.float64)
+    m[:3, 3] = node.get("translation", (0, 0, 0))
+    return m
+
+
+def _mesh_instances(doc):
+    """(mesh index, world matrix) for every mesh placed in the default scene."""
+    nodes = doc.get("nodes", [])
+    scenes = doc.get("scenes")
+    if not scenes:
+        return [(i, np.eye(4)) for i in range(len(doc.get("meshes", [])))]
+    found = []
+    stack = [(i, np.eye(4)) for i in scenes[doc.get("scene", 0)].get("nodes", [])]
+    while stack:
+        index, parent = stack.pop()
+        node = nodes[index]
+        world = parent @ node_matrix(node)
+        if "mesh" in node: found.append((node["mesh"], world))
+        stack.extend((child, world) for child in node.get("children", []))
+    return found
+
+
+def load_glb(path, z_up=True):
+    """Returns the triangles of every mesh in a GLB as an (n, 3, 3) float64 array (Z-up by default).
+
+    Node transforms are applied, so the result is what a viewer shows. Only
+    triangle-list primitives are read; Draco-compressed files are refused.
+    """
+    doc, binary = read_glb(path)
+    if "KHR_draco_mesh_compression" in doc.get("extensionsRequired", []):
+        raise MeshError("Draco-compressed GLB files are not supported.")
+    parts = []
+    for mesh_index, world in _mesh_instances(doc):
+        for prim in doc["meshes"][mesh_index].get("primitives", []):
+            if prim.get("mode", TRIANGLES) != TRIANGLES or "POSITION" not in prim.get("attributes", {}):
+                continue
+            positions = read_accessor(doc, binary, prim["attributes"]["POSITION"])
+            if "indices" in prim:
+                indices = read_accessor(doc, binary, prim["indices"]).astype(np.int64).ravel()
+            else:
+                indices = np.arange(len(positions))
+            tris = positions[indices[:len(indices) - len(indices) % 3]].reshape(-1, 3, 3)
+            tris = tris @ world[:3, :3].T + world[:3, 3]
+            if np.linalg.det(world[:3, :3]) < 0: tris = tris[:, ::-1]  # mirrored node: keep normals outward
+            parts.append(tris)
+    if not parts or not sum(len(p) for p in parts):
+        raise MeshError("GLB contains no triangles.")
+    triangles = np.concatenate(parts)
+    return triangles @ Y_UP_TO_Z_UP.T if z_up else triangles
+
+
+def vertex_normals(vertices, faces):
+    """Area-weighted unit normals per vertex."""
+    tris = vertices[faces]
+    face_normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    corners = faces.ravel()
+    normals = np.stack([np.bincount(corners, weights=np.repeat(face_normals[:, i], 3), minlength=len(vertices))
+                        for i in range(3)], axis=1)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    return normals
+
+
+def _pad(data, fill=b"\0"):
+    return data + fill * (-len(data) % 4)
+
+
+def encode_glb(vertices, faces, color=(0.8, 0.8, 0.8, 1.0)):
+    """A compact GLB (KHR_mesh_quantization) for the viewer: one untextured mesh.
+
+    Positions are 16-bit (normalized, mapped back by a uniform node scale so
+    normals stay valid), normals 8-bit and indices 16-bit whenever they fit,
+    i.e. 12 bytes per vertex instead of 24.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    lo = vertices.min(axis=0)
+    extent = float((vertices.max(axis=0) - lo).max()) or 1.0
+    count = len(vertices)
+
+    # Vertex attribute elements must start on 4-byte boundaries: pad XYZ16 to 8 and XYZ8 to 4 bytes
+    positions = np.zeros((count, 4), dtype="<u2")
+    positions[:, :3] = np.round((vertices - lo) / extent * 65535)
+    normals = np.zeros((count, 4), dtype="<i1")
+    normals[:, :3] = np.round(vertex_normals(vertices, faces) * 127)
+    index_type = 5123 if count <= 65535 else 5125
+    indices = np.ascontiguousarray(faces, dtype="<u2" if index_type == 5123 else "<u4").ravel()
+
+    chunks = [positions.tobytes(), normals.tobytes(), _pad(indices.tobytes())]
+    views, offset = [], 0
+    for chunk, stride, target in zip(chunks, (8, 4, None), (34962, 34962, 34963)):
+        view = {"buffer": 0, "byteOffset": offset, "byteLength": len(chunk), "target": target}
+        if stride: view["byteStride"] = stride
+        views.append(view)
+        offset += len(chunk)
+    binary = b"".join(chunks)
+
+    doc = {
+        "asset": {"version": "2.0", "generator": "gift-app lod"},
+        "extensionsUsed": ["KHR_mesh_quantization"],
+        "extensionsRequired": ["KHR_mesh_quantization"],
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0, "translation": lo.tolist(), "scale": [extent] * 3}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0, "NORMAL": 1}, "indices": 2, "material": 0}]}],
+        "materials": [{"pbrMetallicRoughness": {"baseColorFactor": list(color), "metallicFactor": 0.0,
+                                                "roughnessFactor": 0.8}}],
+        "buffers": [{"byteLength": len(binary)}],
+        "bufferViews": views,
+        "accessors": [
+            {"bufferView": 0, "componentType": 5123, "normalized": True, "count": count, "type": "VEC3",
+             "min": [0.0, 0.0, 0.0], "max": [float(x) for x in positions[:, :3].max(axis=0) / 65535]},
+            {"bufferView": 1, "componentType": 5120, "normalized": True, "count": count, "type": "VEC3"},
+            {"bufferView": 2, "componentType": index_type, "count": len(indices), "type": "SCALAR"},
+        ],
+    }
+    text = _pad(json.dumps(doc, separators=(",", ":")).encode(), b" ")
+    length = 12 + 8 + len(text) + 8 + len(binary)
+    return (b"glTF" + struct.pack("<II", 2, length) + struct.pack("<I4s", len(text), b"JSON") + text
+            + struct.pack("<I4s", len(binary), b"BIN\0") + binary)
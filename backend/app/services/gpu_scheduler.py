@@ -0,0 +1,270 @@
+import time
+import uuid
+import asyncio
+from collections import deque
+from app.services import http_pool
+from app.services.job_events import hub as job_hub
+from app.services.metrics import metrics
+
+PHASES = ("image", "3d")
+
+
+class SchedulerFull(Exception):
+    """Raised when a phase already has `max_pending` jobs waiting."""
+
+
+class GpuJob:
+    def __init__(self, phase, workflow, prepare=None, node=0):
+        self.id = uuid.uuid4().hex
+        self.phase = phase
+        self.node = node
+        self.workflow = workflow
+        self.prepare = prepare
+        self.status = "pending"  # (preparing ->) pending -> submitted | failed
+        self.prompt_id = None
+        self.error = None
+        self.created_at = time.monotonic()
+
+
+class GpuScheduler:
+    """Owns the ComfyUI queue and orders work to minimize model swaps.
+
+    Stage-1 (image) and stage-2 (3D) jobs wait in separate queues. The
+    scheduler keeps submitting jobs of the current phase and only switches (and
+    calls /free) when that phase runs dry, or for fairness once it has run
+    `max_batch` jobs in a row or the other phase's oldest job has waited
+    `max_wait` seconds. At most `max_inflight` of our prompts sit in ComfyUI's
+    queue at once, and a phase switch waits for them to drain first.
+
+    One scheduler drives one ComfyUI node. `submit_prompt(workflow, node)`
+    queues a workflow there and returns its prompt_id (or None on failure).
+    """
+
+    def __init__(self, submit_prompt, node=0, max_inflight=2, max_pending=32, max_batch=4, max_wait=60, poll_interval=0.5):
+        self.submit_prompt = submit_prompt
+        self.node = node
+        self.max_inflight = max_inflight
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.pending = {phase: deque() for phase in PHASES}
+        self.preparing = {phase: 0 for phase in PHASES}
+        self.jobs = {}
+        self.phase = None
+        self.streak = 0
+        self.switches = 0
+        self._inflight = set()
+        self._wake = asyncio.Event()
+        self._task = None
+        self._prepares = set()
+
+    def submit(self, phase, workflow, prepare=None):
+        """Queues a workflow.
+
+        `prepare(job)` (async, e.g. bridging the input image) runs as a task of
+        its own and the job joins the queue once it has finished, so a slow
+        download or upload never holds up the other jobs of this node.
+        """
+        if len(self.pending[phase]) + self.preparing[phase] >= self.max_pending:
+            raise SchedulerFull(f"Too many {phase} jobs waiting, try again shortly.")
+        self._prune()
+        job = GpuJob(phase, workflow, prepare, self.node)
+        self.jobs[job.id] = job
+        if prepare is None:
+            self._enqueue(job)
+            return job
+        job.status = "preparing"
+        self.preparing[phase] += 1
+        task = asyncio.create_task(self._prepare(job))
+        self._prepares.add(task)
+        task.add_done_callback(self._prepares.discard)
+        return job
+
+    def _enqueue(self, job):
+        job.status = "pending"
+        self.pending[job.phase].append(job)
+        self._wake.set()
+
+    async def _prepare(self, job):
+        try:
+            await job.prepare(job)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self._enqueue(job)
+        finally:
+            self.preparing[job.phase] -= 1
+
+    def _fail(self, job, error):
+        job.status = "failed"
+        job.error = str(error)
+        metrics.inc("gpu_jobs_failed_total", phase=job.phase)
+        job_hub.publish(job.id, {"type": "failed", "message": job.error})
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def position(self, job):
+        if job.status == "preparing": return len(self.pending[job.phase]) + 1  # joins at the back
+        try:
+            return self.pending[job.phase].index(job) + 1
+        except ValueError:
+            return 0
+
+    def status(self, job):
+        """check_status-style answer for a job that has not reached ComfyUI yet."""
+        if job.status == "failed":
+            return {"status": "failed", "message": job.error}
+        return {"status": "queued", "position": self.position(job)}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in list(self._prepares): task.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _pick_phase(self):
+        waiting = [p for p in PHASES if self.pending[p]]
+        if self.phase in waiting:
+            others = [p for p in waiting if p != self.phase]
+            if not others: return self.phase
+            other = others[0]
+            starved = time.monotonic() - self.pending[other][0].created_at > self.max_wait
+            if self.streak < self.max_batch and not starved: return self.phase
+            return other
+        return min(waiting, key=lambda p: self.pending[p][0].created_at)
+
+    async def _refresh_inflight(self):
+        try:
+            resp = await http_pool.comfy("GET", "/queue", node=self.node, timeout_setting="poll_timeout")
+            queue = resp.json()
+            live = {item[1] for item in queue.get("queue_running", []) + queue.get("queue_pending", [])}
+            self._inflight &= live
+        except Exception as e:
+            print(f"ComfyUI Queue Error: {e}")
+
+    async def _run(self):
+        while True:
+            if not any(self.pending.values()):
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            if self._inflight: await self._refresh_inflight()
+            if len(self._inflight) >= self.max_inflight:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            phase = self._pick_phase()
+            if phase != self.phase:
+                if self._inflight:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                if self.phase is not None:
+                    # Evict the previous phase's models only when actually switching
+                    try:
+                        await http_pool.comfy("POST", "/free", node=self.node, json={"unload_models": True, "free_memory": True})
+                    except Exception as e:
+                        print(f"ComfyUI Free Error: {e}")
+                    self.switches += 1
+                    metrics.inc("gpu_phase_switches_total", node=self.node)
+                self.phase = phase
+                self.streak = 0
+
+            await self._dispatch(self.pending[phase].popleft())
+
+    async def _dispatch(self, job):
+        metrics.observe("gpu_scheduler_wait", time.monotonic() - job.created_at, phase=job.phase)
+        try:
+            prompt_id = await self.submit_prompt(job.workflow, self.node)
+            if not prompt_id: raise RuntimeError("ComfyUI did not accept the workflow.")
+        except Exception as e:
+            self._fail(job, e)
+            return
+        job.status = "submitted"
+        job.prompt_id = prompt_id
+        job.workflow = None
+        self._inflight.add(prompt_id)
+        self.streak += 1
+        job_hub.alias(prompt_id, job.id)
+        job_hub.publish(job.id, {"type": "submitted"})
+
+    def _prune(self, keep=4096):
+        if len(self.jobs) <= keep: return
+        for job_id in list(self.jobs)[:len(self.jobs) - keep]:
+            if self.jobs[job_id].status not in ("preparing", "pending"): del self.jobs[job_id]
+
+    def backlog(self):
+        return sum(len(q) for q in self.pending.values()) + sum(self.preparing.values())
+
+    def stats(self):
+        return {
+            "node": self.node,
+            "phase": self.phase,
+            "pending": {phase: len(q) for phase, q in self.pending.items()},
+            "preparing": dict(self.preparing),
+            "inflight": len(self._inflight),
+            "phase_switches": self.switches,
+        }
+
+
+class GpuCluster:
+    """One GpuScheduler per ComfyUI node in a ComfyPool.
+
+    New work goes to the least-loaded healthy node (its ComfyUI queue depth
+    plus what we still hold back for it); work that needs a particular
+    machine's files is pinned with `node=`.
+    """
+
+    def __init__(self, pool, submit_prompt, **scheduler_options):
+        self.pool = pool
+        self.submit_prompt = submit_prompt
+        self.scheduler_options = scheduler_options
+        self._schedulers = None
+
+    @property
+    def schedulers(self):
+        if self._schedulers is None:
+            self._schedulers = [GpuScheduler(self.submit_prompt, node.index, **self.scheduler_options)
+                                for node in self.pool.nodes]
+        return self._schedulers
+
+    def submit(self, phase, workflow, prepare=None, node=None):
+        if node is None: node = self.pool.pick(lambda i: self.schedulers[i].backlog())
+        job = self.schedulers[node].submit(phase, workflow, prepare)
+        self.pool.pin(job.id, node)
+        return job
+
+    def get(self, job_id):
+        for scheduler in self.schedulers:
+            job = scheduler.get(job_id)
+            if job is not None: return job
+        return None
+
+    def position(self, job):
+        return self.schedulers[job.node].position(job)
+
+    def status(self, job):
+        return self.schedulers[job.node].status(job)
+
+    def start(self):
+        self.pool.start()
+        for scheduler in self.schedulers:
+            scheduler.start()
+
+    async def stop(self):
+        for scheduler in self.schedulers:
+            await scheduler.stop()
+        await self.pool.stop()
+
+    def stats(self):
+        return {"nodes": [{**node.to_dict(), **scheduler.stats()}
+                          for node, scheduler in zip(self.pool.nodes, self.schedulers)]}
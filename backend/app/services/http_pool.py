@@ -0,0 +1,114 @@
+import os
+import asyncio
+import contextlib
+import httpx
+
+
+def comfy_urls():
+    """ComfyUI nodes: COMFY_URLS (comma-separated) or the single COMFY_URL."""
+    urls = os.getenv("COMFY_URLS") or os.getenv("COMFY_URL", "http://127.0.0.1:8188")
+    return [url.strip().rstrip("/") for url in urls.split(",") if url.strip()]
+
+
+# Per-backend settings. Values are read lazily (on first use) so that
+# load_dotenv() in main.py has already populated the environment.
+# "comfy:<n>" is ComfyUI node n from comfy_urls(), with the "comfy" settings.
+BACKENDS = {
+    "comfy": {
+        "base_url": lambda: comfy_urls()[0],
+        "timeout": lambda: float(os.getenv("COMFY_TIMEOUT", "10")),
+        "poll_timeout": lambda: float(os.getenv("COMFY_POLL_TIMEOUT", "3")),       # /history, /queue checks
+        "upload_timeout": lambda: float(os.getenv("COMFY_UPLOAD_TIMEOUT", "60")),  # /upload/image, /view
+        "retries": lambda: int(os.getenv("COMFY_RETRIES", "2")),
+        "max_concurrency": lambda: int(os.getenv("COMFY_MAX_CONCURRENCY", "64")),
+    },
+    "ollama": {
+        "base_url": lambda: os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
+        "timeout": lambda: float(os.getenv("OLLAMA_TIMEOUT", "40")),
+        "vlm_timeout": lambda: float(os.getenv("VLM_TIMEOUT", "30")),
+        "retries": lambda: int(os.getenv("OLLAMA_RETRIES", "1")),
+        "max_concurrency": lambda: int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4")),
+    },
+}
+
+_clients = {}
+_limits = {}
+
+# Connection errors mean the request never reached the server, so they are
+# safe to retry for any method. Other transport errors are only retried for
+# idempotent methods (a repeated POST /prompt would queue the job twice).
+_SAFE_RETRY = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+_IDEMPOTENT = {"GET", "HEAD", "OPTIONS"}
+
+
+def _config(backend):
+    if backend in BACKENDS: return BACKENDS[backend]
+    name, _, index = backend.partition(":")
+    return {**BACKENDS[name], "base_url": lambda: comfy_urls()[int(index)]}
+
+
+def get_client(backend):
+    """Returns the shared, connection-pooled AsyncClient for a backend."""
+    client = _clients.get(backend)
+    if client is None:
+        cfg = _config(backend)
+        max_conn = cfg["max_concurrency"]()
+        client = httpx.AsyncClient(
+            base_url=cfg["base_url"](),
+            timeout=httpx.Timeout(cfg["timeout"](), connect=5.0),
+            limits=httpx.Limits(max_connections=max_conn, max_keepalive_connections=max_conn),
+        )
+        _clients[backend] = client
+        _limits[backend] = asyncio.Semaphore(max_conn)
+    return client
+
+
+async def request(backend, method, url, timeout_setting=None, **kwargs):
+    """Sends a request through the backend's pool with retries and a concurrency cap.
+
+    `url` may be a path (joined to the backend base URL) or an absolute URL.
+    `timeout_setting` picks one of the backend's other timeouts (e.g.
+    "poll_timeout") instead of its default. Raises httpx.HTTPError once the
+    retries are exhausted.
+    """
+    client = get_client(backend)
+    cfg = _config(backend)
+    if timeout_setting: kwargs["timeout"] = cfg[timeout_setting]()
+    retries = cfg["retries"]()
+    method = method.upper()
+    attempt = 0
+    while True:
+        try:
+            async with _limits[backend]:
+                return await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            retryable = isinstance(e, _SAFE_RETRY) or method in _IDEMPOTENT
+            if not retryable or attempt >= retries:
+                raise
+            attempt += 1
+            await asyncio.sleep(0.25 * 2 ** attempt)
+
+
+@contextlib.asynccontextmanager
+async def stream(backend, method, url, **kwargs):
+    """Streams a response body through the backend's pool (no retries once bytes flow)."""
+    client = get_client(backend)
+    async with _limits[backend]:
+        async with client.stream(method.upper(), url, **kwargs) as resp:
+            yield resp
+
+
+async def comfy(method, path, node=0, **kwargs):
+    return await request(f"comfy:{node}", method, path, **kwargs)
+
+
+async def ollama(method, url, **kwargs):
+    return await request("ollama", method, url, **kwargs)
+
+
+async def close_clients():
+    """Closes every pooled client (called on application shutdown)."""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+    _limits.clear()
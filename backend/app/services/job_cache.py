@@ -0,0 +1,77 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+
+class JobResultCache:
+    """TTL + LRU store for finished job results, so each job is resolved (and uploaded) once.
+
+    `on_evict(job_id)` is called when an entry expires or is pushed out.
+    """
+
+    def __init__(self, max_entries=1024, ttl=6 * 3600, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._locks = {}
+
+    def get(self, job_id):
+        entry = self._entries.get(job_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(job_id)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[job_id]
+            self._evicted(job_id)
+        self.misses += 1
+        return None
+
+    def put(self, job_id, result):
+        self._entries[job_id] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(job_id)
+        while len(self._entries) > self.max_entries:
+            self._evicted(self._entries.popitem(last=False)[0])
+
+    def _evicted(self, job_id):
+        self.evictions += 1
+        if self.on_evict is not None: self.on_evict(job_id)
+
+    async def resolve(self, job_id, compute):
+        """Returns the cached result or runs `compute()` under a per-job lock.
+
+        `compute` returns `(result, cacheable)`; only cacheable (final and
+        complete) results are stored. Concurrent polls of the same job wait for
+        the first one instead of resolving (and uploading) in parallel.
+        """
+        cached = self.get(job_id)
+        if cached is not None: return cached
+
+        slot = self._locks.setdefault(job_id, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                entry = self._entries.get(job_id)
+                if entry is not None and entry[0] > time.monotonic():
+                    return entry[1]
+                result, cacheable = await compute()
+                if cacheable: self.put(job_id, result)
+                return result
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0: del self._locks[job_id]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
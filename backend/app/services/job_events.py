@@ -0,0 +1,196 @@
+import json
+import uuid
+import time
+import asyncio
+import websockets
+from app.services import http_pool
+from app.services.metrics import metrics
+
+TERMINAL_STATUSES = ("completed", "rejected", "failed", "unknown")
+
+
+def sse(event, data):
+    """Formats one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class JobEventHub:
+    """Keeps ONE websocket subscription per ComfyUI node and fans job events out to listeners.
+
+    Prompts must be queued with `client_id=hub.client_id`, otherwise ComfyUI only
+    sends their progress to whoever submitted them.
+    """
+
+    def __init__(self):
+        self.client_id = uuid.uuid4().hex
+        self._connected = set()
+        self._subscribers = {}
+        self._aliases = {}
+        self._timings = {}  # prompt_id -> [queued_at, started_at]
+        self._tasks = []
+
+    @property
+    def connected(self):
+        """True while every node's feed is up (otherwise streams fall back to polling)."""
+        return bool(self._tasks) and len(self._connected) == len(self._tasks)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run(url)) for url in http_pool.comfy_urls()]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._connected.clear()
+
+    def subscribe(self, job_id):
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id, queue):
+        queues = self._subscribers.get(job_id)
+        if queues:
+            queues.discard(queue)
+            if not queues: del self._subscribers[job_id]
+
+    def publish(self, job_id, event):
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(event)
+
+    def alias(self, prompt_id, job_id):
+        """Also delivers a ComfyUI prompt's events to listeners of our own job id."""
+        self._aliases[prompt_id] = job_id
+        self._timings[prompt_id] = [time.monotonic(), None]
+        if len(self._timings) > 4096: del self._timings[next(iter(self._timings))]
+
+    def _time(self, prompt_id, kind):
+        """ComfyUI queue wait (queued -> first node runs) and execution time (-> finished)."""
+        timing = self._timings.get(prompt_id)
+        if timing is None: return
+        now = time.monotonic()
+        if timing[1] is None and kind in ("progress", "executing"):
+            timing[1] = now
+            metrics.observe("comfy_queue_wait", now - timing[0])
+        elif kind in ("finished", "failed"):
+            del self._timings[prompt_id]
+            if timing[1] is not None: metrics.observe("comfy_execution", now - timing[1])
+            metrics.inc("comfy_prompts_total", result=kind)
+
+    def _emit(self, prompt_id, event):
+        self._time(prompt_id, event["type"])
+        self.publish(prompt_id, event)
+        job_id = self._aliases.get(prompt_id)
+        if job_id is not None:
+            self.publish(job_id, event)
+            if event["type"] in ("finished", "failed"): del self._aliases[prompt_id]
+
+    def _ws_url(self, base):
+        base = base.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+        return f"{base}/ws?clientId={self.client_id}"
+
+    async def _run(self, url):
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(self._ws_url(url), max_size=None) as ws:
+                    self._connected.add(url)
+                    delay = 1
+                    print(f"DEBUG: Connected to ComfyUI event feed at {url}")
+                    async for message in ws:
+                        if isinstance(message, bytes): continue  # latent previews
+                        self._dispatch(json.loads(message))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ComfyUI Event Feed Error ({url}): {e}")
+            self._connected.discard(url)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def _dispatch(self, message):
+        data = message.get("data") or {}
+        job_id = data.get("prompt_id")
+        if not job_id: return
+        kind = message.get("type")
+        if kind == "progress":
+            self._emit(job_id, {"type": "progress", "node": data.get("node"),
+                                "value": data.get("value"), "max": data.get("max")})
+        elif kind == "executing" and data.get("node") is not None:
+            self._emit(job_id, {"type": "executing", "node": data["node"]})
+        elif kind == "execution_success" or (kind == "executing" and data.get("node") is None):
+            self._emit(job_id, {"type": "finished"})
+        elif kind in ("execution_error", "execution_interrupted"):
+            self._emit(job_id, {"type": "failed", "message": data.get("exception_message", kind)})
+
+    async def stream(self, job_id, resolve, keepalive=15, settle_interval=2.0):
+        """Yields SSE frames for one job until it reaches a terminal status.
+
+        `resolve` is the app's job_status coroutine; it is called once up front
+        (the job may already be done), when ComfyUI reports completion, and on
+        every keepalive tick, so a missed event only delays the result. After
+        completion it keeps being called every `settle_interval` seconds until
+        the result is terminal (uploads can take longer than the history lag).
+        A completed result whose previews are still building is followed by a
+        `lods` frame once they are ready (or failed).
+        """
+        queue = self.subscribe(job_id)
+        finished = False
+        try:
+            result = await resolve(job_id)
+            if result.get("status") in TERMINAL_STATUSES:
+                async for frame in self._final(job_id, resolve, result, queue, settle_interval): yield frame
+                return
+            yield sse("queued", {"job_id": job_id})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), settle_interval if finished else keepalive)
+                except asyncio.TimeoutError:
+                    # Also while the feed is up: the completion message may have been lost
+                    # in a reconnect gap or sent before the prompt alias existed
+                    result = await resolve(job_id)
+                    if result.get("status") in TERMINAL_STATUSES:
+                        async for frame in self._final(job_id, resolve, result, queue, settle_interval): yield frame
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+
+                if event["type"] == "failed":
+                    yield sse("failed", {"status": "failed", "message": event["message"]})
+                    return
+                if event["type"] != "finished":
+                    yield sse(event["type"], event)
+                    continue
+                # History can lag the websocket by a moment; retry briefly, then keep polling
+                for _ in range(5):
+                    result = await resolve(job_id)
+                    if result.get("status") in TERMINAL_STATUSES:
+                        async for frame in self._final(job_id, resolve, result, queue, settle_interval): yield frame
+                        return
+                    await asyncio.sleep(0.5)
+                finished = True
+        finally:
+            self.unsubscribe(job_id, queue)
+
+
+    async def _final(self, job_id, resolve, result, queue, interval, timeout=300):
+        """The terminal frame, then the `lods` frame if previews were still being built."""
+        yield sse(result["status"], result)
+        if result.get("lods_status") != "pending": return
+        deadline = time.monotonic() + timeout
+        while result.get("lods_status") == "pending" and time.monotonic() < deadline:
+            try:
+                await asyncio.wait_for(queue.get(), interval)  # the app publishes a "lods" event
+            except asyncio.TimeoutError:
+                pass
+            result = await resolve(job_id)
+        yield sse("lods", {"lods_status": result.get("lods_status"), "lods": result.get("lods", [])})
+
+
+hub = JobEventHub()
@@ -0,0 +1,70 @@
+import os
+import asyncio
+import hashlib
+from pathlib import Path
+from app.services.gltf import encode_glb, load_glb
+from app.services.mesh import decimate
+
+
+def lod_budgets():
+    """Triangle counts of the preview levels, from GLB_LOD_TRIANGLES (comma-separated)."""
+    raw = os.getenv("GLB_LOD_TRIANGLES", "5000,25000,100000")
+    return sorted(int(v) for v in raw.split(",") if v.strip())
+
+
+def build_lods(src, out_dir, budgets=None):
+    """Writes quantized, decimated copies of a GLB into `out_dir`, smallest first.
+
+    Levels at or above the source's own triangle count are skipped (the
+    original is the top level). File names are content hashes, so the same
+    mesh always produces the same files. Returns ([{path, triangles, bytes}], source triangles).
+    """
+    triangles = load_glb(src, z_up=False)
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    levels = []
+    for budget in budgets or lod_budgets():
+        if budget >= len(triangles): break
+        vertices, faces = decimate(triangles, budget)
+        data = encode_glb(vertices, faces)
+        path = Path(out_dir) / f"lod_{hashlib.sha256(data).hexdigest()[:24]}.glb"
+        path.write_bytes(data)
+        levels.append({"path": path, "triangles": len(faces), "bytes": len(data)})
+    return levels, len(triangles)
+
+
+def manifest(levels, urls, source_triangles, source_bytes, source_url):
+    """check-status `lods` entry: every level (then the original) with its size and URL, coarsest first."""
+    entries = [{"level": i, "triangles": level["triangles"], "bytes": level["bytes"], "url": url}
+               for i, (level, url) in enumerate(zip(levels, urls))]
+    entries.append({"level": len(entries), "triangles": source_triangles, "bytes": source_bytes,
+                    "url": source_url, "original": True})
+    return entries
+
+
+_building = set()  # background builds, referenced until they finish
+
+
+def attach_later(result, build, on_done=None):
+    """Runs the `build` coroutine in the background and adds its manifest to `result` when done.
+
+    `result` is the check-status dict that is returned (and cached) right away,
+    so building the previews never delays the poll that completes the job;
+    `lods_status` goes pending -> ready (with `lods`) or failed, then
+    `on_done(result)` runs (to store the row and wake SSE listeners).
+    """
+    result["lods_status"] = "pending"
+
+    async def run():
+        try:
+            manifest = await build
+        except Exception as e:
+            print(f"LOD Error: {e}")
+            manifest = None
+        if manifest: result["lods"] = manifest
+        result["lods_status"] = "ready" if manifest else "failed"
+        if on_done is not None: on_done(result)
+
+    task = asyncio.create_task(run())
+    _building.add(task)
+    task.add_done_callback(_building.discard)
+    return task
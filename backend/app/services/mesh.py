@@ -0,0 +1,301 @@
+import os
+import re
+import numpy as np
+from dataclasses import dataclass
+from typing import Tuple
+from app.services.pricing import weight_from_volume, price_for_weight
+
+# Binary STL: 80-byte header, uint32 triangle count, then 50 bytes per triangle
+STL_HEADER = 84
+STL_DTYPE = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attr", "<u2")])
+_ASCII_VERTEX = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+
+# Max: 100 x 100 mm footprint (PedestalControls.js); height from config.ini max_print_height
+PRINT_ENVELOPE_MM = (100.0, 100.0, 200.0)
+
+
+class MeshError(ValueError):
+    """Raised for unreadable meshes or meshes that do not fit the printer."""
+
+
+@dataclass
+class MeshStats:
+    triangles: int
+    volume_cm3: float
+    area_cm2: float
+    bbox_min: Tuple[float, float, float]
+    bbox_max: Tuple[float, float, float]
+
+    @property
+    def size_mm(self):
+        return tuple(round(hi - lo, 2) for lo, hi in zip(self.bbox_min, self.bbox_max))
+
+
+def is_binary_stl(path):
+    size = os.path.getsize(path)
+    if size < STL_HEADER: return False
+    with open(path, "rb") as f:
+        f.seek(80)
+        count = int.from_bytes(f.read(4), "little")
+    return size == STL_HEADER + count * STL_DTYPE.itemsize
+
+
+def load_stl(path):
+    """Returns an (n, 3, 3) float32 array of triangle vertices.
+
+    Binary files are memory-mapped rather than read; ASCII files fall back to a
+    regex scan of the `vertex` lines.
+    """
+    if is_binary_stl(path):
+        count = (os.path.getsize(path) - STL_HEADER) // STL_DTYPE.itemsize
+        if count == 0: raise MeshError("STL contains no triangles.")
+        return np.memmap(path, dtype=STL_DTYPE, mode="r", offset=STL_HEADER, shape=(count,))["vertices"]
+
+    with open(path, "rb") as f:
+        coords = _ASCII_VERTEX.findall(f.read())
+    if not coords or len(coords) % 3:
+        raise MeshError("Not a valid STL file.")
+    try:
+        return np.array(coords, dtype=np.float32).reshape(-1, 3, 3)
+    except ValueError:
+        raise MeshError("STL contains non-numeric vertex data.")
+
+
+def mesh_stats(triangles):
+    """Signed volume, surface area and bounding box straight from the triangles (mm in, cm out)."""
+    v = np.asarray(triangles, dtype=np.float64)
+    v0, v1, v2 = v[:, 0], v[:, 1], v[:, 2]
+    area_mm2 = 0.5 * np.linalg.norm(np.cross(v1 - v0, v2 - v0), axis=1).sum()
+    volume_mm3 = abs(np.einsum("ij,ij->", v0, np.cross(v1, v2))) / 6.0
+    points = v.reshape(-1, 3)
+    return MeshStats(
+        triangles=len(v),
+        volume_cm3=float(volume_mm3) / 1000.0,
+        area_cm2=float(area_mm2) / 100.0,
+        bbox_min=tuple(float(x) for x in points.min(axis=0)),
+        bbox_max=tuple(float(x) for x in points.max(axis=0)),
+    )
+
+
+def check_envelope(stats, envelope=PRINT_ENVELOPE_MM):
+    x, y, z = stats.size_mm
+    if x > envelope[0] or y > envelope[1] or z > envelope[2]:
+        raise MeshError(
+            f"Model is {x} x {y} x {z} mm; max print size is "
+            f"{envelope[0]:g} x {envelope[1]:g} x {envelope[2]:g} mm."
+        )
+
+
+def load_print_profile(config_path):
+    """Reads the few config.ini settings the estimate needs."""
+    values = {}
+    with open(config_path) as f:
+        for line in f:
+            if " = " in line and not line.startswith("#"):
+                key, value = line.split(" = ", 1)
+                values[key.strip()] = value.strip()
+
+    def num(key, default):
+        try:
+            return float(values.get(key, "").rstrip("%"))
+        except ValueError:
+            return default
+
+    nozzle = num("nozzle_diameter", 0.4)
+    return {
+        # Walls: perimeters x ~1.125 nozzle width (PrusaSlicer's default extrusion width)
+        "shell_mm": num("perimeters", 2) * nozzle * 1.125,
+        "infill": num("fill_density", 20) / 100.0,
+        "max_height_mm": num("max_print_height", PRINT_ENVELOPE_MM[2]),
+    }
+
+
+def estimate_quote(stats, profile):
+    """Instant weight/price estimate using the same density and pricing as the slicer path.
+
+    The printed volume is approximated as a solid shell (surface area x wall
+    thickness) plus the infill fraction of whatever is left inside.
+    """
+    shell_cm3 = min(stats.volume_cm3, stats.area_cm2 * profile["shell_mm"] / 10.0)
+    printed_cm3 = shell_cm3 + (stats.volume_cm3 - shell_cm3) * profile["infill"]
+    weight_g = weight_from_volume(printed_cm3)
+    return {
+        "estimated": True,
+        "triangles": stats.triangles,
+        "size_mm": stats.size_mm,
+        "volume_cm3": round(stats.volume_cm3, 2),
+        "weight": round(weight_g, 1),
+        "price": round(price_for_weight(weight_g), 2),
+    }
+
+
+def quote_stl(path, profile):
+    """Loads an STL, rejects it if it does not fit the envelope, and returns the instant estimate."""
+    stats = mesh_stats(load_stl(path))
+    check_envelope(stats, (PRINT_ENVELOPE_MM[0], PRINT_ENVELOPE_MM[1], profile["max_height_mm"]))
+    return estimate_quote(stats, profile)
+
+
+# --- PRINT PREPARATION (server-side version of the ModelViewer.js export) ---
+
+@dataclass
+class Pedestal:
+    """Base settings as sent by PedestalControls.js (all in mm).
+
+    `offset` is how far above the bed the model starts (the viewer defaults it
+    to the base height); `scale` multiplies the automatic fit, which makes the
+    model's largest side 70% of the base width like the viewer does.
+    """
+    shape: str = "box"
+    width: float = 60.0
+    depth: float = 60.0
+    height: float = 10.0
+    offset: float = 10.0
+    scale: float = 1.0
+    modelZOffset: float = 0.0  # back/front shift, named as in the frontend settings
+    segments: int = 64
+
+
+def write_stl(path, triangles, header=b"gift-app"):
+    """Writes triangles as binary STL with per-facet normals (50 bytes per triangle)."""
+    v = np.asarray(triangles, dtype=np.float32)
+    normals = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    records = np.zeros(len(v), dtype=STL_DTYPE)
+    records["normal"] = normals
+    records["vertices"] = v
+    with open(path, "wb") as f:
+        f.write(header[:80].ljust(80, b"\0"))
+        f.write(np.uint32(len(v)).tobytes())
+        records.tofile(f)
+
+
+def cluster_vertices(triangles, cell):
+    """Vertex clustering: snaps every vertex to a `cell`-sized grid and merges each cell into one.
+
+    Returns (vertices, faces). Triangles that collapse (two corners in the same
+    cell) and duplicates are dropped, so the face count falls roughly with
+    the square of the cell size.
+    """
+    points = np.asarray(triangles, dtype=np.float64).reshape(-1, 3)
+    grid = np.floor((points - points.min(axis=0)) / cell).astype(np.int64)
+    # One int64 key per cell (21 bits per axis, ~2M cells per side)
+    grid = np.minimum(grid, (1 << 21) - 1)
+    keys = (grid[:, 0] << 42) | (grid[:, 1] << 21) | grid[:, 2]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    vertices = np.stack([np.bincount(inverse, weights=points[:, i], minlength=len(counts)) for i in range(3)], axis=1)
+    vertices /= counts[:, None]
+
+    faces = inverse.reshape(-1, 3)
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    return vertices, faces[np.sort(first)]
+
+
+def shell_labels(faces, vertex_count):
+    """Index of the connected shell each face belongs to (faces sharing a vertex are connected).
+
+    Min-label propagation over the faces with pointer jumping, so it takes a
+    handful of vectorized passes rather than one per ring of faces.
+    """
+    parent = np.arange(vertex_count)
+    while True:
+        low = parent[faces].min(axis=1)
+        nxt = parent.copy()
+        np.minimum.at(nxt, faces.ravel(), np.repeat(low, 3))
+        nxt = nxt[nxt]
+        if np.array_equal(nxt, parent): break
+        parent = nxt
+    return np.unique(parent[faces[:, 0]], return_inverse=True)[1].ravel()
+
+
+def orient_shells(vertices, faces):
+    """Flips every shell whose signed volume is negative, so all normals point outward.
+
+    Generated meshes often mix shells of either winding; summed as they are,
+    an inverted shell subtracts its volume instead of adding it.
+    """
+    if not len(faces): return faces
+    labels = shell_labels(faces, len(vertices))
+    tris = vertices[faces] - vertices.mean(axis=0)
+    signed = np.einsum("ij,ij->i", tris[:, 0], np.cross(tris[:, 1], tris[:, 2]))
+    flip = (np.bincount(labels, weights=signed) < 0)[labels]
+    faces = faces.copy()
+    faces[flip] = faces[flip][:, [0, 2, 1]]
+    return faces
+
+
+def decimate(triangles, max_triangles, rounds=8):
+    """Reduces a triangle soup to at most `max_triangles` by vertex clustering. Returns (vertices, faces).
+
+    The first cell size comes from the surface area (a clustered surface has
+    about two triangles per occupied cell); each round grows it by the
+    remaining overshoot. Meshes already under budget are only welded.
+    """
+    v = np.asarray(triangles, dtype=np.float64)
+    extent = float(np.ptp(v.reshape(-1, 3), axis=0).max()) or 1.0
+    if len(v) <= max_triangles:
+        return cluster_vertices(v, extent * 1e-6)
+    area = 0.5 * np.linalg.norm(np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0]), axis=1).sum()
+    cell = max(np.sqrt(2.0 * area / max_triangles), extent * 1e-6)
+    for _ in range(rounds):
+        vertices, faces = cluster_vertices(v, cell)
+        if len(faces) <= max_triangles: return vertices, faces
+        cell *= np.sqrt(len(faces) / max_triangles) * 1.05
+    raise MeshError(f"Could not reduce the model below {max_triangles} triangles.")
+
+
+def fit_model(triangles, size_mm, offset_mm=0.0, shift_y_mm=0.0):
+    """Scales the model so its largest side is `size_mm`, centred on X/Y, bottom at `offset_mm`."""
+    v = np.asarray(triangles, dtype=np.float64)
+    lo, hi = v.reshape(-1, 3).min(axis=0), v.reshape(-1, 3).max(axis=0)
+    largest = float((hi - lo).max())
+    if largest <= 0: raise MeshError("Model has no extent.")
+    scale = size_mm / largest
+    origin = np.array([(lo[0] + hi[0]) / 2, (lo[1] + hi[1]) / 2, lo[2]])
+    return (v - origin) * scale + np.array([0.0, shift_y_mm, offset_mm])
+
+
+def pedestal_mesh(base):
+    """Closed box or cylinder triangles for the base, standing on z=0 and centred on X/Y."""
+    h = base.height
+    if base.shape == "cylinder":
+        r = base.width / 2.0  # the viewer's cylinder is round: width is the diameter
+        angles = np.linspace(0, 2 * np.pi, base.segments, endpoint=False)
+        ring = np.stack([r * np.cos(angles), r * np.sin(angles), np.zeros_like(angles)], axis=1)
+        nxt = np.roll(ring, -1, axis=0)
+        up = np.array([0.0, 0.0, h])
+        bottom_c, top_c = np.zeros(3), up
+        top = np.stack([np.broadcast_to(top_c, ring.shape), ring + up, nxt + up], axis=1)
+        bottom = np.stack([np.broadcast_to(bottom_c, ring.shape), nxt, ring], axis=1)
+        side_a = np.stack([ring, nxt, nxt + up], axis=1)
+        side_b = np.stack([ring, nxt + up, ring + up], axis=1)
+        return np.concatenate([top, bottom, side_a, side_b])
+
+    x, y = base.width / 2.0, base.depth / 2.0
+    c = np.array([[-x, -y, 0], [x, -y, 0], [x, y, 0], [-x, y, 0],
+                  [-x, -y, h], [x, -y, h], [x, y, h], [-x, y, h]], dtype=np.float64)
+    faces = [(0, 2, 1), (0, 3, 2), (4, 5, 6), (4, 6, 7), (0, 1, 5), (0, 5, 4),
+             (1, 2, 6), (1, 6, 5), (2, 3, 7), (2, 7, 6), (3, 0, 4), (3, 4, 7)]
+    return c[np.array(faces)]
+
+
+def prepare_print(model_triangles, stl_path, base, max_triangles, envelope=PRINT_ENVELOPE_MM):
+    """Decimates the model, fits it onto the base, merges the base and writes one binary STL.
+
+    Returns the MeshStats of the written mesh plus the model's triangle count before decimation.
+    """
+    source_triangles = len(model_triangles)
+    budget = max(max_triangles - (4 * base.segments if base.shape == "cylinder" else 12), 1)
+    vertices, faces = decimate(model_triangles, budget)
+    # Per-shell orientation: the merged volume is then a plain sum (the base is built outward)
+    faces = orient_shells(vertices, faces)
+    # The viewer is Y-up: its +Z (towards the front) is -Y here, as in gltf.Y_UP_TO_Z_UP
+    model = fit_model(vertices[faces], base.width * 0.7 * base.scale, base.offset, -base.modelZOffset)
+    merged = np.concatenate([model, pedestal_mesh(base)])
+    stats = mesh_stats(merged)
+    check_envelope(stats, envelope)
+    write_stl(stl_path, merged)
+    return stats, source_triangles
@@ -0,0 +1,156 @@
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+
+# (trace_id, spans) for the request being handled, when tracing is on
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs: return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def _quantile(ordered, q):
+    if not ordered: return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None: self.registry.inc(f"{self.name}_errors_total", **self.labels)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class Metrics:
+    """In-process counters, latency summaries and gauges, rendered in Prometheus text format.
+
+    Latencies keep the last `window` observations per series, so the
+    p50/p95/p99 reported on /metrics describe recent traffic.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=2048):
+        self.window = window
+        self._counters = {}
+        self._summaries = {}
+        self._gauges = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (f"{name}_seconds", _labels(labels))
+        with self._lock:
+            series = self._summaries.get(key)
+            if series is None:
+                series = self._summaries[key] = [deque(maxlen=self.window), 0.0, 0]
+            series[0].append(seconds)
+            series[1] += seconds
+            series[2] += 1
+        spans = _trace.get()
+        if spans is not None: spans[1].append((name, seconds))
+
+    def timer(self, name, **labels):
+        """`with` / `async with` block timed into `<name>_seconds`; exceptions count into `<name>_errors_total`."""
+        return _Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        """Decorator form of timer() for coroutine functions."""
+        def wrap(func):
+            async def wrapper(*args, **kwargs):
+                async with self.timer(name, **labels):
+                    return await func(*args, **kwargs)
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+        return wrap
+
+    def gauge(self, name, read, text=None):
+        """Registers `read()` (a number, or {labels dict as tuple: number}) sampled at scrape time."""
+        self._gauges[name] = read
+        if text: self.describe(name, text)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {key: (sorted(s[0]), s[1], s[2]) for key, s in self._summaries.items()}
+
+        def header(name, kind):
+            if name in self._help: lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in seen: header(name, "counter"); seen.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (ordered, total, count) in sorted(summaries.items()):
+            if name not in seen: header(name, "summary"); seen.add(name)
+            for q in self.QUANTILES:
+                lines.append(f"{name}{_format_labels(labels, [('quantile', q)])} {_quantile(ordered, q):.6f}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for name, read in sorted(self._gauges.items()):
+            try:
+                value = read()
+            except Exception as e:
+                print(f"Metrics Gauge Error ({name}): {e}")
+                continue
+            header(name, "gauge")
+            samples = value.items() if isinstance(value, dict) else [((), value)]
+            for labels, sample in samples:
+                lines.append(f"{name}{_format_labels(labels)} {float(sample)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+async def trace_requests(request, call_next):
+    """HTTP middleware: tags the request with a trace id (X-Trace-Id, taken from the
+    caller if present) and prints how long each instrumented stage took."""
+    trace_id = request.headers.get("x-trace-id") or uuid.uuid4().hex[:16]
+    token = _trace.set((trace_id, []))
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _, spans = _trace.get()
+        _trace.reset(token)
+    elapsed = (time.perf_counter() - start) * 1000
+    stages = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in spans)
+    print(f"TRACE {trace_id} {request.method} {request.url.path} {response.status_code} {elapsed:.0f}ms {stages}")
+    response.headers["X-Trace-Id"] = trace_id
+    return response
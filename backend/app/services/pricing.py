@@ -0,0 +1,18 @@
+# PLA Density is 1.24g/cm3
+PLA_DENSITY = 1.24
+
+# Pricing: (Material * 0.05) + 5€ setup + 7€ profit
+PRICE_PER_GRAM = 0.05
+SETUP_FEE = 5
+PROFIT = 7
+# Force a minimum price for tiny objects
+MIN_PRICE = 12.00
+
+
+def weight_from_volume(volume_cm3, density=PLA_DENSITY):
+    return volume_cm3 * density
+
+
+def price_for_weight(weight_g):
+    price = (weight_g * PRICE_PER_GRAM) + SETUP_FEE + PROFIT
+    return max(price, MIN_PRICE)
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from collections import OrderedDict
+
+
+class SliceCache:
+    """Persistent, content-addressed store of slice quotes.
+
+    Keys hash everything that determines the slicer output (STL bytes,
+    config.ini, slicer binary and CLI arguments), so a repeat quote for the
+    same mesh is answered without running PrusaSlicer again. Entries are small
+    JSON files; the least recently used ones are dropped once the directory
+    grows past `max_entries` or `max_bytes`.
+    """
+
+    def __init__(self, directory, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._index = OrderedDict()
+        self._bytes = 0
+        for path in sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime):
+            size = path.stat().st_size
+            self._index[path.stem] = size
+            self._bytes += size
+
+    @staticmethod
+    def make_key(stl_digest, config_path, argv):
+        h = hashlib.sha256()
+        h.update(stl_digest.encode())
+        h.update(Path(config_path).read_bytes())
+        h.update("\0".join(argv).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return self.directory / f"{key}.json"
+
+    def get(self, key):
+        if key not in self._index:
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            result = json.loads(path.read_text())
+            os.utime(path)
+        except (OSError, ValueError):
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._index.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(result))
+        os.replace(tmp, path)
+        self._bytes -= self._index.pop(key, 0)
+        self._index[key] = path.stat().st_size
+        self._bytes += self._index[key]
+        while self._index and (len(self._index) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._index)))
+
+    def _drop(self, key):
+        self._bytes -= self._index.pop(key, 0)
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    def stats(self):
+        return {"entries": len(self._index), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
@@ -1,34 +1,179 @@
+import os
+import time
+import uuid
+import asyncio
+import traceback
 import subprocess
-import re
-
-PRUSA_PATH = "C:\\Program Files\\Prusa3D\\PrusaSlicer\\prusa-slicer-console.exe" # Adjust path
-CONFIG_PATH = "config.ini"
-
-def slice_and_estimate(input_stl):
-    output_gcode = input_stl.replace(".stl", ".gcode")
-    
-    # Run PrusaSlicer Headless
-    # We use --load to load your specific printer settings
-    process = subprocess.run([
-        PRUSA_PATH,
-        "--export-gcode",
-        "--load", CONFIG_PATH,
-        "--output", output_gcode,
-        input_stl
-    ], capture_output=True, text=True)
-    
-    log_output = process.stdout
-    
-    # Parse the output for estimates (PrusaSlicer outputs this in console)
-    # Example output: "Estimated printing time: 1h 30m 10s"
-    
-    time_match = re.search(r"Estimated printing time: (.*)", log_output)
-    cost_match = re.search(r"Cost: (.*)", log_output) # You might need to check exact output format
-    
-    print_time = time_match.group(1) if time_match else "Unknown"
-    
-    return {
-        "gcode_path": output_gcode,
-        "estimated_time": print_time,
-        "status": "success"
-    }
\ No newline at end of file
+from app.services.metrics import metrics
+
+# --- SLICE SCHEDULER ---
+# Runs slicer processes on a bounded set of workers fed by a bounded queue, so a
+# burst of uploads queues up (or is refused) instead of forking a process each.
+
+
+class SlicerBusy(Exception):
+    """Raised when the slice queue is full."""
+
+
+class SliceError(Exception):
+    """Raised by the finish step when the slicer produced no usable G-code."""
+
+
+class SliceJob:
+    def __init__(self, stl_path, gcode_path, job_id=None, key=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.stl_path = stl_path
+        self.gcode_path = gcode_path
+        self.key = key
+        self.status = "queued"  # queued -> running -> success | error | cancelled
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = asyncio.Event()
+        self._proc = None
+
+    def to_dict(self):
+        data = {"job_id": self.id, "status": self.status}
+        if self.result: data.update(self.result)
+        if self.error: data["message"] = self.error
+        return data
+
+
+class SliceScheduler:
+    """Bounded worker pool for slicer runs.
+
+    `build_command(job)` returns the argv for a job; `finish(job, stderr)` is an
+    async callback that turns the slicer output into the job's result dict (it
+    may raise SliceError). Input/output files are removed once a job ends.
+    """
+
+    def __init__(self, build_command, finish, workers=2, max_queue=16, timeout=300, keep_finished=900):
+        self.build_command = build_command
+        self.finish = finish
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.keep_finished = keep_finished
+        self.jobs = {}
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for job in self.jobs.values():
+            if job._proc is not None: job._proc.kill()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def full(self):
+        return self._queue.full()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def running(self):
+        return sum(1 for job in self.jobs.values() if job.status == "running")
+
+    def submit(self, stl_path, gcode_path, job_id=None, key=None):
+        self._prune()
+        job = SliceJob(stl_path, gcode_path, job_id, key)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise SlicerBusy("Slicer queue is full, try again shortly.")
+        self.jobs[job.id] = job
+        return job
+
+    def record(self, result, job_id=None):
+        """Registers an already finished job (e.g. a cache hit) so it can be polled like any other."""
+        self._prune()
+        job = SliceJob(None, None, job_id)
+        self._end(job, "success", result=result)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def position(self, job):
+        """1-based place of a queued job in line, 0 once it has started."""
+        if job.status != "queued": return 0
+        queued = sorted((j for j in self.jobs.values() if j.status == "queued"), key=lambda j: j.created_at)
+        return queued.index(job) + 1
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.done.is_set(): return False
+        if job._proc is not None: job._proc.kill()
+        self._end(job, "cancelled", error="Cancelled by client.")
+        return True
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status == "queued":
+                    await self._run(job)
+            except Exception as e:
+                print(f"Slicer Error ({job.id}): {e}")
+                if not isinstance(e, SliceError): print(traceback.format_exc())
+                self._end(job, "error", error=str(e))
+            finally:
+                self._cleanup(job)
+                self._queue.task_done()
+
+    async def _run(self, job):
+        job.status = "running"
+        metrics.observe("slicer_queue_wait", time.time() - job.created_at)
+        command = self.build_command(job)
+        print(f"DEBUG: Running Slicer for job {job.id}...")
+        started = time.perf_counter()
+        job._proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        try:
+            _, stderr = await asyncio.to_thread(job._proc.communicate, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            job._proc.kill()
+            await asyncio.to_thread(job._proc.communicate)
+            metrics.inc("slicer_timeouts_total")
+            self._end(job, "error", error=f"Slicer timed out after {self.timeout}s.")
+            return
+        finally:
+            job._proc = None
+            metrics.observe("slicer_run", time.perf_counter() - started)
+        if job.status == "cancelled": return
+
+        try:
+            result = await self.finish(job, stderr)
+        except SliceError as e:
+            print("--- SLICER ERROR LOG ---")
+            print(stderr)
+            self._end(job, "error", error=str(e))
+            return
+        self._end(job, "success", result=result)
+
+    def _end(self, job, status, result=None, error=None):
+        if job.done.is_set(): return
+        metrics.inc("slice_jobs_total", status=status)
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job.done.set()
+
+    def _cleanup(self, job):
+        for path in (job.stl_path, job.gcode_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_finished
+        for job_id in [j.id for j in self.jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self.jobs[job_id]
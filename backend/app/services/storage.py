@@ -0,0 +1,179 @@
+import os
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from app.services.metrics import metrics
+from app.services.gcode_pack import GzipStream
+
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".glb": "model/gltf-binary",
+    ".gcode": "text/x.gcode",
+    ".bgcode": "application/x-bgcode",
+}
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class R2Storage:
+    """Long-lived R2 uploader: one shared boto3 client, a bounded upload pool and
+    content-hash object keys, so identical files are stored (and sent) only once.
+
+    Settings come from the R2_* environment variables when first used.
+    R2_ENDPOINT_URL overrides the Cloudflare endpoint (e.g. a local moto or
+    MinIO server for testing).
+
+    Known keys are LRU-bounded (R2_KNOWN_KEYS); an evicted key costs one HEAD
+    request the next time it is seen.
+    """
+
+    def __init__(self, max_workers=None, multipart_threshold=8 * 1024 * 1024, max_known=None):
+        self.max_workers = max_workers
+        self.max_known = max_known or int(os.getenv("R2_KNOWN_KEYS", "50000"))
+        self.transfer = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_threshold,
+            max_concurrency=4,
+        )
+        self._client = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._known = OrderedDict()         # uploaded keys, most recently used last
+        self._key_locks = {}                # key -> [lock, users], dropped when the last user leaves
+
+    @property
+    def bucket(self):
+        return os.getenv("R2_BUCKET_NAME")
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                workers = self.max_workers or int(os.getenv("R2_UPLOAD_WORKERS", "8"))
+                endpoint = os.getenv("R2_ENDPOINT_URL") or f"https://{os.getenv('R2_ACCOUNT_ID')}.r2.cloudflarestorage.com"
+                self._client = boto3.client(
+                    service_name='s3',
+                    endpoint_url=endpoint,
+                    aws_access_key_id=os.getenv('R2_ACCESS_KEY_ID'),
+                    aws_secret_access_key=os.getenv('R2_SECRET_ACCESS_KEY'),
+                    region_name="auto",
+                    config=Config(max_pool_connections=workers * 4, retries={"max_attempts": 3, "mode": "standard"}),
+                )
+                self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="r2-upload")
+            return self._client
+
+    def public_url(self, key):
+        return f"{os.getenv('R2_PUBLIC_URL')}/{key}"
+
+    def object_key(self, local_path, digest=None):
+        return f"{digest or file_digest(local_path)}{Path(local_path).suffix.lower()}"
+
+    def _remember(self, key):
+        with self._lock:
+            self._known[key] = True
+            self._known.move_to_end(key)
+            while len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+
+    def _is_known(self, key):
+        with self._lock:
+            if key not in self._known: return False
+            self._known.move_to_end(key)
+            return True
+
+    def _acquire_key(self, key):
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+
+    def _release_key(self, key):
+        with self._lock:
+            entry = self._key_locks[key]
+            entry[0].release()
+            entry[1] -= 1
+            if not entry[1]: del self._key_locks[key]
+
+    def _exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    def upload_file(self, local_path, key=None, extra_args=None, encoding=None):
+        """Blocking upload; returns the public URL, or None on failure.
+
+        encoding="gzip" compresses while uploading and stores the object with
+        Content-Encoding: gzip (the key still hashes the uncompressed file).
+        """
+        try:
+            key = key or self.object_key(local_path)
+            self._acquire_key(key)
+            try:
+                if self._is_known(key) or self._exists(key):
+                    metrics.inc("r2_upload_deduplicated_total")
+                else:
+                    args = {
+                        "ContentType": CONTENT_TYPES.get(Path(key).suffix, "application/octet-stream"),
+                        # Keep the ComfyUI filename so the object can be traced back to its output
+                        "Metadata": {"source-name": Path(local_path).name},
+                    }
+                    args.update(extra_args or {})
+                    if encoding == "gzip":
+                        args["ContentEncoding"] = "gzip"
+                        with GzipStream(local_path) as body:
+                            self.client.upload_fileobj(body, self.bucket, key, ExtraArgs=args, Config=self.transfer)
+                        metrics.inc("r2_gzip_input_bytes_total", body.raw_bytes)
+                        metrics.inc("r2_gzip_output_bytes_total", body.compressed_bytes)
+                    else:
+                        self.client.upload_file(str(local_path), self.bucket, key, ExtraArgs=args, Config=self.transfer)
+                self._remember(key)
+            finally:
+                self._release_key(key)
+            return self.public_url(key)
+        except Exception as e:
+            print(f"R2 Error: {e}")
+            metrics.inc("r2_upload_errors_total")
+            return None
+
+    def download(self, url, dest):
+        """Blocking download of an uploaded object (by its public URL) to `dest`."""
+        self.client.download_file(self.bucket, url.rsplit("/", 1)[-1], str(dest))
+        return Path(dest)
+
+    def open_object(self, key, byte_range=None):
+        """Blocking GetObject (optionally for an HTTP Range); the caller streams and closes ["Body"]."""
+        args = {"Bucket": self.bucket, "Key": key}
+        if byte_range: args["Range"] = byte_range
+        return self.client.get_object(**args)
+
+    async def upload(self, local_path, key=None, extra_args=None, encoding=None):
+        self.client  # make sure the pool exists
+        loop = asyncio.get_running_loop()
+        with metrics.timer("r2_upload"):
+            return await loop.run_in_executor(self._pool, self.upload_file, local_path, key, extra_args, encoding)
+
+    async def upload_many(self, paths):
+        """Uploads files in parallel; returns URLs in the same order (None for failures)."""
+        return await asyncio.gather(*(self.upload(p) for p in paths))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+storage = R2Storage()
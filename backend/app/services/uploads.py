@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import hashlib
+import tempfile
+from pathlib import Path
+from dataclasses import dataclass
+from fastapi.responses import JSONResponse
+
+CHUNK_SIZE = 1024 * 1024
+# Room for multipart boundaries and part headers on top of the file itself
+MULTIPART_SLACK = 64 * 1024
+
+_STL_HEADER = 84
+_STL_TRIANGLE = 50
+
+
+class UploadRejected(ValueError):
+    """Raised while streaming an upload that is too large or not a valid STL."""
+
+    def __init__(self, message, status_code=422):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class SpooledUpload:
+    path: Path
+    sha256: str
+    size: int
+    triangles: int
+    binary: bool
+
+
+class StlValidator:
+    """Checks an STL incrementally, chunk by chunk, as it streams in.
+
+    A binary STL announces its triangle count in the header, and a body longer
+    than announced is refused immediately. The count itself is only trusted
+    once the body length matches it: four arbitrary bytes usually announce an
+    enormous mesh, and garbage is a 422, not a 413. Files that start with
+    `solid` might be ASCII, in which case facets are counted instead.
+    """
+
+    def __init__(self, max_triangles):
+        self.max_triangles = max_triangles
+        self.size = 0
+        self.head = b""
+        self.tail = b""
+        self.expected = None
+        self.ascii_facets = 0
+
+    def _maybe_ascii(self):
+        return self.head.lstrip()[:5].lower() == b"solid"
+
+    def feed(self, chunk):
+        if len(self.head) < _STL_HEADER:
+            self.head += chunk[:_STL_HEADER - len(self.head)]
+            if len(self.head) == _STL_HEADER:
+                count = int.from_bytes(self.head[80:84], "little")
+                self.expected = _STL_HEADER + count * _STL_TRIANGLE
+        self.size += len(chunk)
+
+        if self._maybe_ascii():
+            window = self.tail + chunk
+            self.ascii_facets += window.count(b"facet normal") - self.tail.count(b"facet normal")
+            self.tail = window[-256:]
+            if self.ascii_facets > self.max_triangles:
+                raise UploadRejected(f"STL has more than {self.max_triangles} triangles.", 413)
+        elif self.expected is not None and self.size > self.expected:
+            raise UploadRejected("Binary STL is longer than its triangle count says.")
+
+    def finish(self):
+        """Returns (triangles, is_binary) or raises UploadRejected."""
+        if self.expected is not None and self.size == self.expected and self.expected > _STL_HEADER:
+            count = (self.expected - _STL_HEADER) // _STL_TRIANGLE
+            if count > self.max_triangles:
+                raise UploadRejected(f"STL has {count} triangles; the limit is {self.max_triangles}.", 413)
+            return count, True
+        if self._maybe_ascii() and self.ascii_facets > 0 and b"endsolid" in self.tail:
+            return self.ascii_facets, False
+        raise UploadRejected("Not a valid STL file.")
+
+
+def max_upload_bytes():
+    return int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+
+async def limit_upload_size(request, call_next):
+    """HTTP middleware: refuses a multipart upload by its Content-Length before the body is read.
+
+    FastAPI parses File(...) parameters before the endpoint runs, so the cap in
+    spool_upload alone only applies once the whole body has been buffered.
+    Chunked uploads without a length still hit that cap.
+    """
+    length = request.headers.get("content-length")
+    if (request.method == "POST" and length and length.isdigit()
+            and request.headers.get("content-type", "").startswith("multipart/form-data")):
+        limit = max_upload_bytes()
+        if int(length) > limit + MULTIPART_SLACK:
+            return JSONResponse({"detail": f"Upload exceeds {limit // (1024 * 1024)} MB."}, status_code=413)
+    return await call_next(request)
+
+
+def scratch_dir():
+    return Path(os.getenv("SCRATCH_DIR", Path(tempfile.gettempdir()) / "ai-gift-scratch"))
+
+
+def scratch_path(name):
+    """Path for a working file in the scratch directory (kept out of the source tree)."""
+    directory = scratch_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    return (directory / name).absolute()
+
+
+async def spool_upload(upload, dest, max_bytes=None, max_triangles=None):
+    """Streams an UploadFile to `dest` in chunks while hashing, size-capping and validating it.
+
+    Memory stays at one chunk regardless of upload size. On any failure the
+    partial file is removed before the error propagates.
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    max_triangles = max_triangles or int(os.getenv("MAX_TRIANGLES", "2000000"))
+    digest = hashlib.sha256()
+    validator = StlValidator(max_triangles)
+    try:
+        with open(dest, "wb") as out:
+            while chunk := await upload.read(CHUNK_SIZE):
+                if validator.size + len(chunk) > max_bytes:
+                    raise UploadRejected(f"Upload exceeds {max_bytes // (1024 * 1024)} MB.", 413)
+                validator.feed(chunk)
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+        triangles, binary = validator.finish()
+    except BaseException:
+        Path(dest).unlink(missing_ok=True)
+        raise
+    return SpooledUpload(Path(dest), digest.hexdigest(), validator.size, triangles, binary)
+
+
+def sweep_scratch(max_age=3600):
+    """Removes scratch files left behind by a crash or a killed worker."""
+    directory = scratch_dir()
+    if not directory.exists(): return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in directory.iterdir():
+        try:
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
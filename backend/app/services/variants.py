@@ -0,0 +1,35 @@
+import os
+import random
+from app.services.workflows import TEMPLATES
+
+SAVE_NODE = "9"  # stage-1 SaveImage
+
+
+def max_variants():
+    return int(os.getenv("MAX_VARIANTS", "4"))
+
+
+def variant_params(count=1, seed=None):
+    """Stage-1 render parameters for one batched pass that renders `count` candidates.
+
+    ComfyUI draws the noise for the whole batch from the sampler seed, so
+    (seed, batch size, index) pins every variant: re-running with the same
+    seed and count reproduces the same images.
+    """
+    count = max(1, min(int(count), max_variants()))
+    if seed is None: seed = random.randint(1, 10**14)
+    return {"seed": seed, "batch_size": count}
+
+
+def batch_seed(history_entry):
+    """Sampler seed a finished prompt ran with, read back from its ComfyUI history entry."""
+    node, key = TEMPLATES["stage1"].points("seed")[0]
+    try:
+        return history_entry["prompt"][2][node]["inputs"][key]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def saved_images(history_entry):
+    """Stage-1 output items ({filename, subfolder, type}) in batch order (index i is variant i)."""
+    return [item for item in history_entry.get("outputs", {}).get(SAVE_NODE, {}).get("images", []) if "filename" in item]
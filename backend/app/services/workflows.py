@@ -0,0 +1,98 @@
+import json
+import threading
+from pathlib import Path
+
+WORKFLOW_DIR = Path(__file__).resolve().parent.parent.parent / "workflows"
+
+
+class WorkflowError(Exception):
+    """A template is missing a patch point, or a render asked for an unknown parameter."""
+
+
+class WorkflowTemplate:
+    """One ComfyUI API-format workflow, parsed once and patched by parameter name.
+
+    `params` maps a name to the node input(s) it sets, e.g.
+    {"seed": ("34:3", "seed"), "resolution": [("34:13", "width"), ("34:13", "height")]}.
+    The file is re-read only when its mtime changes; a broken edit is reported
+    and the last good version keeps serving.
+    """
+
+    def __init__(self, filename, params):
+        self.path = WORKFLOW_DIR / filename
+        self.params = {name: [points] if isinstance(points, tuple) else list(points)
+                       for name, points in params.items()}
+        self._nodes = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _validate(self, nodes):
+        for name, points in self.params.items():
+            for node, key in points:
+                if key not in nodes.get(node, {}).get("inputs", {}):
+                    raise WorkflowError(f"{self.path.name}: parameter '{name}' expects input '{key}' on node {node}")
+
+    def load(self):
+        """Returns the parsed nodes, (re)loading and validating them if the file changed."""
+        mtime = self.path.stat().st_mtime_ns
+        if mtime == self._mtime: return self._nodes
+        with self._lock:
+            if mtime == self._mtime: return self._nodes
+            try:
+                with open(self.path, "r") as f:
+                    nodes = json.load(f)
+                self._validate(nodes)
+            except (OSError, ValueError, WorkflowError) as e:
+                if self._nodes is None: raise WorkflowError(str(e)) from e
+                print(f"Workflow Reload Error ({self.path.name}): {e}")
+                return self._nodes
+            self._nodes = nodes
+            self._mtime = mtime
+            print(f"DEBUG: Loaded workflow {self.path.name}")
+            return nodes
+
+    def points(self, name):
+        if name not in self.params:
+            raise WorkflowError(f"{self.path.name} has no parameter '{name}'")
+        return self.params[name]
+
+    def render(self, **values):
+        """Per-request prompt: node/inputs dicts are copied, everything else is shared."""
+        nodes = self.load()
+        prompt = {node_id: {**node, "inputs": dict(node["inputs"])} for node_id, node in nodes.items()}
+        for name, value in values.items():
+            if value is None: continue
+            for node, key in self.points(name):
+                prompt[node]["inputs"][key] = value
+        return prompt
+
+
+TEMPLATES = {
+    "stage1": WorkflowTemplate("stage1_image.json", {
+        "prompt": ("34:27", "text"),
+        "negative": ("42", "text"),
+        "seed": ("34:3", "seed"),
+        "cfg": ("34:3", "cfg"),
+        "steps": ("34:3", "steps"),
+        "resolution": [("34:13", "width"), ("34:13", "height")],
+        "batch_size": ("34:13", "batch_size"),
+    }),
+    "stage2": WorkflowTemplate("stage2_3d.json", {
+        "image": ("2", "image"),
+        "resolution": ("4", "resolution"),
+        "seed": ("7", "seed"),
+        "cfg": ("7", "cfg"),
+        "steps": ("7", "steps"),
+        "background": ("17", "background_color"),
+    }),
+}
+
+
+def load_all():
+    """Parses and validates every template (called at startup so a bad file fails fast)."""
+    for template in TEMPLATES.values():
+        template.load()
+
+
+def render(name, **values):
+    return TEMPLATES[name].render(**values)
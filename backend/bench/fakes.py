@@ -0,0 +1,250 @@
+"""Local stand-ins for the services the backend talks to, for load tests without a GPU.
+
+- comfy_app(): ComfyUI's /prompt, /queue, /history, /free, /ws, /view and
+  /upload/image. Prompts run one at a time (like a single GPU) with a
+  configurable latency per phase, and write real output files.
+- ollama_app(): /api/chat for both the chat model (streaming or not) and the
+  VLM gatekeeper.
+- s3_server(): moto's in-process S3 server standing in for R2.
+- slicer_launcher(): PRUSA_PATH pointing at stub_slicer.py.
+- cube_stl(): a small binary STL to slice or upload.
+"""
+import io
+import os
+import sys
+import json
+import logging
+import uuid
+import random
+import struct
+import asyncio
+import threading
+from pathlib import Path
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form
+from fastapi.responses import Response, StreamingResponse
+import uvicorn
+
+from PIL import Image
+
+STUB_SLICER = Path(__file__).resolve().parent / "stub_slicer.py"
+
+# Unit cube, triangles wound counter-clockwise seen from outside
+CUBE_VERTICES = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)]
+CUBE_FACES = [(0, 2, 1), (0, 3, 2), (4, 5, 6), (4, 6, 7), (0, 1, 5), (0, 5, 4),
+              (1, 2, 6), (1, 6, 5), (2, 3, 7), (2, 7, 6), (3, 0, 4), (3, 4, 7)]
+
+
+def cube_stl(size_mm):
+    """Binary STL of an axis-aligned cube (12 triangles); different sizes give different cache keys."""
+    v = [(x * size_mm, y * size_mm, z * size_mm) for x, y, z in CUBE_VERTICES]
+    out = bytearray(b"bench cube".ljust(80, b"\0") + struct.pack("<I", len(CUBE_FACES)))
+    for a, b, c in CUBE_FACES:
+        out += struct.pack("<12fH", 0, 0, 0, *v[a], *v[b], *v[c], 0)
+    return bytes(out)
+
+
+def slicer_launcher(directory):
+    """PRUSA_PATH must be one executable, so wrap `python stub_slicer.py` in a script."""
+    if os.name == "nt":
+        path = Path(directory) / "stub_slicer.cmd"
+        path.write_text(f'@"{sys.executable}" "{STUB_SLICER}" %*\r\n')
+    else:
+        path = Path(directory) / "stub_slicer.sh"
+        path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{STUB_SLICER}" "$@"\n')
+        path.chmod(0o755)
+    return str(path)
+
+
+def _png(size=256):
+    out = io.BytesIO()
+    Image.new("RGB", (size, size), (128, 128, 128)).save(out, format="PNG")
+    return out.getvalue()
+
+
+def _glb(rings=200):
+    """A UV sphere of ~4 * rings^2 triangles, roughly the weight of a real stage-2 mesh."""
+    import numpy as np
+    from app.services.gltf import encode_glb
+    u, v = np.meshgrid(np.linspace(0, np.pi, rings), np.linspace(0, 2 * np.pi, 2 * rings))
+    p = np.stack([np.sin(u) * np.cos(v), np.cos(u), np.sin(u) * np.sin(v)], -1)
+    a, b, c, d = p[:-1, :-1], p[1:, :-1], p[1:, 1:], p[:-1, 1:]
+    quads = np.arange(a.shape[0] * a.shape[1] * 4).reshape(-1, 4)
+    vertices = np.stack([a, b, c, d], 2).reshape(-1, 3)
+    faces = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])  # counter-clockwise seen from outside
+    return encode_glb(vertices, faces)
+
+
+def comfy_app(output_dir, input_dir, image_latency=1.0, mesh_latency=4.0, jitter=0.2, steps=8):
+    output_dir, input_dir = Path(output_dir), Path(input_dir)
+    (output_dir / "mesh").mkdir(parents=True, exist_ok=True)
+    input_dir.mkdir(parents=True, exist_ok=True)
+    app = FastAPI()
+    state = {"queue": [], "running": None, "history": {}, "clients": {}, "frees": 0, "counter": 0,
+             "png": _png(), "glb": _glb()}
+    wake = asyncio.Event()
+
+    async def send(client_id, message):
+        ws = state["clients"].get(client_id)
+        if ws is None: return
+        try:
+            await ws.send_text(json.dumps(message))
+        except Exception:
+            state["clients"].pop(client_id, None)
+
+    async def execute(prompt_id, prompt, client_id):
+        is_mesh = "10" in prompt
+        latency = (mesh_latency if is_mesh else image_latency) * random.uniform(1 - jitter, 1 + jitter)
+        await send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+        node = "7" if is_mesh else "34:3"
+        await send(client_id, {"type": "executing", "data": {"node": node, "prompt_id": prompt_id}})
+        for step in range(1, steps + 1):
+            await asyncio.sleep(latency / steps)
+            await send(client_id, {"type": "progress", "data": {"value": step, "max": steps, "node": node, "prompt_id": prompt_id}})
+
+        state["counter"] += 1
+        if is_mesh:
+            name = f"mesh/ComfyUI_{state['counter']:05d}_.glb"
+            (output_dir / name).write_bytes(state["glb"])
+            outputs = {"10": {"files": [{"filename": name, "subfolder": "", "type": "output"}]}}
+        else:
+            batch = int(prompt.get("34:13", {}).get("inputs", {}).get("batch_size", 1))
+            images = []
+            for i in range(batch):
+                name = f"gift_app_{state['counter']:05d}_{i}_.png"
+                (output_dir / name).write_bytes(state["png"])
+                images.append({"filename": name, "subfolder": "", "type": "output"})
+            outputs = {"9": {"images": images}}
+        state["history"][prompt_id] = {"prompt": [0, prompt_id, prompt, {}, list(outputs)], "outputs": outputs,
+                                       "status": {"status_str": "success", "completed": True}}
+        await send(client_id, {"type": "execution_success", "data": {"prompt_id": prompt_id}})
+        await send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+    async def worker():
+        while True:
+            if not state["queue"]:
+                wake.clear()
+                await wake.wait()
+                continue
+            prompt_id, prompt, client_id = state["queue"].pop(0)
+            state["running"] = prompt_id
+            try:
+                await execute(prompt_id, prompt, client_id)
+            finally:
+                state["running"] = None
+
+    @app.on_event("startup")
+    async def start():
+        asyncio.create_task(worker())
+
+    @app.post("/prompt")
+    async def prompt(body: dict):
+        prompt_id = uuid.uuid4().hex
+        state["queue"].append((prompt_id, body["prompt"], body.get("client_id")))
+        wake.set()
+        return {"prompt_id": prompt_id, "number": len(state["queue"])}
+
+    @app.get("/queue")
+    async def queue():
+        running = [[0, state["running"], {}, {}, []]] if state["running"] else []
+        return {"queue_running": running, "queue_pending": [[i, p[0], {}, {}, []] for i, p in enumerate(state["queue"])]}
+
+    @app.get("/history/{prompt_id}")
+    async def history(prompt_id: str):
+        entry = state["history"].get(prompt_id)
+        return {prompt_id: entry} if entry else {}
+
+    @app.post("/free")
+    async def free(body: dict = None):
+        state["frees"] += 1
+        return {}
+
+    @app.get("/view")
+    async def view(filename: str, type: str = "output", subfolder: str = ""):
+        folder = output_dir if type == "output" else input_dir
+        return Response((folder / subfolder / filename).read_bytes(), media_type="image/png")
+
+    @app.post("/upload/image")
+    async def upload_image(image: UploadFile = File(...), type: str = Form("input"), overwrite: str = Form("false")):
+        (input_dir / image.filename).write_bytes(await image.read())
+        return {"name": image.filename, "subfolder": "", "type": type}
+
+    @app.get("/bench/stats")
+    async def stats():
+        return {"completed": len(state["history"]), "queued": len(state["queue"]), "frees": state["frees"]}
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket, clientId: str = ""):
+        await websocket.accept()
+        state["clients"][clientId] = websocket
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            state["clients"].pop(clientId, None)
+
+    return app
+
+
+def ollama_app(chat_latency=0.8, vlm_latency=0.3, fail_rate=0.0):
+    app = FastAPI()
+    reply = ("Love it, a tiny desk buddy! Here is the design: "
+             '{"visual_prompt": "A macro studio photo of a chunky cartoon owl figurine"}')
+
+    @app.post("/api/chat")
+    async def chat(body: dict):
+        if any(m.get("images") for m in body.get("messages", [])):
+            await asyncio.sleep(vlm_latency)
+            answer = "FAIL" if random.random() < fail_rate else "PASS"
+            return {"message": {"role": "assistant", "content": answer}, "done": True}
+        if not body.get("stream"):
+            await asyncio.sleep(chat_latency)
+            return {"message": {"role": "assistant", "content": reply}, "done": True}
+
+        words = reply.split(" ")
+        per_token = chat_latency / max(len(words), 1)
+
+        async def lines():
+            for i, word in enumerate(words):
+                await asyncio.sleep(per_token)
+                text = word if i == 0 else " " + word
+                yield json.dumps({"message": {"role": "assistant", "content": text}, "done": False}) + "\n"
+            yield json.dumps({"message": {"role": "assistant", "content": ""}, "done": True}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return app
+
+
+class BackgroundServer:
+    """Runs an ASGI app with uvicorn on a thread of its own."""
+
+    def __init__(self, app, port):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self, timeout=10):
+        self.thread.start()
+        deadline = timeout
+        while not self.server.started and deadline > 0:
+            threading.Event().wait(0.05)
+            deadline -= 0.05
+        if not self.server.started: raise RuntimeError(f"Fake server on port {self.port} did not start")
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+def s3_server(port, bucket):
+    """Starts moto's S3 server and creates the bucket. Returns the server (call .stop())."""
+    from moto.server import ThreadedMotoServer
+    import boto3
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # one line per request otherwise
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    boto3.client("s3", endpoint_url=f"http://127.0.0.1:{port}", region_name="us-east-1",
+                 aws_access_key_id="bench", aws_secret_access_key="bench").create_bucket(Bucket=bucket)
+    return server
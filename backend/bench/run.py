@@ -0,0 +1,305 @@
+"""End-to-end load test: fakes for ComfyUI / Ollama / R2 / PrusaSlicer, the real app, scripted users.
+
+Run from backend/:
+
+    python -m bench.run --app main --users 8 --flows 40
+    python -m bench.run --app local --scenario images --users 16 --duration 60
+    python -m bench.run --app main --json bench.json                      # save a baseline
+    python -m bench.run --app main --baseline bench.json --tolerance 0.25  # exit 1 on regression
+
+Scenarios:
+    full    chat -> generate-images -> check-status -> generate-3d -> check-status -> slice
+    images  chat -> generate-images -> check-status
+    print   full, but the model is prepared and sliced server-side: prepare-print -> slice/jobs (main only)
+    slice   slice uploads only (unique meshes, so the slice cache does not short-circuit)
+
+The app runs as its own uvicorn process, so the numbers include real HTTP and
+process boundaries. Each endpoint reports throughput and p50/p95/p99 latency;
+"flow:*" rows are end-to-end times as a user would feel them.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+import httpx
+
+from bench.fakes import BackgroundServer, comfy_app, cube_stl, ollama_app, s3_server, slicer_launcher
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BUCKET = "bench-assets"
+TERMINAL = ("completed", "rejected", "failed")
+SLICE_TERMINAL = ("success", "error", "cancelled")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.started = time.perf_counter()
+
+    def add(self, name, seconds, ok=True):
+        self.samples.setdefault(name, []).append(seconds)
+        if not ok: self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        rows = {}
+        for name, values in sorted(self.samples.items()):
+            ordered = sorted(values)
+            pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+            rows[name] = {
+                "count": len(ordered),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(ordered) / elapsed, 3),
+                "p50_ms": round(pick(0.5) * 1000, 1),
+                "p95_ms": round(pick(0.95) * 1000, 1),
+                "p99_ms": round(pick(0.99) * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+            }
+        return {"elapsed_s": round(elapsed, 1), "endpoints": rows}
+
+
+class User:
+    def __init__(self, client, recorder, args):
+        self.client = client
+        self.rec = recorder
+        self.args = args
+
+    async def call(self, name, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+            ok = resp.status_code < 400
+        except httpx.HTTPError as e:
+            self.rec.add(name, time.perf_counter() - start, ok=False)
+            raise RuntimeError(f"{name}: {e}") from e
+        self.rec.add(name, time.perf_counter() - start, ok=ok)
+        if not ok: raise RuntimeError(f"{name}: HTTP {resp.status_code} {resp.text[:200]}")
+        return resp.json()
+
+    async def wait_for(self, job_id, timeout=600):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            result = await self.call("GET /api/check-status", "GET", f"/api/check-status/{job_id}")
+            if result.get("status") in TERMINAL: return result
+            await asyncio.sleep(self.args.poll_interval)
+        raise RuntimeError(f"job {job_id} did not finish in {timeout}s")
+
+    async def chat(self):
+        body = {"history": [{"role": "user", "content": "A gift for my sister, she loves owls"}]}
+        return (await self.call("POST /api/chat", "POST", "/api/chat", json=body)).get("visual_prompt") or "owl figurine"
+
+    async def images(self):
+        prompt = await self.chat()
+        start = time.perf_counter()
+        ticket = await self.call("POST /api/generate-images", "POST", "/api/generate-images",
+                                 json={"visual_prompt": prompt, "variants": self.args.variants})
+        result = await self.wait_for(ticket["job_id"])
+        self.rec.add("flow:image_ready", time.perf_counter() - start, ok=result["status"] == "completed")
+        return result
+
+    async def mesh(self, image_url):
+        start = time.perf_counter()
+        ticket = await self.call("POST /api/generate-3d", "POST", "/api/generate-3d", json={"image_url": image_url})
+        result = await self.wait_for(ticket["job_id"])
+        self.rec.add("flow:mesh_ready", time.perf_counter() - start, ok=result["status"] == "completed")
+        return result
+
+    async def prepare_print(self, glb_url, timeout=600):
+        start = time.perf_counter()
+        result = await self.call("POST /api/prepare-print", "POST", "/api/prepare-print", json={"glb_url": glb_url})
+        deadline = time.monotonic() + timeout
+        while result.get("status") not in SLICE_TERMINAL:
+            if time.monotonic() > deadline: raise RuntimeError(f"slice job {result['job_id']} did not finish in {timeout}s")
+            await asyncio.sleep(self.args.poll_interval)
+            result = await self.call("GET /api/slice/jobs", "GET", f"/api/slice/jobs/{result['job_id']}")
+        self.rec.add("flow:print_ready", time.perf_counter() - start, ok=result["status"] == "success")
+        return result
+
+    async def slice(self):
+        stl = cube_stl(random.uniform(10, 60))
+        return await self.call("POST /api/slice", "POST", "/api/slice", files={"file": ("gift.stl", stl, "model/stl")})
+
+    async def flow(self, scenario):
+        start = time.perf_counter()
+        ok = True
+        try:
+            if scenario == "slice":
+                await self.slice()
+            else:
+                result = await self.images()
+                if scenario in ("full", "print") and result["status"] == "completed" and result.get("images"):
+                    mesh = await self.mesh(result["images"][0])
+                    if scenario == "print" and mesh["status"] == "completed":
+                        await self.prepare_print(mesh["images"][0])
+                    elif scenario == "full" and self.args.app == "main":
+                        await self.slice()
+        except RuntimeError as e:
+            print(f"flow error: {e}")
+            ok = False
+        self.rec.add(f"flow:{scenario}", time.perf_counter() - start, ok=ok)
+
+
+async def drive(base_url, args):
+    recorder = Recorder()
+    remaining = [args.flows]
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    def take():
+        if deadline is not None: return time.monotonic() < deadline
+        if remaining[0] <= 0: return False
+        remaining[0] -= 1
+        return True
+
+    limits = httpx.Limits(max_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def user_loop():
+            user = User(client, recorder, args)
+            while take():
+                await user.flow(args.scenario)
+        await asyncio.gather(*(user_loop() for _ in range(args.users)))
+        metrics = (await client.get("/metrics")).text
+    return recorder.report(), metrics
+
+
+def print_report(report):
+    print(f"\n{'endpoint':34} {'n':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, row in report["endpoints"].items():
+        print(f"{name:34} {row['count']:>6} {row['errors']:>5} {row['rps']:>8} {row['p50_ms']:>9} "
+              f"{row['p95_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}")
+    print(f"elapsed: {report['elapsed_s']}s")
+
+
+def compare(report, baseline, tolerance):
+    """Returns the regressions of `report` against a saved baseline report."""
+    problems = []
+    for name, old in baseline.get("endpoints", {}).items():
+        new = report["endpoints"].get(name)
+        if new is None: continue
+        if new["p95_ms"] > old["p95_ms"] * (1 + tolerance) and new["p95_ms"] - old["p95_ms"] > 5:
+            problems.append(f"{name}: p95 {old['p95_ms']} -> {new['p95_ms']} ms")
+        if new["errors"] > old["errors"]:
+            problems.append(f"{name}: errors {old['errors']} -> {new['errors']}")
+    return problems
+
+
+def wait_ready(url, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None: raise RuntimeError("App exited during startup")
+        try:
+            if httpx.get(f"{url}/metrics", timeout=1).status_code == 200: return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("App did not become ready")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["main", "local"], default="main")
+    parser.add_argument("--scenario", choices=["full", "images", "print", "slice"], default="full")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--flows", type=int, default=20, help="total flows to run (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--variants", type=int, default=1)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--comfy-nodes", type=int, default=1)
+    parser.add_argument("--remote-nodes", action="store_true", help="hide the nodes' folders: outputs come over /view")
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--mesh-latency", type=float, default=4.0)
+    parser.add_argument("--chat-latency", type=float, default=0.8)
+    parser.add_argument("--vlm-latency", type=float, default=0.3)
+    parser.add_argument("--vlm-fail-rate", type=float, default=0.0)
+    parser.add_argument("--slicer-delay", type=float, default=2.0)
+    parser.add_argument("--json", help="write the report here")
+    parser.add_argument("--baseline", help="compare against a saved report; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    if args.scenario == "print" and args.app != "main": parser.error("--scenario print needs --app main")
+
+    work = Path(tempfile.mkdtemp(prefix="gift-bench-"))
+    servers, nodes = [], []
+    for i in range(args.comfy_nodes):
+        out_dir, in_dir = work / f"comfy{i}" / "output", work / f"comfy{i}" / "input"
+        app = comfy_app(out_dir, in_dir, args.image_latency, args.mesh_latency)
+        servers.append(BackgroundServer(app, free_port()).start())
+        nodes.append((servers[-1].url, out_dir, in_dir))
+    ollama = BackgroundServer(ollama_app(args.chat_latency, args.vlm_latency, args.vlm_fail_rate), free_port()).start()
+    servers.append(ollama)
+    s3_port = free_port()
+    s3 = s3_server(s3_port, BUCKET)
+
+    env = dict(os.environ)
+    env.update({
+        "COMFY_URLS": ",".join(url for url, _, _ in nodes),
+        "COMFY_OUTPUT_DIRS": "" if args.remote_nodes else ",".join(str(o) for _, o, _ in nodes),
+        "COMFY_INPUT_DIRS": "" if args.remote_nodes else ",".join(str(i) for _, _, i in nodes),
+        "COMFY_OUTPUT_DIR": "",
+        "COMFY_INPUT_DIR": "",
+        "OLLAMA_URL": f"{ollama.url}/api/chat",
+        "OLLAMA_BASE_URL": ollama.url,
+        "R2_ENDPOINT_URL": f"http://127.0.0.1:{s3_port}",
+        "R2_BUCKET_NAME": BUCKET,
+        "R2_PUBLIC_URL": f"http://127.0.0.1:{s3_port}/{BUCKET}",
+        "R2_ACCESS_KEY_ID": "bench",
+        "R2_SECRET_ACCESS_KEY": "bench",
+        "PRUSA_PATH": slicer_launcher(work),
+        "STUB_SLICER_DELAY": str(args.slicer_delay),
+        "SLICE_CACHE_DIR": str(work / "slice-cache"),
+        "SCRATCH_DIR": str(work / "scratch"),
+        "GENERATED_DIR": str(work / "generated"),
+        "DB_BACKEND": "sqlite",
+        "SQLITE_PATH": str(work / "records.db"),
+    })
+    port = free_port()
+    module = "main" if args.app == "main" else "main_local"
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", f"app.{module}:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_ready(base_url, proc)
+        print(f"Running {args.scenario} against app.{module} with {args.users} users...")
+        report, metrics = asyncio.run(drive(base_url, args))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        for server in servers:
+            server.stop()
+        s3.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    report["config"] = vars(args)
+    print_report(report)
+    print("\nServer-side stage latencies (from /metrics):")
+    for line in metrics.splitlines():
+        if 'quantile="0.95"' in line: print("  " + line)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        problems = compare(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if problems:
+            print("\nREGRESSIONS:\n  " + "\n  ".join(problems))
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
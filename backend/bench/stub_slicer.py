@@ -0,0 +1,28 @@
+"""Stands in for prusa-slicer-console: accepts the same argv, sleeps, and writes one
+of the real gift_*.gcode fixtures to --output so pricing/metadata parsing is exercised.
+
+STUB_SLICER_DELAY (seconds, default 2) and STUB_SLICER_FAIL_RATE (0..1) shape the run.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+from pathlib import Path
+
+FIXTURES = sorted((Path(__file__).resolve().parent.parent).glob("gift_*.gcode"))
+
+
+def main(argv):
+    output = argv[argv.index("--output") + 1]
+    time.sleep(float(os.getenv("STUB_SLICER_DELAY", "2")) * random.uniform(0.8, 1.2))
+    if random.random() < float(os.getenv("STUB_SLICER_FAIL_RATE", "0")):
+        print("Objects could not fit on the bed", file=sys.stderr)
+        return 1
+    shutil.copy(random.choice(FIXTURES), output)
+    print(f"Slicing result exported to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
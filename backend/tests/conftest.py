@@ -0,0 +1,23 @@
+import importlib
+import pytest
+
+from bench.fakes import slicer_launcher
+
+
+@pytest.fixture
+def stub_slicer(tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_SLICER_DELAY", "0.1")
+    monkeypatch.setenv("STUB_SLICER_FAIL_RATE", "0")
+    return slicer_launcher(tmp_path)
+
+
+@pytest.fixture
+def load_app(tmp_path, monkeypatch):
+    """Imports (or re-imports) app.<module> with throwaway state dirs plus `env`; settings are read at import."""
+    def load(module="main", **env):
+        base = {"SCRATCH_DIR": tmp_path / "scratch", "SLICE_CACHE_DIR": tmp_path / "slice-cache",
+                "DB_BACKEND": "sqlite", "SQLITE_PATH": tmp_path / "records.db"}
+        for name, value in {**base, **env}.items():
+            monkeypatch.setenv(name, str(value))
+        return importlib.reload(importlib.import_module(f"app.{module}"))
+    return load
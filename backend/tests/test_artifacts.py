@@ -0,0 +1,39 @@
+import asyncio
+from pathlib import Path
+
+from app.services import artifacts
+from app.services.comfy_pool import ComfyNode
+
+
+class ViewResponse:
+    def __init__(self, status_code, content=b""):
+        self.status_code = status_code
+        self.content = content
+
+
+def test_fetch_output_reads_visible_folders_in_place(tmp_path):
+    (tmp_path / "mesh").mkdir()
+    (tmp_path / "mesh" / "ComfyUI_00001_.glb").write_bytes(b"glTF")
+    node = ComfyNode(0, "http://comfy", output_dir=tmp_path)
+    item = {"filename": "ComfyUI_00001_.glb", "subfolder": "", "type": "output"}
+    path, name = asyncio.run(artifacts.fetch_output(node, item, tmp_path / "unused"))
+    assert path == tmp_path / "mesh" / "ComfyUI_00001_.glb" and name == "mesh/ComfyUI_00001_.glb"
+    assert not (tmp_path / "unused").exists()
+    assert asyncio.run(artifacts.fetch_output(node, {"filename": "missing.png"}, tmp_path / "unused")) is None
+
+
+def test_fetch_output_pulls_remote_outputs_through_view(tmp_path, monkeypatch):
+    calls = []
+
+    async def comfy(method, path, node=0, **kw):
+        calls.append((method, path, node, kw["params"]))
+        return ViewResponse(200, b"png bytes") if kw["params"]["filename"] == "a.png" else ViewResponse(404)
+
+    monkeypatch.setattr(artifacts.http_pool, "comfy", comfy)
+    node = ComfyNode(1, "http://remote")  # no output folder we can see
+    item = {"filename": "a.png", "subfolder": "batch", "type": "output"}
+    path, name = asyncio.run(artifacts.fetch_output(node, item, tmp_path / "copy.png"))
+    assert path == tmp_path / "copy.png" and path.read_bytes() == b"png bytes"
+    assert name == "batch/a.png"
+    assert calls[0] == ("GET", "/view", 1, {"filename": "a.png", "subfolder": "batch", "type": "output"})
+    assert asyncio.run(artifacts.fetch_output(node, {"filename": "b.png"}, tmp_path / "b.png")) is None
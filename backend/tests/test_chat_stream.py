@@ -0,0 +1,44 @@
+import pytest
+
+from app.services.chat_stream import VisualPromptExtractor
+
+REPLY = ('Love it! {so} here is the design: {"style": {"mood": "cozy"}, '
+         '"visual_prompt": "An owl figurine saying \\"hi {there}\\" on a desk \\\\ studio light"} enjoy')
+PROMPT = 'An owl figurine saying "hi {there}" on a desk \\ studio light'
+
+
+def feed_all(chunks):
+    extractor = VisualPromptExtractor()
+    found = [p for p in (extractor.feed(c) for c in chunks) if p is not None]
+    return extractor, found
+
+
+@pytest.mark.parametrize("cut", range(1, len(REPLY)))
+def test_any_split_point_finds_the_prompt_once(cut):
+    extractor, found = feed_all([REPLY[:cut], REPLY[cut:]])
+    assert found == [PROMPT]
+    assert extractor.visual_prompt == PROMPT
+
+
+def test_one_character_per_chunk():
+    _, found = feed_all(list(REPLY))
+    assert found == [PROMPT]
+
+
+def test_prompt_is_returned_when_the_object_closes():
+    extractor = VisualPromptExtractor()
+    closing = REPLY.index("} enjoy")
+    assert extractor.feed(REPLY[:closing]) is None
+    assert extractor.feed(REPLY[closing:]) == PROMPT
+    assert extractor.feed(' {"visual_prompt": "another"}') is None  # only the first one counts
+    assert extractor.visual_prompt == PROMPT
+
+
+def test_objects_without_a_prompt_are_skipped():
+    _, found = feed_all(['{"visual_', 'prompt": ""} {"mood": "}"}', ' {"visual_prompt": "cat"}'])
+    assert found == ["cat"]
+
+
+def test_reply_without_json():
+    extractor, found = feed_all(["Sure, ", "tell me more about ", "who it is for."])
+    assert found == [] and extractor.visual_prompt is None
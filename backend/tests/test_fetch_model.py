@@ -0,0 +1,32 @@
+import asyncio
+from pathlib import Path
+
+from app.services.storage import file_digest
+
+
+def glb_key(path):
+    return f"{file_digest(path)}.glb"
+
+
+def test_fetch_model_reads_the_recorded_node_not_a_same_named_file(tmp_path, load_app, monkeypatch):
+    outputs = [tmp_path / "node0", tmp_path / "node1"]
+    for i, out in enumerate(outputs):
+        (out / "mesh").mkdir(parents=True)
+        (out / "mesh" / "ComfyUI_00001_.glb").write_bytes(b"glTF mesh of customer %d" % i)
+    main = load_app(COMFY_URLS="http://127.0.0.1:1,http://127.0.0.1:2",
+                    COMFY_OUTPUT_DIRS=",".join(str(o) for o in outputs))
+    downloads = []
+    monkeypatch.setattr(main.storage, "download", lambda url, dest: downloads.append(url) or Path(dest))
+
+    mine = outputs[1] / "mesh" / "ComfyUI_00001_.glb"
+    key = glb_key(mine)
+    main.comfy_pool.record_output(key, 1, "mesh/ComfyUI_00001_.glb")
+    assert asyncio.run(main.fetch_model(f"https://cdn.test/{key}", tmp_path / "dl.glb")) == mine
+    assert not downloads
+
+    # Unrecorded keys, and files rewritten since they were published, come from R2
+    other = glb_key(outputs[0] / "mesh" / "ComfyUI_00001_.glb")
+    assert asyncio.run(main.fetch_model(f"https://cdn.test/{other}", tmp_path / "dl.glb")) == tmp_path / "dl.glb"
+    mine.write_bytes(b"glTF a later job's mesh")
+    assert asyncio.run(main.fetch_model(f"https://cdn.test/{key}", tmp_path / "dl.glb")) == tmp_path / "dl.glb"
+    assert len(downloads) == 2
@@ -0,0 +1,58 @@
+from pathlib import Path
+import pytest
+
+from app.services import gcode_meta
+from app.services.gcode_meta import parse_duration, read_gcode_stats, read_tail
+
+FIXTURES = Path(__file__).resolve().parent.parent
+
+
+@pytest.mark.parametrize("name, filament_mm, print_time, print_seconds", [
+    ("gift_1798.gcode", 14.54, "34s", 34),
+    ("gift_6300.gcode", 22.09, "46s", 46),
+    ("gift_6762.gcode", 42.65, "1m 20s", 80),
+    ("gift_8037.gcode", 9.04, "24s", 24),
+])
+def test_reads_filament_and_time_from_the_footer(name, filament_mm, print_time, print_seconds):
+    stats = read_gcode_stats(FIXTURES / name)
+    assert stats.filament_mm == filament_mm
+    assert stats.print_time == print_time
+    assert stats.print_seconds == print_seconds
+    assert stats.volume_cm3 > 0
+
+
+def test_config_block_is_kept_apart_from_the_statistics():
+    stats = read_gcode_stats(FIXTURES / "gift_6762.gcode")
+    assert stats.first_layer_time == "6s"
+    assert stats.config["layer_height"] == "0.3" and stats.config["first_layer_height"] == "0.35"
+    assert "prusaslicer_config" not in stats.config
+    assert "estimated printing time (normal mode)" not in stats.config
+    # Last ;Z: before the footer, and the layer count derived from the embedded layer heights
+    assert stats.max_z == 6.35
+    assert stats.layer_count == 21
+
+
+@pytest.mark.parametrize("chunk_size", [64, 1000, 4096])
+def test_small_chunks_read_back_to_the_last_layer(monkeypatch, chunk_size):
+    path = FIXTURES / "gift_6762.gcode"
+    expected = read_gcode_stats(path)
+    monkeypatch.setattr(gcode_meta, "CHUNK_SIZE", chunk_size)
+    tail = read_tail(path)
+    start = tail.rfind(b"; filament used [mm]")
+    assert start != -1 and tail.rfind(b"\n;Z:", 0, start) != -1
+    assert len(tail) < path.stat().st_size  # stopped early, not a full read
+    assert read_gcode_stats(path) == expected
+
+
+def test_missing_footer_reads_at_most_the_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(gcode_meta, "CHUNK_SIZE", 1024)
+    path = tmp_path / "truncated.gcode"
+    path.write_bytes(b"G1 X1 Y1 E0.1\n" * 2000)
+    assert len(read_tail(path, limit=4096)) == 4096
+    stats = read_gcode_stats(path)
+    assert stats.print_time == "Unknown" and stats.print_seconds is None and stats.max_z is None
+
+
+def test_parse_duration():
+    assert parse_duration("1d 2h 3m 4s") == 93784
+    assert parse_duration("Unknown") is None
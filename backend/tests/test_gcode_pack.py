@@ -0,0 +1,97 @@
+import gzip
+import socket
+from pathlib import Path
+from collections import OrderedDict
+import pytest
+
+from app.services.gcode_pack import GzipStream, iter_body
+from app.services.storage import file_digest, storage
+from bench.fakes import s3_server
+
+GCODE = Path(__file__).resolve().parent.parent / "gift_6762.gcode"
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    def iter_chunks(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+def test_gzip_stream_round_trip_in_small_reads():
+    with GzipStream(GCODE, chunk_size=1000) as stream:
+        parts = []
+        while part := stream.read(777):
+            parts.append(part)
+    compressed = b"".join(parts)
+    assert gzip.decompress(compressed) == GCODE.read_bytes()
+    assert stream.raw_bytes == GCODE.stat().st_size
+    assert stream.compressed_bytes == len(compressed) < stream.raw_bytes
+
+
+def test_iter_body_inflates_and_closes():
+    data = GCODE.read_bytes()
+    body = FakeBody(gzip.compress(data))
+    assert b"".join(iter_body(body, inflate=True, chunk_size=500)) == data
+    assert body.closed
+    body = FakeBody(data)
+    assert b"".join(iter_body(body, chunk_size=500)) == data and body.closed
+
+
+@pytest.fixture
+def gcode_client(tmp_path, load_app, monkeypatch):
+    """The production app in front of a moto S3 bucket holding the fixture G-code plain and gzipped."""
+    from fastapi.testclient import TestClient
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = s3_server(port, "bkt-test")
+    for name, value in {"R2_ENDPOINT_URL": f"http://127.0.0.1:{port}", "R2_BUCKET_NAME": "bkt-test",
+                        "R2_ACCESS_KEY_ID": "test", "R2_SECRET_ACCESS_KEY": "test",
+                        "R2_PUBLIC_URL": "https://cdn.test"}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(storage, "_client", None)  # built again against the moto endpoint
+    monkeypatch.setattr(storage, "_pool", None)
+    monkeypatch.setattr(storage, "_known", OrderedDict())
+    # The gzipped upload takes the content key <sha256>.gcode; the plain copy goes under .bgcode
+    digest = file_digest(GCODE)
+    plain = storage.upload_file(GCODE, key=f"{digest}.bgcode").rsplit("/", 1)[-1]
+    zipped = storage.upload_file(GCODE, encoding="gzip").rsplit("/", 1)[-1]
+    main = load_app()
+    try:
+        with TestClient(main.app) as client:
+            yield client, plain, zipped
+    finally:
+        storage.shutdown()
+        server.stop()
+
+
+def test_gcode_download_ranges_and_encodings(gcode_client):
+    client, plain, zipped = gcode_client
+    data = GCODE.read_bytes()
+
+    resp = client.get(f"/api/gcode/{plain}", headers={"Range": "bytes=100-199"})
+    assert resp.status_code == 206
+    assert resp.headers["content-range"] == f"bytes 100-199/{len(data)}"
+    assert resp.content == data[100:200]
+
+    # Gzip-accepting clients get the stored bytes; httpx inflates them here
+    resp = client.get(f"/api/gcode/{zipped}", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200 and resp.headers["content-encoding"] == "gzip"
+    assert int(resp.headers["content-length"]) < len(data)
+    assert resp.content == data
+
+    # Others get the whole file inflated, whatever range they asked for
+    resp = client.get(f"/api/gcode/{zipped}", headers={"Accept-Encoding": "identity", "Range": "bytes=0-9"})
+    assert resp.status_code == 200 and "content-encoding" not in resp.headers
+    assert resp.content == data
+
+    assert client.get(f"/api/gcode/{plain}", headers={"Range": f"bytes={len(data) + 10}-"}).status_code == 416
+    assert client.get(f"/api/gcode/{'0' * 64}.gcode").status_code == 404
+    assert client.get("/api/gcode/not-a-key.gcode").status_code == 404
@@ -0,0 +1,73 @@
+import asyncio
+
+from app.services import gpu_scheduler
+from app.services.gpu_scheduler import GpuScheduler
+
+
+class QueueResponse:
+    def json(self):
+        return {"queue_running": [], "queue_pending": []}
+
+
+def scheduler(monkeypatch, sent):
+    async def comfy(method, path, node=0, **kw):
+        return QueueResponse()
+
+    async def submit_prompt(workflow, node):
+        sent.append(workflow["name"])
+        return f"prompt-{workflow['name']}"
+
+    monkeypatch.setattr(gpu_scheduler.http_pool, "comfy", comfy)
+    return GpuScheduler(submit_prompt, max_inflight=4, poll_interval=0.01)
+
+
+async def wait_until(check, timeout=2):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not check():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_slow_prepare_does_not_hold_up_other_jobs(monkeypatch):
+    sent = []
+    release = None
+
+    async def slow_bridge(job):
+        await release.wait()
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        gpu = scheduler(monkeypatch, sent)
+        gpu.start()
+        slow = gpu.submit("3d", {"name": "slow"}, slow_bridge)
+        fast = gpu.submit("3d", {"name": "fast"})
+        await wait_until(lambda: fast.status == "submitted")
+        assert slow.status == "preparing" and gpu.status(slow) == {"status": "queued", "position": 1}
+        assert gpu.backlog() == 1
+        release.set()
+        await wait_until(lambda: slow.status == "submitted")
+        await gpu.stop()
+
+    asyncio.run(run())
+    assert sent == ["fast", "slow"]
+
+
+def test_failed_prepare_fails_the_job_without_sending_it(monkeypatch):
+    sent = []
+
+    async def broken_bridge(job):
+        raise OSError("upload failed")
+
+    async def run():
+        gpu = scheduler(monkeypatch, sent)
+        gpu.start()
+        job = gpu.submit("3d", {"name": "broken"}, broken_bridge)
+        await wait_until(lambda: job.status == "failed")
+        await gpu.stop()
+        return job, gpu
+
+    job, gpu = asyncio.run(run())
+    assert sent == [] and job.error == "upload failed"
+    assert gpu.status(job) == {"status": "failed", "message": "upload failed"}
+    assert gpu.backlog() == 0
@@ -0,0 +1,82 @@
+import asyncio
+
+from app.services.job_events import JobEventHub
+
+
+def connected_hub():
+    """A hub whose (fake) feed is up but never delivers the job's events."""
+    hub = JobEventHub()
+    hub._tasks = ["feed"]
+    hub._connected = {"feed"}
+    return hub
+
+
+async def collect(stream, limit=20):
+    frames = []
+    async for frame in stream:
+        frames.append(frame)
+        if len(frames) >= limit: break
+    return frames
+
+
+def test_stream_ends_when_the_completion_event_was_missed():
+    hub = connected_hub()
+    calls = []
+
+    async def resolve(job_id):
+        calls.append(job_id)
+        return {"status": "completed" if len(calls) >= 3 else "processing"}
+
+    frames = asyncio.run(collect(hub.stream("job", resolve, keepalive=0.01)))
+    assert hub.connected
+    assert frames[-1].startswith("event: completed")
+    assert sum(f == ": keepalive\n\n" for f in frames) == 1
+    assert len(calls) == 3
+
+
+def test_stream_forwards_events_and_resolves_after_finished():
+    hub = connected_hub()
+    done = []
+
+    async def resolve(job_id):
+        return {"status": "completed"} if done else {"status": "processing"}
+
+    async def feed():
+        await asyncio.sleep(0.05)
+        hub._emit("job", {"type": "progress", "node": "3", "value": 1, "max": 2})
+        done.append(True)
+        hub._emit("job", {"type": "finished"})
+
+    async def run():
+        task = asyncio.create_task(feed())
+        frames = await collect(hub.stream("job", resolve, keepalive=5))
+        await task
+        return frames
+
+    frames = asyncio.run(run())
+    assert [f.split("\n")[0] for f in frames] == ["event: queued", "event: progress", "event: completed"]
+
+
+def test_stream_follows_a_completed_result_with_its_lods():
+    from app.services import lods
+    hub = connected_hub()
+    stored = []
+
+    async def build():
+        await asyncio.sleep(0.05)
+        return [{"level": 0, "url": "lod0.glb"}]
+
+    async def run():
+        result = {"status": "completed", "images": ["mesh.glb"]}
+        lods.attach_later(result, build(), on_done=lambda r: (stored.append(dict(r)), hub.publish("job", {"type": "lods"})))
+
+        async def resolve(job_id):
+            return result
+
+        return await collect(hub.stream("job", resolve, settle_interval=5))
+
+    frames = asyncio.run(run())
+    assert [f.split("\n")[0] for f in frames] == ["event: completed", "event: lods"]
+    assert '"lods_status": "pending"' in frames[0]
+    assert '"lods_status": "ready"' in frames[1] and "lod0.glb" in frames[1]
+    assert stored[0]["lods_status"] == "ready"
@@ -0,0 +1,54 @@
+import numpy as np
+
+from app.services.mesh import Pedestal, decimate, mesh_stats, orient_shells, prepare_print, shell_labels
+from app.services.mesh import load_stl
+from bench.fakes import CUBE_FACES, CUBE_VERTICES
+
+
+def cube(size, at=(0, 0, 0)):
+    """Outward-wound cube triangles."""
+    v = np.array(CUBE_VERTICES, dtype=np.float64) * size + np.array(at, dtype=np.float64)
+    return v[np.array(CUBE_FACES)]
+
+
+def test_shell_labels_split_disjoint_parts():
+    vertices, faces = decimate(np.concatenate([cube(10), cube(10, (30, 0, 0)), cube(5, (0, 30, 0))]), 1000)
+    labels = shell_labels(faces, len(vertices))
+    assert len(np.unique(labels)) == 3
+    assert sorted(np.bincount(labels)) == [12, 12, 12]
+
+
+def test_orient_shells_flips_only_inverted_shells():
+    inverted = cube(10, (30, 0, 0))[:, ::-1]
+    vertices, faces = decimate(np.concatenate([cube(10), inverted]), 1000)
+    assert mesh_stats(vertices[faces]).volume_cm3 < 0.01  # +1 cm3 and -1 cm3 cancel out
+    oriented = orient_shells(vertices, faces)
+    assert abs(mesh_stats(vertices[oriented]).volume_cm3 - 2.0) < 1e-9
+
+
+def test_prepare_print_adds_inverted_model_to_base(tmp_path):
+    # An inside-out model must not subtract its volume from the base
+    model = np.concatenate([cube(10), cube(10, (20, 0, 0))[:, ::-1]])
+    base = Pedestal(shape="box", width=60, depth=60, height=10, offset=10)
+    stats, source = prepare_print(model, tmp_path / "print.stl", base, 1000)
+    # Model is fitted to 42 mm wide: two 14 mm cubes (2.744 cm3 each) on a 36 cm3 base
+    assert source == 24
+    assert abs(stats.volume_cm3 - (36.0 + 2 * 2.744)) < 1e-6
+    written = np.asarray(load_stl(tmp_path / "print.stl"), dtype=np.float64)
+    assert abs(mesh_stats(written).volume_cm3 - stats.volume_cm3) < 1e-3
+
+
+def test_model_offset_moves_the_model_like_the_viewer(tmp_path):
+    # ModelViewer.js places the model at (0, offset, modelZOffset) in its Y-up scene
+    from app.services.gltf import Y_UP_TO_Z_UP, encode_glb, load_glb
+    v = cube(1.0)
+    vertices, faces = v.reshape(-1, 3), np.arange(len(v) * 3).reshape(-1, 3)
+    (tmp_path / "model.glb").write_bytes(encode_glb(vertices, faces))
+    base = Pedestal(shape="box", width=60, depth=60, height=10, offset=10, modelZOffset=8)
+    prepare_print(load_glb(tmp_path / "model.glb"), tmp_path / "print.stl", base, 1000)
+
+    model = np.asarray(load_stl(tmp_path / "print.stl"), dtype=np.float64)[:-12].reshape(-1, 3)  # base is last
+    lo, hi = model.min(axis=0), model.max(axis=0)
+    expected = Y_UP_TO_Z_UP @ np.array([0.0, base.offset, base.modelZOffset])
+    assert np.allclose([(lo[0] + hi[0]) / 2, (lo[1] + hi[1]) / 2, lo[2]], expected, atol=1e-3)
+    assert (lo[1] + hi[1]) / 2 < 0  # front of the viewer is -Y on the bed
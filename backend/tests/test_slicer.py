@@ -0,0 +1,158 @@
+import time
+import hashlib
+import asyncio
+from pathlib import Path
+import pytest
+
+from app.services.slicer import SliceScheduler, SlicerBusy, SliceError
+from app.services.gcode_meta import read_gcode_stats
+from bench.fakes import cube_stl, slicer_launcher
+
+
+def make_job_files(directory, name):
+    stl = Path(directory) / f"temp_{name}.stl"
+    stl.write_bytes(cube_stl(20))
+    return stl, Path(directory) / f"gift_{name}.gcode"
+
+
+def scheduler(launcher, **opts):
+    def build(job):
+        return [launcher, "--export-gcode", "--output", str(job.gcode_path), str(job.stl_path)]
+
+    async def finish(job, stderr):
+        if not Path(job.gcode_path).exists(): raise SliceError("Slicer failed to create G-code.")
+        return {"print_seconds": read_gcode_stats(job.gcode_path).print_seconds}
+
+    return SliceScheduler(build, finish, **opts)
+
+
+async def wait_gone(*paths, timeout=5):
+    deadline = time.monotonic() + timeout
+    while any(Path(p).exists() for p in paths) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+def test_success_cleans_up_scratch_files(stub_slicer, tmp_path):
+    async def run():
+        slicer = scheduler(stub_slicer, workers=1)
+        await slicer.start()
+        stl, gcode = make_job_files(tmp_path, "ok")
+        job = slicer.submit(stl, gcode)
+        await asyncio.wait_for(job.done.wait(), 10)
+        await wait_gone(stl, gcode)
+        await slicer.stop()
+        return job, stl, gcode
+
+    job, stl, gcode = asyncio.run(run())
+    assert job.status == "success"
+    assert job.result["print_seconds"] > 0
+    assert not stl.exists() and not gcode.exists()
+
+
+def test_timeout_kills_the_slicer(stub_slicer, tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_SLICER_DELAY", "30")
+
+    async def run():
+        slicer = scheduler(stub_slicer, workers=1, timeout=0.5)
+        await slicer.start()
+        stl, gcode = make_job_files(tmp_path, "slow")
+        started = time.monotonic()
+        job = slicer.submit(stl, gcode)
+        await asyncio.wait_for(job.done.wait(), 10)
+        elapsed = time.monotonic() - started
+        await wait_gone(stl, gcode)
+        await slicer.stop()
+        return job, elapsed, stl, gcode
+
+    job, elapsed, stl, gcode = asyncio.run(run())
+    assert job.status == "error"
+    assert "timed out" in job.error
+    assert elapsed < 5  # killed, not waited out
+    assert not stl.exists() and not gcode.exists()
+
+
+def test_cancel_running_and_queued_jobs(stub_slicer, tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_SLICER_DELAY", "30")
+
+    async def run():
+        slicer = scheduler(stub_slicer, workers=1, max_queue=4)
+        await slicer.start()
+        running = slicer.submit(*make_job_files(tmp_path, "a"))
+        queued = slicer.submit(*make_job_files(tmp_path, "b"))
+        while running.status != "running":
+            await asyncio.sleep(0.05)
+        assert slicer.cancel(queued.id)
+        assert slicer.cancel(running.id)
+        assert not slicer.cancel(running.id)  # already finished
+        started = time.monotonic()
+        await wait_gone(*tmp_path.glob("temp_*.stl"))
+        waited = time.monotonic() - started
+        await slicer.stop()
+        return running, queued, waited
+
+    running, queued, waited = asyncio.run(run())
+    assert running.status == "cancelled" and queued.status == "cancelled"
+    assert waited < 5
+    assert not list(tmp_path.glob("temp_*.stl")) and not list(tmp_path.glob("gift_*.gcode"))
+
+
+def test_full_queue_refuses_new_jobs(stub_slicer, tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_SLICER_DELAY", "30")
+
+    async def run():
+        slicer = scheduler(stub_slicer, workers=1, max_queue=1)
+        await slicer.start()
+        first = slicer.submit(*make_job_files(tmp_path, "1"))
+        while first.status != "running":
+            await asyncio.sleep(0.05)
+        second = slicer.submit(*make_job_files(tmp_path, "2"))
+        assert slicer.full()
+        with pytest.raises(SlicerBusy):
+            slicer.submit(*make_job_files(tmp_path, "3"))
+        slicer.cancel(first.id)
+        slicer.cancel(second.id)
+        await slicer.stop()
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def app_client(tmp_path, load_app):
+    """The production app with a one-worker, one-slot slicer queue and a slow stub slicer."""
+    from fastapi.testclient import TestClient
+    main = load_app(PRUSA_PATH=slicer_launcher(tmp_path), STUB_SLICER_DELAY=30, SLICER_WORKERS=1, SLICER_QUEUE_SIZE=1)
+    with TestClient(main.app) as client:
+        yield client, tmp_path / "scratch", main
+
+
+def test_slice_jobs_endpoint_returns_503_when_full(app_client):
+    client, scratch, main = app_client
+
+    def upload(size):
+        return client.post("/api/slice/jobs", files={"file": ("gift.stl", cube_stl(size), "model/stl")})
+
+    first, second = upload(20), upload(21)
+    assert first.status_code == 200 and second.status_code == 200
+    deadline = time.monotonic() + 5
+    while client.get(f"/api/slice/jobs/{first.json()['job_id']}").json()["status"] != "running":
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    third = upload(22)
+    assert third.status_code == 503
+
+    # A mesh already in the slice cache is still quoted while the queue is full
+    sha256 = hashlib.sha256(cube_stl(23)).hexdigest()
+    quote = {"gcode_url": "https://cdn.test/x.gcode", "weight": 12.5, "print_time": "1h 0m", "print_seconds": 3600, "price": 9.5}
+    main.slice_cache.put(main.SliceCache.make_key(sha256, main.CONFIG_PATH, [main.PRUSA_PATH, *main.SLICER_ARGS]), quote)
+    cached = upload(23)
+    assert cached.status_code == 200
+    assert cached.json()["status"] == "success" and cached.json()["cached"] and cached.json()["price"] == 9.5
+
+    for resp in (first, second):
+        assert client.delete(f"/api/slice/jobs/{resp.json()['job_id']}").status_code == 200
+    assert client.get(f"/api/slice/jobs/{first.json()['job_id']}").json()["status"] == "cancelled"
+    deadline = time.monotonic() + 5
+    while list(scratch.glob("temp_*.stl")) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not list(scratch.glob("temp_*.stl"))
+    assert not list(scratch.glob("gift_*.gcode"))
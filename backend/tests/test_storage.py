@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+from app.services.storage import R2Storage
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.heads = 0
+        self.uploads = 0
+        self.lock = threading.Lock()
+
+    def head_object(self, Bucket, Key):
+        with self.lock:
+            self.heads += 1
+            if Key not in self.objects:
+                raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+            return {"Metadata": self.objects[Key]}
+
+    def upload_file(self, path, bucket, key, ExtraArgs, Config):
+        with self.lock:
+            self.uploads += 1
+            self.objects[key] = ExtraArgs["Metadata"]
+
+
+def make_storage(max_known):
+    store = R2Storage(max_workers=4, max_known=max_known)
+    store._client = FakeS3()
+    store._pool = ThreadPoolExecutor(max_workers=4)
+    return store
+
+
+def test_known_keys_and_locks_stay_bounded(tmp_path, monkeypatch):
+    monkeypatch.setenv("R2_PUBLIC_URL", "https://cdn.test")
+    store = make_storage(max_known=8)
+    paths = []
+    for i in range(50):
+        path = tmp_path / f"ComfyUI_{i:05}_.png"
+        path.write_bytes(b"image %d" % i)
+        paths.append(path)
+
+    urls = [store.upload_file(p) for p in paths]
+    assert all(urls) and store._client.uploads == 50
+    assert len(store._known) == 8
+    assert not store._key_locks
+
+    # An evicted key is found again with one HEAD and is not re-uploaded
+    assert store.upload_file(paths[0]) == urls[0]
+    assert store._client.uploads == 50
+
+
+def test_concurrent_uploads_of_one_file_upload_once(tmp_path, monkeypatch):
+    monkeypatch.setenv("R2_PUBLIC_URL", "https://cdn.test")
+    store = make_storage(max_known=8)
+    path = tmp_path / "same.glb"
+    path.write_bytes(b"glTF" * 1000)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        urls = set(pool.map(lambda _: store.upload_file(path), range(32)))
+    assert len(urls) == 1 and store._client.uploads == 1
+    assert not store._key_locks
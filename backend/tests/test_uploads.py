@@ -0,0 +1,64 @@
+import os
+import asyncio
+import pytest
+from starlette.datastructures import Headers
+
+from app.services.uploads import UploadRejected, limit_upload_size, spool_upload
+from bench.fakes import cube_stl
+
+
+class FakeUpload:
+    def __init__(self, data):
+        self.data = data
+
+    async def read(self, size):
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+def spool(data, tmp_path, **limits):
+    return asyncio.run(spool_upload(FakeUpload(data), tmp_path / "upload.stl", **limits))
+
+
+def rejected(data, tmp_path, **limits):
+    with pytest.raises(UploadRejected) as e:
+        spool(data, tmp_path, **limits)
+    assert not (tmp_path / "upload.stl").exists()
+    return e.value.status_code
+
+
+def test_valid_binary_stl(tmp_path):
+    upload = spool(cube_stl(20), tmp_path)
+    assert upload.triangles == 12 and upload.binary
+
+
+def test_garbage_is_422_not_413(tmp_path):
+    assert rejected(os.urandom(4096), tmp_path) == 422
+    assert rejected(b"\xff" * 200, tmp_path) == 422  # header announces ~4 billion triangles
+    assert rejected(b"", tmp_path) == 422
+
+
+def test_too_many_triangles_is_413(tmp_path):
+    assert rejected(cube_stl(20), tmp_path, max_triangles=10) == 413
+
+
+def test_too_many_bytes_is_413(tmp_path):
+    assert rejected(cube_stl(20), tmp_path, max_bytes=300) == 413
+
+
+class FakeRequest:
+    def __init__(self, length, content_type="multipart/form-data; boundary=x"):
+        self.method = "POST"
+        self.headers = Headers({"content-length": str(length), "content-type": content_type})
+
+
+def test_content_length_checked_before_the_body(monkeypatch):
+    monkeypatch.setenv("MAX_UPLOAD_BYTES", str(1024 * 1024))
+
+    async def call_next(request):
+        return "passed"
+
+    too_big = asyncio.run(limit_upload_size(FakeRequest(10 * 1024 * 1024), call_next))
+    assert too_big.status_code == 413
+    assert asyncio.run(limit_upload_size(FakeRequest(1024 * 1024), call_next)) == "passed"
+    assert asyncio.run(limit_upload_size(FakeRequest(10 * 1024 * 1024, "application/json"), call_next)) == "passed"